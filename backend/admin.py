@@ -2,7 +2,7 @@
 Admin Panel Module
 Handles administration features: users, providers, stats, subscriptions
 """
-from fastapi import APIRouter, HTTPException, Request, Response, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, Depends, Query
 from pydantic import BaseModel
 from datetime import datetime, timezone, timedelta
 import uuid
@@ -10,6 +10,14 @@ import bcrypt
 import os
 from typing import Optional
 
+import rollups
+import realtime
+import moderation
+import settings_service
+import bootstrap
+import http_cache
+import provider_page
+
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
 
@@ -205,68 +213,197 @@ async def get_admin_me(admin: dict = Depends(get_admin_user)):
 
 @router.get("/stats")
 async def get_admin_stats(admin: dict = Depends(get_admin_user)):
-    """Get dashboard statistics"""
-    db = get_db()
-    
+    """Get dashboard statistics (read from the monthly rollups)"""
     now = datetime.now(timezone.utc)
     month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    # Total counts
-    total_users = await db.users.count_documents({})
-    total_providers = await db.provider_profiles.count_documents({})
-    total_clients = await db.users.count_documents({"user_type": "client"})
-    total_bookings = await db.bookings.count_documents({})
-    
-    # This month stats
-    new_users_this_month = await db.users.count_documents({
-        "created_at": {"$gte": month_start.isoformat()}
-    })
-    new_bookings_this_month = await db.bookings.count_documents({
-        "created_at": {"$gte": month_start.isoformat()}
-    })
-    
-    # Revenue calculation
-    payments = await db.payment_transactions.find({
-        "payment_status": "paid"
-    }, {"_id": 0, "amount": 1, "created_at": 1}).to_list(10000)
-    
-    total_revenue = sum(p.get("amount", 0) for p in payments)
-    
-    revenue_this_month = sum(
-        p.get("amount", 0) for p in payments 
-        if p.get("created_at", "") >= month_start.isoformat()
-    )
+    totals = await rollups.get_totals()
+    this_month = await rollups.get_totals(since_month=month_start.strftime("%Y-%m"))
     
-    # Subscription stats
-    subscriptions = await db.subscriptions.find(
-        {"status": "active"},
-        {"_id": 0, "plan_id": 1}
-    ).to_list(1000)
+    total_providers = totals.get("new_providers", 0)
     
+    # Active subscriptions per plan = started - ended
+    started = totals.get("subscriptions_started", {})
+    ended = totals.get("subscriptions_ended", {})
     subscription_counts = {"free": 0, "pro": 0, "premium": 0}
-    for sub in subscriptions:
-        plan = sub.get("plan_id", "free")
+    providers_with_sub = 0
+    for plan in set(started) | set(ended):
+        active = started.get(plan, 0) - ended.get(plan, 0)
+        providers_with_sub += active
         if plan in subscription_counts:
-            subscription_counts[plan] += 1
+            subscription_counts[plan] += active
     
     # Providers without active subscription = free
-    providers_with_sub = len(subscriptions)
     subscription_counts["free"] = total_providers - providers_with_sub
     
     return {
-        "total_users": total_users,
+        "total_users": totals.get("new_users", 0),
         "total_providers": total_providers,
-        "total_clients": total_clients,
-        "total_bookings": total_bookings,
-        "total_revenue": total_revenue,
-        "new_users_this_month": new_users_this_month,
-        "new_bookings_this_month": new_bookings_this_month,
-        "revenue_this_month": revenue_this_month,
+        "total_clients": totals.get("new_users_by_type", {}).get("client", 0),
+        "total_bookings": totals.get("new_bookings", 0),
+        "total_revenue": round(totals.get("revenue", 0), 2),
+        "new_users_this_month": this_month.get("new_users", 0),
+        "new_bookings_this_month": this_month.get("new_bookings", 0),
+        "revenue_this_month": round(this_month.get("revenue", 0), 2),
         "active_subscriptions": subscription_counts,
         "month": month_start.strftime("%B %Y")
     }
 
 
+@router.get("/stats/daily")
+async def get_daily_stats(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    """Get day-by-day counters between two YYYY-MM-DD dates (default: last 30 days)"""
+    today = datetime.now(timezone.utc)
+    end = end or today.strftime("%Y-%m-%d")
+    start = start or (today - timedelta(days=29)).strftime("%Y-%m-%d")
+    
+    return {"start": start, "end": end, "days": await rollups.get_daily_stats(start, end)}
+
+
+@router.get("/analytics")
+async def get_analytics(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: str = "day",
+    admin: dict = Depends(get_admin_user)
+):
+    """Get signups, bookings, GMV, commission and revenue series (day, week or month)"""
+    import analytics
+    
+    if granularity not in analytics.GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Granularité invalide (day, week, month)")
+    
+    today = datetime.now(timezone.utc)
+    try:
+        end_date = datetime.strptime(end, "%Y-%m-%d") if end else today
+        start_date = datetime.strptime(start, "%Y-%m-%d") if start else end_date - timedelta(days=89)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates invalides (format AAAA-MM-JJ)")
+    
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="La date de début doit précéder la date de fin")
+    if (end_date - start_date).days > 366 * 5:
+        raise HTTPException(status_code=400, detail="Période limitée à 5 ans")
+    
+    return await analytics.get_analytics(
+        start_date.strftime("%Y-%m-%d"),
+        end_date.strftime("%Y-%m-%d"),
+        granularity
+    )
+
+
+@router.post("/stats/rebuild")
+async def rebuild_stats(admin: dict = Depends(get_admin_user)):
+    """Recompute the stats rollups from the source collections"""
+    import analytics
+    result = await rollups.rebuild_rollups()
+    analytics.clear_cache()
+    return {"success": True, **result}
+
+
+@router.post("/stats/review-stats/rebuild")
+async def rebuild_review_stats(admin: dict = Depends(get_admin_user)):
+    """Recompute every provider's review stats and rating from the reviews"""
+    import review_stats
+    result = await review_stats.reconcile()
+    await http_cache.invalidate("/api/providers/")
+    return {"success": True, **result}
+
+
+@router.get("/stats/payment-gateway")
+async def get_payment_gateway_stats(admin: dict = Depends(get_admin_user)):
+    """Get payment gateway call latency, error counts and circuit state"""
+    from payment_gateway import get_payment_gateway
+    return get_payment_gateway().stats()
+
+
+@router.get("/stats/message-pipeline")
+async def get_message_pipeline_stats(admin: dict = Depends(get_admin_user)):
+    """Get message post-processing queue depth, retries and failures"""
+    import message_pipeline
+    return message_pipeline.stats()
+
+
+@router.get("/stats/message-notifications")
+async def get_message_notification_stats(admin: dict = Depends(get_admin_user)):
+    """Get chat email notifications sent, coalesced and suppressed"""
+    import message_notifications
+    return await message_notifications.stats()
+
+
+@router.get("/stats/email-transport")
+async def get_email_transport_stats(admin: dict = Depends(get_admin_user)):
+    """Get SMTP emails sent, failures and pooled connections"""
+    import smtp_transport
+    return smtp_transport.stats()
+
+
+@router.get("/stats/settings")
+async def get_settings_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Get the in-memory settings version, reloads and loaded keys"""
+    return settings_service.stats()
+
+
+@router.get("/stats/http-cache")
+async def get_http_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Get public response cache hits, misses, coalesced fetches and 304s"""
+    import http_cache
+    return http_cache.stats()
+
+
+@router.get("/stats/bootstrap")
+async def get_bootstrap_stats(admin: dict = Depends(get_admin_user)):
+    """Get homepage bootstrap builds, size and 304s"""
+    return bootstrap.stats()
+
+
+@router.get("/stats/view-counters")
+async def get_view_counter_stats(admin: dict = Depends(get_admin_user)):
+    """Get buffered view counts: pending, flushed, lost and bulk writes"""
+    import counters
+    return counters.stats()
+
+
+@router.get("/stats/views/{kind}/{item_id}")
+async def get_daily_views(
+    kind: str,
+    item_id: str,
+    days: int = Query(30, ge=1, le=365),
+    admin: dict = Depends(get_admin_user)
+):
+    """Get the daily views of a portfolio item, provider, event or marketplace item"""
+    import counters
+    if kind not in {buffer.kind for buffer in counters.BUFFERS}:
+        raise HTTPException(status_code=400, detail="Type invalide")
+    return {"kind": kind, "item_id": item_id, "days": await counters.get_daily(kind, item_id, days)}
+
+
+@router.get("/email-outbox")
+async def get_email_outbox(admin: dict = Depends(get_admin_user)):
+    """Get email outbox depth by status, worker counters and dead letters"""
+    import email_outbox
+    return await email_outbox.status()
+
+
+@router.post("/email-outbox/{email_id}/retry")
+async def retry_outbox_email(email_id: str, admin: dict = Depends(get_admin_user)):
+    """Requeue a dead-lettered email"""
+    import email_outbox
+    if not await email_outbox.retry(email_id):
+        raise HTTPException(status_code=404, detail="Email introuvable ou pas en échec définitif")
+    return {"message": "Email remis en file d'envoi"}
+
+
+@router.get("/stats/realtime")
+async def get_realtime_stats(admin: dict = Depends(get_admin_user)):
+    """Get this worker's socket counts and typing-indicator counters"""
+    return realtime.stats()
+
+
 # ============ USERS MANAGEMENT ============
 
 @router.get("/users")
@@ -409,6 +546,7 @@ async def block_user(user_id: str, admin: dict = Depends(get_admin_user)):
     # Invalidate user sessions
     if not is_blocked:  # If blocking
         await db.user_sessions.delete_many({"user_id": user_id})
+        await realtime.disconnect_sockets(user_id)
     
     return {
         "success": True,
@@ -438,13 +576,16 @@ async def delete_user(user_id: str, admin: dict = Depends(get_admin_user)):
         await db.provider_packs.delete_many({"provider_id": provider_id})
         await db.subscriptions.delete_many({"provider_id": provider_id})
         await db.provider_profiles.delete_one({"provider_id": provider_id})
+        await provider_page.invalidate(provider_id)
     
     # Delete user data
     await db.bookings.delete_many({"$or": [{"client_id": user_id}, {"provider_id": provider.get("provider_id") if provider else None}]})
     await db.messages.delete_many({"$or": [{"sender_id": user_id}, {"receiver_id": user_id}]})
+    await db.conversations.delete_many({"participants": user_id})
     await db.favorites.delete_many({"user_id": user_id})
     await db.quote_requests.delete_many({"client_id": user_id})
     await db.user_sessions.delete_many({"user_id": user_id})
+    await realtime.disconnect_sockets(user_id)
     await db.users.delete_one({"user_id": user_id})
     
     return {"success": True, "message": "Utilisateur supprimé"}
@@ -488,30 +629,15 @@ async def send_profile_reminder(
         raise HTTPException(status_code=400, detail="Sujet et message requis")
     
     # Format email as HTML
-    html_content = f"""
-    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-        <div style="background: linear-gradient(135deg, #c9a227 0%, #d4af37 100%); padding: 20px; text-align: center;">
-            <h1 style="color: white; margin: 0;">Je Suis</h1>
-        </div>
-        <div style="padding: 30px; background: #f9f9f9;">
-            <p>Bonjour <strong>{name}</strong>,</p>
-            <div style="white-space: pre-line;">{message}</div>
-            <div style="margin-top: 30px; text-align: center;">
-                <a href="https://jesuisapp.cloud/login" style="background: #c9a227; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; display: inline-block;">
-                    Se connecter
-                </a>
-            </div>
-        </div>
-        <div style="padding: 20px; text-align: center; color: #666; font-size: 12px;">
-            <p>L'équipe Je Suis</p>
-        </div>
-    </div>
-    """
+    import email_templates
+    html_content, text_content = email_templates.render(
+        "profile_reminder.html", layout="notice", name=name, message=message
+    )
     
     # Try to send email
     try:
         from email_service import send_email
-        await send_email(email, subject, html_content)
+        await send_email(email, subject, html_content, text_content)
         
         # Log the reminder
         await db.admin_actions.insert_one({
@@ -593,6 +719,7 @@ async def verify_provider(provider_id: str, admin: dict = Depends(get_admin_user
         {"provider_id": provider_id},
         {"$set": {"verified": not is_verified}}
     )
+    await provider_page.invalidate(provider_id)
     
     return {
         "success": True,
@@ -672,6 +799,16 @@ async def update_subscription(
             {"subscription_id": subscription_id},
             {"$set": update_fields}
         )
+        
+        old_plan = subscription.get("plan_id")
+        new_plan = update_fields.get("plan_id", old_plan)
+        was_active = subscription.get("status") == "active"
+        is_active = update_fields.get("status", subscription.get("status")) == "active"
+        changed_plan = new_plan != old_plan
+        await rollups.record_subscription_change(
+            started_plan=new_plan if is_active and (not was_active or changed_plan) else None,
+            ended_plan=old_plan if was_active and (not is_active or changed_plan) else None
+        )
     
     return {"success": True, "message": "Abonnement mis à jour"}
 
@@ -738,6 +875,7 @@ async def update_commission_settings(request: Request, admin: dict = Depends(get
         {"$set": {"key": "commission", "value": {"enabled": enabled, "rate": rate}}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"message": "Paramètres de commission mis à jour", "enabled": enabled, "rate": rate}
 
@@ -818,6 +956,7 @@ async def add_category(mode: str, request: Request, admin: dict = Depends(get_ad
         {"$set": {"key": key, "value": categories}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"message": "Catégorie ajoutée", "category": new_category}
 
@@ -849,6 +988,7 @@ async def update_category_image(mode: str, category_id: str, request: Request, a
         {"$set": {"value": categories}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"message": "Image mise à jour"}
 
@@ -875,6 +1015,7 @@ async def delete_category(mode: str, category_id: str, admin: dict = Depends(get
         {"$set": {"key": key, "value": categories}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"message": "Catégorie supprimée"}
 
@@ -936,10 +1077,12 @@ async def approve_category_suggestion(
                 {"key": key},
                 {"$set": {"value": categories}}
             )
+            await settings_service.notify_changed()
     else:
         # Create new categories list with this category
         categories = [{"id": category_id, "name": category_name, "icon": category_icon}]
         await db.site_settings.insert_one({"key": key, "value": categories})
+        await settings_service.notify_changed()
     
     # Update suggestion status
     await db.category_suggestions.update_one(
@@ -1035,6 +1178,10 @@ async def delete_pack_admin(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Pack non trouvé")
+    # The pack's provider is unknown here: drop every cached provider page
+    await http_cache.invalidate("/api/packages" if pack_type == "event" else "/api/packs")
+    bootstrap.mark_stale()
+    await http_cache.invalidate("/api/providers/")
     
     return {"success": True, "message": "Pack supprimé"}
 
@@ -1097,6 +1244,8 @@ async def delete_community_event_admin(
     # Also delete associated likes and comments
     await db.event_likes.delete_many({"event_id": event_id})
     await db.event_comments.delete_many({"event_id": event_id})
+    await http_cache.invalidate("/api/events")
+    bootstrap.mark_stale()
     
     return {"success": True, "message": "Événement supprimé"}
 
@@ -1123,6 +1272,8 @@ async def update_community_event_status(
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Événement non trouvé")
+    await http_cache.invalidate("/api/events")
+    bootstrap.mark_stale()
     
     return {"success": True, "message": f"Statut mis à jour: {new_status}"}
 
@@ -1216,21 +1367,7 @@ async def get_site_content(admin: dict = Depends(get_admin_user)):
 # ============ CHAT MODERATION ============
 
 # Default inappropriate keywords (can be customized via admin)
-DEFAULT_FLAGGED_KEYWORDS = [
-    # Contact hors plateforme
-    "whatsapp", "telegram", "signal", "viber", "skype",
-    "mon numéro", "mon numero", "appelle-moi", "appelle moi",
-    "contacte-moi", "contacte moi", "mon email", "mon mail",
-    "hors plateforme", "en dehors", "sans passer par",
-    # Paiement hors plateforme
-    "virement", "espèces", "cash", "liquide", "paypal direct",
-    "paiement direct", "sans commission", "éviter les frais",
-    # Contenu inapproprié
-    "arnaque", "escroquerie", "faux", "frauduleux",
-    # Mots vulgaires/offensants (basiques)
-    "merde", "putain", "connard", "salaud", "enculé",
-    "nique", "fdp", "ntm", "tg", "ferme ta gueule"
-]
+DEFAULT_FLAGGED_KEYWORDS = moderation.DEFAULT_FLAGGED_KEYWORDS
 
 
 @router.get("/moderation/keywords")
@@ -1247,6 +1384,8 @@ async def get_moderation_keywords(admin: dict = Depends(get_admin_user)):
             "enabled": True
         }
         await db.moderation_config.insert_one(config)
+        config.pop("_id", None)
+        await settings_service.notify_changed()
     
     return config
 
@@ -1270,6 +1409,7 @@ async def update_moderation_keywords(request: Request, admin: dict = Depends(get
         }},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"success": True, "message": "Mots-clés mis à jour"}
 
@@ -1406,6 +1546,7 @@ async def block_user_from_moderation(
     
     # Invalidate sessions
     await db.user_sessions.delete_many({"user_id": user_id})
+    await realtime.disconnect_sockets(user_id)
     
     return {"success": True, "message": "Utilisateur bloqué"}
 
@@ -1413,22 +1554,10 @@ async def block_user_from_moderation(
 # Function to check and flag messages (called from message sending)
 async def check_message_for_moderation(message_data: dict):
     """Check a message for inappropriate content and flag if needed"""
-    from server import db
-    
-    # Get moderation config
-    config = await db.moderation_config.find_one({"type": "keywords"})
-    
-    if not config or not config.get("enabled", True):
-        return None
-    
-    keywords = config.get("keywords", DEFAULT_FLAGGED_KEYWORDS)
-    content = message_data.get("content", "").lower()
+    db = get_db()
     
-    # Check for flagged keywords
-    found_keywords = []
-    for keyword in keywords:
-        if keyword.lower() in content:
-            found_keywords.append(keyword)
+    # Cached automaton over the configured keywords (no config read per message)
+    found_keywords = await moderation.find_keywords(message_data.get("content", ""))
     
     if found_keywords:
         # Create flag entry
@@ -1550,6 +1679,14 @@ async def get_all_recent_messages(
     }
 
 
+@router.post("/moderation/rebuild-conversations")
+async def rebuild_conversation_summaries(admin: dict = Depends(get_admin_user)):
+    """Recompute the conversation summaries (inbox, unread counters) from the messages"""
+    from conversations import rebuild_conversations
+    rebuilt = await rebuild_conversations()
+    return {"success": True, "conversations": rebuilt}
+
+
 @router.put("/site-content")
 async def update_site_content(request: Request, admin: dict = Depends(get_admin_user)):
     """Update site content settings"""
@@ -1565,6 +1702,7 @@ async def update_site_content(request: Request, admin: dict = Depends(get_admin_
         {"$set": body},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"success": True, "message": "Contenu mis à jour"}
 
@@ -1591,6 +1729,7 @@ async def add_testimonial(request: Request, admin: dict = Depends(get_admin_user
         {"$push": {"testimonials": testimonial}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"success": True, "testimonial": testimonial}
 
@@ -1604,6 +1743,7 @@ async def delete_testimonial(testimonial_id: str, admin: dict = Depends(get_admi
         {"type": "homepage"},
         {"$pull": {"testimonials": {"id": testimonial_id}}}
     )
+    await settings_service.notify_changed()
     
     return {"success": True, "message": "Témoignage supprimé"}
 
@@ -1627,6 +1767,7 @@ async def add_featured_image(request: Request, admin: dict = Depends(get_admin_u
         {"$push": {"featured_images": image}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"success": True, "image": image}
 
@@ -1640,6 +1781,7 @@ async def delete_featured_image(image_id: str, admin: dict = Depends(get_admin_u
         {"type": "homepage"},
         {"$pull": {"featured_images": {"id": image_id}}}
     )
+    await settings_service.notify_changed()
     
     return {"success": True, "message": "Image supprimée"}
 
@@ -1648,11 +1790,10 @@ async def delete_featured_image(image_id: str, admin: dict = Depends(get_admin_u
 @router.get("/public/site-content")
 async def get_public_site_content():
     """Get site content for public display (no auth)"""
-    db = get_db()
-    
-    content = await db.site_content.find_one({"type": "homepage"}, {"_id": 0, "updated_by": 0})
-    
-    if not content:
+    content = await settings_service.homepage()
+    if content:
+        content.pop("updated_by", None)
+    else:
         content = {
             "hero": {
                 "title": "Trouvez les meilleurs prestataires pour vos événements",
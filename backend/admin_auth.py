@@ -5,7 +5,6 @@ import qrcode
 import io
 import base64
 import secrets
-import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timezone, timedelta
@@ -14,6 +13,9 @@ from fastapi import APIRouter, HTTPException, Depends, Response, Request
 from pydantic import BaseModel
 import bcrypt
 
+import settings_service
+import smtp_transport
+
 router = APIRouter(prefix="/api/admin/auth", tags=["Admin Auth"])
 
 # Get database
@@ -52,11 +54,10 @@ class EmailConfigUpdate(BaseModel):
 # ============ EMAIL FUNCTIONS ============
 
 async def get_email_config():
-    """Get email configuration from database"""
-    db = get_db()
-    config = await db.site_settings.find_one({"key": "email_config"}, {"_id": 0})
-    if config:
-        return config.get("value", {})
+    """Get email configuration from database (cached)"""
+    config = await smtp_transport.load_email_config()
+    if config is not None:
+        return config
     # Default IONOS config
     return {
         "smtp_host": "smtp.ionos.fr",
@@ -80,14 +81,7 @@ async def send_email(to_email: str, subject: str, html_content: str):
     message.attach(html_part)
     
     try:
-        await aiosmtplib.send(
-            message,
-            hostname=config["smtp_host"],
-            port=config["smtp_port"],
-            username=config["smtp_user"],
-            password=config["smtp_password"],
-            start_tls=True
-        )
+        await smtp_transport.send_message(message, config)
         return True
     except Exception as e:
         print(f"Email error: {e}")
@@ -441,6 +435,7 @@ async def update_email_config(config: EmailConfigUpdate, request: Request):
         {"$set": {"key": "email_config", "value": config_dict}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"message": "Configuration email mise à jour"}
 
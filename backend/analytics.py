@@ -0,0 +1,101 @@
+"""
+Admin Analytics
+Daily, weekly or monthly series (signups, bookings, GMV, commission, revenue)
+built from the daily_stats rollups
+"""
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import rollups
+
+# Ranges ending today still move; older ranges only change on the nightly rebuild
+CACHE_TTL_CURRENT = 60
+CACHE_TTL_PAST = 3600
+MAX_CACHE_ENTRIES = 256
+
+GRANULARITIES = {
+    "day": None,
+    "week": "W-MON",  # weeks starting on Monday
+    "month": "MS"
+}
+
+AMOUNT_COLUMNS = ("gmv_by_status", "commission_by_status", "revenue")
+
+# Bookings that never turned into business
+EXCLUDED_GMV_STATUSES = ("cancelled", "rejected")
+
+_cache = {}
+
+
+def build_series(buckets: list, start: str, end: str, granularity: str) -> dict:
+    """Gap-fill day buckets over [start, end] and aggregate them to the granularity"""
+    days = pd.date_range(start, end, freq="D")
+
+    frame = pd.json_normalize(buckets) if buckets else pd.DataFrame({"date": []})
+    frame.index = pd.to_datetime(frame.pop("date"))
+    frame = frame.select_dtypes("number").reindex(days).fillna(0)
+    counts = [c for c in frame.columns if not c.startswith(AMOUNT_COLUMNS)]
+    frame[counts] = frame[counts].astype("int64")
+
+    rule = GRANULARITIES[granularity]
+    if rule:
+        frame = frame.resample(rule, label="left", closed="left").sum()
+
+    def column(name):
+        if name not in frame:
+            return [0] * len(frame)
+        return frame[name].round(2).tolist()
+
+    def group(prefix):
+        columns = [c for c in frame.columns if c.startswith(f"{prefix}.")]
+        return {c[len(prefix) + 1:]: frame[c].round(2).tolist() for c in columns}
+
+    gmv_columns = [
+        c for c in frame.columns
+        if c.startswith("gmv_by_status.") and c.split(".", 1)[1] not in EXCLUDED_GMV_STATUSES
+    ]
+    commission_columns = [
+        c for c in frame.columns
+        if c.startswith("commission_by_status.") and c.split(".", 1)[1] not in EXCLUDED_GMV_STATUSES
+    ]
+
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "periods": frame.index.strftime("%Y-%m-%d").tolist(),
+        "signups": {"total": column("new_users"), **group("new_users_by_type")},
+        "bookings": {
+            "total": column("new_bookings"),
+            "by_status": group("bookings_by_status"),
+            "by_category": group("bookings_by_category")
+        },
+        "gmv": frame[gmv_columns].sum(axis=1).round(2).tolist(),
+        "commission": frame[commission_columns].sum(axis=1).round(2).tolist(),
+        "revenue": column("revenue")
+    }
+
+
+async def get_analytics(start: str, end: str, granularity: str = "day") -> dict:
+    """Series for a date range, cached per (start, end, granularity)"""
+    key = (start, end, granularity)
+    now = time.monotonic()
+    cached = _cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    buckets = await rollups.get_daily_stats(start, end)
+    result = build_series(buckets, start, end, granularity)
+
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    ttl = CACHE_TTL_CURRENT if end >= today else CACHE_TTL_PAST
+    if len(_cache) >= MAX_CACHE_ENTRIES:
+        _cache.clear()
+    _cache[key] = (now + ttl, result)
+    return result
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,173 @@
+"""
+Homepage Bootstrap
+Everything the landing screen needs (site content, categories, plans,
+featured packs, upcoming events) precomputed in the background and served
+from memory as one response with a content-version ETag
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Request, Response
+from fastapi.encoders import jsonable_encoder
+
+import http_cache
+import settings_service
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api", tags=["bootstrap"])
+
+# Upcoming events go stale on their own: rebuild at least this often
+REFRESH_INTERVAL = float(os.environ.get('BOOTSTRAP_REFRESH_INTERVAL', '60'))
+# Writes often come in bursts: wait this long after a change before rebuilding
+DEBOUNCE = 1.0  # seconds
+FEATURED_PACKS = 12
+UPCOMING_EVENTS = 12
+CACHE_CONTROL = "public, no-cache"
+
+_payload = {"body": None, "etag": None, "built_at": None}
+_stale = asyncio.Event()
+_lock = asyncio.Lock()
+_worker_task: Optional[asyncio.Task] = None
+
+_stats = {
+    "builds": 0,
+    "unchanged_builds": 0,
+    "errors": 0,
+    "served": 0,
+    "not_modified": 0,
+}
+
+
+# ============ BUILD ============
+
+async def _collect() -> dict:
+    from server import get_site_content, get_public_categories, get_all_packs
+    from subscriptions import get_subscription_plans
+    from events import get_events
+
+    site_content, events_categories, pro_categories, plans, packs, events = await asyncio.gather(
+        get_site_content(),
+        get_public_categories("events"),
+        get_public_categories("pro"),
+        get_subscription_plans(),
+        get_all_packs(None),
+        get_events(page=1, limit=UPCOMING_EVENTS, category=None, upcoming_only=True),
+    )
+    return {
+        "site_content": site_content,
+        "categories": {"events": events_categories, "pro": pro_categories},
+        "subscription_plans": plans,
+        "packs": packs[:FEATURED_PACKS],
+        "events": events["events"],
+    }
+
+
+async def _build() -> bool:
+    data = jsonable_encoder(await _collect())
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    etag = http_cache.etag_for(body)
+    changed = etag != _payload["etag"]
+    _payload.update(body=body, etag=etag, built_at=datetime.now(timezone.utc).isoformat())
+    _stats["builds"] += 1
+    if not changed:
+        _stats["unchanged_builds"] += 1
+    return changed
+
+
+async def build() -> bool:
+    """Recompute the payload. Returns False when nothing changed."""
+    async with _lock:
+        return await _build()
+
+
+def mark_stale():
+    """A source changed (settings, packs, events): rebuild soon"""
+    _stale.set()
+
+
+# Sources edited in another worker
+BOOTSTRAP_SOURCES = ("/api/packs", "/api/events")
+
+
+def _on_invalidation(path_prefix: str):
+    if path_prefix in BOOTSTRAP_SOURCES:
+        mark_stale()
+
+
+settings_service.on_change(mark_stale)
+http_cache.on_change(_on_invalidation)
+
+
+# ============ ENDPOINT ============
+
+@router.get("/bootstrap")
+async def get_bootstrap(request: Request):
+    """Landing screen data in one request (304 when the client's copy is current)"""
+    if _payload["body"] is None:
+        async with _lock:
+            if _payload["body"] is None:
+                await _build()
+
+    headers = {"ETag": _payload["etag"], "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and http_cache.etag_matches(if_none_match, _payload["etag"]):
+        _stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    _stats["served"] += 1
+    return Response(content=_payload["body"], media_type="application/json", headers=headers)
+
+
+# ============ WORKER ============
+
+async def _worker_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_stale.wait(), timeout=REFRESH_INTERVAL)
+            await asyncio.sleep(DEBOUNCE)
+        except asyncio.TimeoutError:
+            pass
+        _stale.clear()
+        try:
+            await build()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.error(f"Bootstrap rebuild error: {e}")
+
+
+def start_worker():
+    """Build the payload now and keep it fresh (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+        mark_stale()
+
+
+async def stop_worker():
+    """Stop the background rebuilds"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+# ============ METRICS ============
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "etag": _payload["etag"],
+        "built_at": _payload["built_at"],
+        "size_bytes": len(_payload["body"]) if _payload["body"] else 0,
+        "refresh_interval_seconds": REFRESH_INTERVAL,
+    }
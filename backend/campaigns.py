@@ -0,0 +1,391 @@
+"""
+Admin Email Campaigns
+Bulk reminders to providers with incomplete profiles: recipients selected by
+one aggregation, emails rendered from a template and queued in the outbox
+in batches, then sent throttled with per-recipient status. Preparation holds
+a lease and is resumed by another run if its process goes away.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from pymongo import ReturnDocument
+
+import email_outbox
+import email_templates
+from admin import get_admin_user
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/campaigns", tags=["admin campaigns"])
+
+# Emails per minute for one campaign; emails to one domain are also spaced
+# to stay within the outbox domain limit
+DEFAULT_RATE = int(os.environ.get('CAMPAIGN_RATE_PER_MINUTE', '300'))
+MAX_RATE = 3000
+BATCH_SIZE = 500
+# A campaign still "preparing" once its lease ran out is picked up again
+PREPARE_LEASE = timedelta(minutes=2)
+RESUME_INTERVAL = 60  # seconds
+
+# Profile criteria a campaign can target; a provider is selected when any
+# of the chosen ones is missing (all of them = "fiche incomplète")
+CRITERIA = ("profile", "photo", "description", "address", "category", "searchable")
+
+_tasks: set = set()
+_worker_task: Optional[asyncio.Task] = None
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+# ============ MODELS ============
+
+class CampaignSegment(BaseModel):
+    missing: List[str] = Field(default_factory=lambda: list(CRITERIA))
+
+
+class CampaignCreate(BaseModel):
+    name: Optional[str] = None
+    subject: str
+    message: str
+    segment: CampaignSegment = Field(default_factory=CampaignSegment)
+    rate_per_minute: int = DEFAULT_RATE
+
+
+# ============ SEGMENT ============
+
+def _blank(field: str) -> dict:
+    return {"$eq": [{"$trim": {"input": {"$ifNull": [field, ""]}}}, ""]}
+
+
+def segment_pipeline(missing: List[str]) -> list:
+    """Providers (not blocked) missing any of the given profile criteria"""
+    unknown = set(missing) - set(CRITERIA)
+    if unknown or not missing:
+        raise HTTPException(status_code=400, detail=f"Critères invalides: {', '.join(sorted(unknown)) or 'aucun'}")
+
+    return [
+        {"$match": {"user_type": "provider", "is_blocked": {"$ne": True}, "email": {"$nin": [None, ""]}}},
+        {"$lookup": {
+            "from": "provider_profiles",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "profile"
+        }},
+        {"$project": {
+            "_id": 0, "user_id": 1, "email": 1, "name": 1,
+            "profile": {"$arrayElemAt": ["$profile", 0]}
+        }},
+        {"$project": {
+            "user_id": 1, "email": 1, "name": 1,
+            "missing": {
+                "profile": {"$eq": [{"$ifNull": ["$profile.user_id", None]}, None]},
+                "photo": {"$not": [{"$or": [
+                    {"$gt": [{"$strLenCP": {"$ifNull": ["$profile.avatar_url", ""]}}, 0]},
+                    {"$gt": [{"$size": {"$ifNull": ["$profile.photos", []]}}, 0]}
+                ]}]},
+                "description": _blank("$profile.description"),
+                "address": _blank("$profile.address"),
+                "category": _blank("$profile.category"),
+                "searchable": {"$not": [{"$or": [
+                    {"$eq": ["$profile.is_searchable", True]},
+                    {"$eq": ["$profile.profile_visible", True]}
+                ]}]},
+            }
+        }},
+        {"$match": {"$or": [{f"missing.{criterion}": True} for criterion in missing]}},
+    ]
+
+
+@router.post("/preview")
+async def preview_segment(segment: CampaignSegment, admin: dict = Depends(get_admin_user)):
+    """Count the recipients of a segment and show a sample"""
+    db = get_db()
+    pipeline = segment_pipeline(segment.missing)
+    counted = await db.users.aggregate(pipeline + [{"$count": "total"}]).to_list(1)
+    sample = await db.users.aggregate(pipeline + [{"$limit": 20}]).to_list(20)
+    return {"total": counted[0]["total"] if counted else 0, "sample": sample}
+
+
+# ============ CAMPAIGNS ============
+
+def _lease() -> str:
+    return (datetime.now(timezone.utc) + PREPARE_LEASE).isoformat()
+
+
+async def _queued_so_far(campaign_id: str) -> Tuple[set, Dict[str, datetime]]:
+    """Recipients already in the outbox and the last send time per domain (resumed runs)"""
+    users, last_by_domain = set(), {}
+    async for row in get_db().email_outbox.aggregate([
+        {"$match": {"campaign_id": campaign_id}},
+        {"$group": {"_id": "$domain", "users": {"$push": "$user_id"}, "last": {"$max": "$next_attempt_at"}}}
+    ]):
+        users.update(row["users"])
+        last_by_domain[row["_id"]] = datetime.fromisoformat(row["last"])
+    return users, last_by_domain
+
+
+async def _prepare(campaign: dict):
+    """Render and queue every recipient's email, BATCH_SIZE per insert"""
+    db = get_db()
+    campaign_id = campaign["campaign_id"]
+    interval = timedelta(seconds=60 / campaign["rate_per_minute"])
+    domain_interval = timedelta(seconds=60 / email_outbox.DOMAIN_RATE)
+
+    # A resumed run skips the recipients queued before the restart and
+    # schedules after them
+    done, last_by_domain = await _queued_so_far(campaign_id)
+    start = max([datetime.now(timezone.utc), *(last + interval for last in last_by_domain.values())])
+    next_free = {domain: last + domain_interval for domain, last in last_by_domain.items()}
+    queued = len(done)
+    added = 0
+    batch = []
+
+    async def flush() -> bool:
+        """Queue the batch and renew the lease; False once the campaign was cancelled"""
+        nonlocal batch
+        await email_outbox.enqueue_many(batch)
+        batch = []
+        current = await db.email_campaigns.find_one_and_update(
+            {"campaign_id": campaign_id},
+            {"$set": {"total": queued, "lease_until": _lease()}},
+            {"_id": 0, "status": 1}
+        )
+        if current and current["status"] == "cancelled":
+            await email_outbox.cancel({"campaign_id": campaign_id})
+            return False
+        return True
+
+    try:
+        async for recipient in db.users.aggregate(segment_pipeline(campaign["segment"]["missing"])):
+            if recipient["user_id"] in done:
+                continue
+            # Campaign pace, but never faster than the domain limit: the
+            # outbox would only put the surplus back
+            domain = email_outbox.email_domain(recipient["email"])
+            send_at = max(start + added * interval, next_free.get(domain, start))
+            next_free[domain] = send_at + domain_interval
+
+            html_content, text_content = email_templates.render(
+                "profile_reminder.html", layout="notice",
+                name=recipient.get("name") or "Prestataire", message=campaign["message"]
+            )
+            batch.append(email_outbox.build_email(
+                recipient["email"], campaign["subject"], html_content, "campaign", text_content,
+                priority=email_outbox.PRIORITY_BULK,
+                send_after=send_at,
+                campaign_id=campaign_id,
+                user_id=recipient["user_id"],
+            ))
+            queued += 1
+            added += 1
+            if len(batch) >= BATCH_SIZE and not await flush():
+                return
+        if not await flush():
+            return
+        await db.email_campaigns.update_one(
+            {"campaign_id": campaign_id, "status": "preparing"},
+            {"$set": {"status": "sending", "total": queued}, "$unset": {"lease_until": ""}}
+        )
+    except Exception as e:
+        logger.error(f"Campaign {campaign_id} preparation failed after {queued} recipients: {e}")
+        await db.email_campaigns.update_one(
+            {"campaign_id": campaign_id},
+            {"$set": {"status": "failed", "total": queued, "error": str(e)}}
+        )
+
+
+def _start_preparation(campaign: dict):
+    task = asyncio.create_task(_prepare(campaign))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def resume_stalled() -> int:
+    """Take over the campaigns whose preparation lease ran out. Returns the number resumed."""
+    db = get_db()
+    resumed = 0
+    while True:
+        campaign = await db.email_campaigns.find_one_and_update(
+            {"status": "preparing", "$or": [
+                {"lease_until": {"$exists": False}},
+                {"lease_until": {"$lte": datetime.now(timezone.utc).isoformat()}}
+            ]},
+            {"$set": {"lease_until": _lease()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not campaign:
+            return resumed
+        logger.info(f"Resuming preparation of campaign {campaign['campaign_id']}")
+        _start_preparation(campaign)
+        resumed += 1
+
+
+async def _progress(campaign: dict) -> dict:
+    """Per-status counts from the outbox; marks the campaign completed when done"""
+    db = get_db()
+    rows = await db.email_outbox.aggregate([
+        {"$match": {"campaign_id": campaign["campaign_id"]}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    counts = {status: 0 for status in email_outbox.STATUSES}
+    counts.update({row["_id"]: row["count"] for row in rows})
+
+    unsent = counts["pending"] + counts["sending"] + counts["failed"]
+    if campaign["status"] == "sending" and not unsent:
+        completed_at = datetime.now(timezone.utc).isoformat()
+        await db.email_campaigns.update_one(
+            {"campaign_id": campaign["campaign_id"], "status": "sending"},
+            {"$set": {"status": "completed", "completed_at": completed_at}}
+        )
+        campaign.update(status="completed", completed_at=completed_at)
+
+    total = campaign.get("total", 0)
+    done = counts["sent"] + counts["dead"] + counts["cancelled"]
+    return {**campaign, "counts": counts, "progress": round(done / total * 100, 1) if total else 0.0}
+
+
+@router.post("")
+async def create_campaign(data: CampaignCreate, admin: dict = Depends(get_admin_user)):
+    """Create a campaign; recipients are queued in the background"""
+    if not data.subject.strip() or not data.message.strip():
+        raise HTTPException(status_code=400, detail="Sujet et message requis")
+    segment_pipeline(data.segment.missing)  # validate before storing
+
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+    campaign = {
+        "campaign_id": f"campaign_{uuid.uuid4().hex[:12]}",
+        "name": data.name or data.subject,
+        "subject": data.subject,
+        "message": data.message,
+        "segment": data.segment.model_dump(),
+        "rate_per_minute": max(1, min(data.rate_per_minute, MAX_RATE)),
+        "status": "preparing",  # preparing, sending, completed, cancelled, failed
+        "total": 0,
+        "lease_until": _lease(),
+        "created_by": admin.get("admin_id"),
+        "created_at": now,
+    }
+    await db.email_campaigns.insert_one(campaign)
+    campaign.pop("_id", None)
+
+    await db.admin_actions.insert_one({
+        "action": "campaign_created",
+        "campaign_id": campaign["campaign_id"],
+        "admin_id": admin.get("admin_id"),
+        "timestamp": now,
+        "subject": data.subject,
+        "segment": campaign["segment"]
+    })
+
+    _start_preparation(campaign)
+    return campaign
+
+
+@router.get("")
+async def list_campaigns(admin: dict = Depends(get_admin_user), limit: int = 20):
+    """Latest campaigns with their progress"""
+    campaigns = await get_db().email_campaigns.find(
+        {}, {"_id": 0, "message": 0}
+    ).sort("created_at", -1).to_list(min(limit, 100))
+    return {"campaigns": [await _progress(campaign) for campaign in campaigns]}
+
+
+async def _get_campaign(campaign_id: str) -> dict:
+    campaign = await get_db().email_campaigns.find_one({"campaign_id": campaign_id}, {"_id": 0})
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    return campaign
+
+
+@router.get("/{campaign_id}")
+async def get_campaign(campaign_id: str, admin: dict = Depends(get_admin_user)):
+    """Campaign details and send progress"""
+    return await _progress(await _get_campaign(campaign_id))
+
+
+@router.get("/{campaign_id}/recipients")
+async def get_campaign_recipients(
+    campaign_id: str,
+    admin: dict = Depends(get_admin_user),
+    status: Optional[str] = None,
+    page: int = 1,
+    limit: int = 50
+):
+    """Per-recipient send status"""
+    await _get_campaign(campaign_id)
+    db = get_db()
+    query = {"campaign_id": campaign_id}
+    if status:
+        query["status"] = status
+    limit = min(limit, 200)
+    total = await db.email_outbox.count_documents(query)
+    recipients = await db.email_outbox.find(
+        query,
+        {"_id": 0, "email_id": 1, "user_id": 1, "to": 1, "status": 1, "attempts": 1,
+         "last_error": 1, "next_attempt_at": 1, "sent_at": 1}
+    ).sort("next_attempt_at", 1).skip((page - 1) * limit).limit(limit).to_list(limit)
+    return {
+        "recipients": recipients,
+        "total": total,
+        "page": page,
+        "pages": (total + limit - 1) // limit
+    }
+
+
+@router.post("/{campaign_id}/cancel")
+async def cancel_campaign(campaign_id: str, admin: dict = Depends(get_admin_user)):
+    """Stop a campaign; emails already sent stay sent"""
+    campaign = await _get_campaign(campaign_id)
+    if campaign["status"] not in ("preparing", "sending"):
+        raise HTTPException(status_code=400, detail="La campagne n'est plus en cours")
+    db = get_db()
+    await db.email_campaigns.update_one(
+        {"campaign_id": campaign_id},
+        {"$set": {"status": "cancelled", "cancelled_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    cancelled = await email_outbox.cancel({"campaign_id": campaign_id})
+    return {"message": "Campagne annulée", "cancelled": cancelled}
+
+
+# ============ WORKER ============
+
+async def _worker_loop():
+    while True:
+        try:
+            await resume_stalled()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Campaign resume error: {e}")
+        await asyncio.sleep(RESUME_INTERVAL)
+
+
+def start_worker():
+    """Resume interrupted campaign preparations now and periodically (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop the resume checks; a preparation cut short is resumed by the next run"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
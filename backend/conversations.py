@@ -0,0 +1,406 @@
+"""
+Conversation Summaries
+One document per participant pair with the last message preview,
+per-participant unread counters and read watermarks, maintained on every
+message write. Also serves cursor-paged history and delta sync.
+"""
+import base64
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 100
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MARK_READ_ATTEMPTS = 3
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the indexes the inbox and message history rely on"""
+    db = get_db()
+    await db.conversations.create_index("conversation_id", unique=True)
+    await db.conversations.create_index([("participants", 1), ("updated_at", -1)])
+    await db.messages.create_index([("conversation_id", 1), ("created_at", -1), ("message_id", -1)])
+    await db.messages.create_index([("receiver_id", 1), ("created_at", -1)])
+    await db.messages.create_index([("sender_id", 1), ("created_at", -1)])
+
+
+def conversation_id_for(user_a: str, user_b: str) -> str:
+    """Stable conversation key of a participant pair"""
+    first, second = sorted([user_a, user_b])
+    return f"conv_{first}_{second}"
+
+
+def message_preview(message: dict) -> dict:
+    content = message.get("content") or ""
+    return {
+        "message_id": message["message_id"],
+        "sender_id": message["sender_id"],
+        "content": content[:PREVIEW_LENGTH] + "..." if len(content) > PREVIEW_LENGTH else content,
+        "has_attachments": bool(message.get("attachments")),
+        "created_at": message["created_at"]
+    }
+
+
+# ============ WRITES ============
+
+async def insert_message(message_doc: dict, summary: bool = True) -> dict:
+    """
+    Store a message and update its conversation summary (summary=False leaves
+    that to the caller, e.g. the message pipeline)
+    """
+    db = get_db()
+    message_doc["conversation_id"] = conversation_id_for(message_doc["sender_id"], message_doc["receiver_id"])
+    await db.messages.insert_one(message_doc)
+    message_doc.pop("_id", None)
+    if summary:
+        await record_message(message_doc)
+    return message_doc
+
+
+async def record_message(message: dict):
+    """Bump the unread counter and last message of the message's conversation"""
+    await count_message(message)
+    await update_preview(message)
+
+
+async def count_message(message: dict):
+    """Create the conversation if needed and bump the receiver's unread counter (not idempotent)"""
+    db = get_db()
+    conversation_id = message["conversation_id"]
+    created_at = message["created_at"]
+    counters = {} if message["sender_id"] == message["receiver_id"] else {f"unread.{message['receiver_id']}": 1}
+
+    await db.conversations.update_one(
+        {"conversation_id": conversation_id},
+        {
+            "$setOnInsert": {
+                "conversation_id": conversation_id,
+                "participants": sorted({message["sender_id"], message["receiver_id"]}),
+                "created_at": created_at
+            },
+            "$max": {"updated_at": created_at},
+            **({"$inc": counters} if counters else {})
+        },
+        upsert=True
+    )
+
+
+async def update_preview(message: dict):
+    """Set the conversation's last message, unless a newer one is already there"""
+    db = get_db()
+    created_at = message["created_at"]
+    # Concurrent sends may land out of order: keep the newest preview
+    await db.conversations.update_one(
+        {
+            "conversation_id": message["conversation_id"],
+            "$or": [
+                {"last_message": {"$exists": False}},
+                {"last_message.created_at": {"$lte": created_at}}
+            ]
+        },
+        {"$set": {"last_message": message_preview(message)}}
+    )
+
+
+async def mark_read(reader_id: str, other_user_id: str) -> Optional[str]:
+    """
+    Move the reader's watermark to the latest message of the conversation and
+    reset their unread counter. Messages are not updated one by one: a message
+    is read once its created_at is at or below the receiver's watermark.
+    Returns the watermark.
+    """
+    db = get_db()
+    conversation_id = conversation_id_for(reader_id, other_user_id)
+    for _ in range(MARK_READ_ATTEMPTS):
+        conversation = await db.conversations.find_one(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "updated_at": 1, "last_message": 1}
+        )
+        if not conversation or not conversation.get("last_message"):
+            return None
+
+        # updated_at moves in the same write as the unread increment: only
+        # reset the counter if no message landed since the read above
+        watermark = conversation["updated_at"]
+        result = await db.conversations.update_one(
+            {"conversation_id": conversation_id, "updated_at": watermark},
+            {"$max": {f"read_at.{reader_id}": watermark}, "$set": {f"unread.{reader_id}": 0}}
+        )
+        if result.matched_count:
+            return watermark
+
+    # Still busy: advance the watermark and leave the counter to the next read
+    await db.conversations.update_one(
+        {"conversation_id": conversation_id},
+        {"$max": {f"read_at.{reader_id}": watermark}}
+    )
+    return watermark
+
+
+def is_read(message: dict, read_at: dict) -> bool:
+    """Read flag of a message given its conversation's watermarks"""
+    if message.get("read"):
+        return True  # stored before watermarks existed
+    watermark = read_at.get(message["receiver_id"])
+    return bool(watermark) and message["created_at"] <= watermark
+
+
+async def apply_read_state(messages: list) -> dict:
+    """Set the read flag of messages from their conversations' watermarks; returns the watermarks"""
+    db = get_db()
+    conversation_ids = list({m["conversation_id"] for m in messages if m.get("conversation_id")})
+    watermarks = {
+        c["conversation_id"]: c.get("read_at", {})
+        for c in await db.conversations.find(
+            {"conversation_id": {"$in": conversation_ids}},
+            {"_id": 0, "conversation_id": 1, "read_at": 1}
+        ).to_list(len(conversation_ids))
+    }
+    for message in messages:
+        message["read"] = is_read(message, watermarks.get(message.get("conversation_id"), {}))
+    return watermarks
+
+
+# ============ HISTORY & SYNC ============
+
+def encode_cursor(message: dict) -> str:
+    """Opaque cursor of a message position: (created_at, message_id)"""
+    raw = json.dumps([message["created_at"], message["message_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, message_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(message_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, message_id
+
+
+def _position_filter(cursor: str, op: str) -> dict:
+    created_at, message_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {op: created_at}},
+        {"created_at": created_at, "message_id": {op: message_id}}
+    ]}
+
+
+async def get_history(user_id: str, other_user_id: str, limit: int = DEFAULT_PAGE_SIZE,
+                      before: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    """
+    One page of a thread going backwards from `before` (newest page by default).
+    Returns the page oldest first and the cursor of the next (older) page.
+    """
+    db = get_db()
+    query = {"conversation_id": conversation_id_for(user_id, other_user_id)}
+    if before:
+        query.update(_position_filter(before, "$lt"))
+
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("message_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = encode_cursor(messages[limit - 1]) if len(messages) > limit else None
+    messages = messages[:limit]
+    messages.reverse()
+    await apply_read_state(messages)
+    return messages, next_cursor
+
+
+async def get_changes(user_id: str, since: Optional[str] = None,
+                      limit: int = DEFAULT_PAGE_SIZE) -> dict:
+    """
+    Messages sent or received by a user after the `since` cursor, oldest first.
+    Without `since`, returns no messages and the cursor of the latest one (or
+    of the current time when there is none yet), so a client can start
+    syncing from now.
+    """
+    db = get_db()
+    participant = {"$or": [{"sender_id": user_id}, {"receiver_id": user_id}]}
+
+    if not since:
+        latest = await db.messages.find(participant, {"_id": 0, "created_at": 1, "message_id": 1}).sort(
+            [("created_at", -1), ("message_id", -1)]
+        ).limit(1).to_list(1)
+        # Every real message_id sorts after "", so messages stamped this
+        # same instant are still returned by the next sync
+        start = latest[0] if latest else {"created_at": datetime.now(timezone.utc).isoformat(), "message_id": ""}
+        return {"messages": [], "cursor": encode_cursor(start), "has_more": False, "read_at": {}}
+
+    query = {"$and": [participant, _position_filter(since, "$gt")]}
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", 1), ("message_id", 1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    watermarks = await apply_read_state(messages)
+    return {
+        "messages": messages,
+        "cursor": encode_cursor(messages[-1]) if messages else since,
+        "has_more": has_more,
+        "read_at": watermarks
+    }
+
+
+# ============ READS ============
+
+USER_FIELDS = {
+    "user_id": 1, "email": 1, "name": 1, "picture": 1, "phone": 1, "user_type": 1,
+    "country": 1, "countries": 1, "preferences": 1, "notification_settings": 1, "created_at": 1
+}
+
+
+async def get_inbox(user_id: str, limit: int = 50, before: Optional[str] = None) -> list:
+    """Conversations of a user, most recent first, each joined with the other participant"""
+    db = get_db()
+    match = {"participants": user_id}
+    if before:
+        match["updated_at"] = {"$lt": before}
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"updated_at": -1}},
+        {"$limit": limit},
+        {"$addFields": {"other_id": {"$ifNull": [
+            {"$arrayElemAt": [{"$filter": {
+                "input": "$participants",
+                "cond": {"$ne": ["$$this", user_id]}
+            }}, 0]},
+            user_id
+        ]}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "other_id",
+            "foreignField": "user_id",
+            "as": "user"
+        }},
+        {"$unwind": "$user"},
+        {"$project": {
+            "_id": 0,
+            "conversation_id": 1,
+            "last_message": 1,
+            "updated_at": 1,
+            "unread": 1,
+            **{f"user.{field}": 1 for field in USER_FIELDS}
+        }}
+    ]
+    return await db.conversations.aggregate(pipeline).to_list(limit)
+
+
+async def get_unread_total(user_id: str) -> int:
+    """Unread messages of a user across all conversations"""
+    db = get_db()
+    result = await db.conversations.aggregate([
+        {"$match": {"participants": user_id, f"unread.{user_id}": {"$gt": 0}}},
+        {"$group": {"_id": None, "total": {"$sum": f"$unread.{user_id}"}}}
+    ]).to_list(1)
+    return result[0]["total"] if result else 0
+
+
+# ============ REBUILD ============
+
+async def rebuild_conversations() -> int:
+    """Recompute every conversation summary from the messages collection"""
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+
+    # Older messages were stored without their conversation key
+    await db.messages.aggregate([
+        {"$match": {"conversation_id": {"$exists": False}}},
+        {"$project": {"conversation_id": {"$cond": [
+            {"$lt": ["$sender_id", "$receiver_id"]},
+            {"$concat": ["conv_", "$sender_id", "_", "$receiver_id"]},
+            {"$concat": ["conv_", "$receiver_id", "_", "$sender_id"]}
+        ]}}},
+        {"$merge": {"into": "messages", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]).to_list(None)
+
+    rows = await db.messages.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$conversation_id",
+            "participants": {"$addToSet": "$sender_id"},
+            "receivers": {"$addToSet": "$receiver_id"},
+            "created_at": {"$first": "$created_at"},
+            "last": {"$last": "$$ROOT"}
+        }}
+    ], allowDiskUse=True).to_list(None)
+
+    # Read watermarks are kept; unread = not flagged read and past the receiver's watermark
+    watermarks = {
+        c["conversation_id"]: c.get("read_at", {})
+        async for c in db.conversations.find({}, {"_id": 0, "conversation_id": 1, "read_at": 1})
+    }
+    unread = {}
+    for row in await db.messages.aggregate([
+        {"$match": {"read": False}},
+        {"$lookup": {
+            "from": "conversations",
+            "localField": "conversation_id",
+            "foreignField": "conversation_id",
+            "as": "conversation"
+        }},
+        {"$addFields": {"watermark": {"$let": {
+            "vars": {"entry": {"$arrayElemAt": [{"$filter": {
+                "input": {"$objectToArray": {"$ifNull": [{"$arrayElemAt": ["$conversation.read_at", 0]}, {}]}},
+                "cond": {"$eq": ["$$this.k", "$receiver_id"]}
+            }}, 0]}},
+            "in": "$$entry.v"
+        }}}},
+        {"$match": {"$expr": {"$gt": ["$created_at", {"$ifNull": ["$watermark", ""]}]}}},
+        {"$group": {"_id": {"conversation_id": "$conversation_id", "receiver_id": "$receiver_id"}, "count": {"$sum": 1}}}
+    ]).to_list(None):
+        unread.setdefault(row["_id"]["conversation_id"], {})[row["_id"]["receiver_id"]] = row["count"]
+
+    operations = []
+    for row in rows:
+        last = row["last"]
+        operations.append(ReplaceOne(
+            {"conversation_id": row["_id"]},
+            {
+                "conversation_id": row["_id"],
+                "participants": sorted(set(row["participants"]) | set(row["receivers"])),
+                "created_at": row["created_at"],
+                "updated_at": last["created_at"],
+                "last_message": message_preview(last),
+                "unread": unread.get(row["_id"], {}),
+                "read_at": watermarks.get(row["_id"], {}),
+                "rebuilt_at": now
+            },
+            upsert=True
+        ))
+
+    if operations:
+        await db.conversations.bulk_write(operations, ordered=False)
+    await db.conversations.delete_many({"conversation_id": {"$nin": [row["_id"] for row in rows]}})
+
+    logger.info(f"Conversations rebuilt: {len(operations)}")
+    return len(operations)
+
+
+async def ensure_populated():
+    """Build the summaries once on a database that predates them"""
+    db = get_db()
+    try:
+        if await db.conversations.count_documents({}, limit=1) == 0 and \
+                await db.messages.count_documents({}, limit=1) > 0:
+            await rebuild_conversations()
+    except Exception as e:
+        logger.error(f"Conversation rebuild failed: {e}")
@@ -0,0 +1,198 @@
+"""
+Write-Behind Counters
+View counters summed in memory per item and written every FLUSH_INTERVAL in
+one bulk_write per collection (plus per-item daily buckets), instead of one
+update per view. Failed writes are kept for the next flush; at most
+FLUSH_INTERVAL of views is lost on a crash
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import rollups
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', '10'))  # seconds
+# Flush early once this many items are pending in one buffer
+MAX_PENDING = 5000
+MIN_FLUSH_GAP = 1.0  # seconds
+
+_worker_task: Optional[asyncio.Task] = None
+_wakeup = asyncio.Event()
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the indexes the daily buckets rely on"""
+    await get_db().daily_views.create_index([("kind", 1), ("item_id", 1), ("date", 1)], unique=True)
+
+
+class CounterBuffer:
+    """Increments of one counter field, keyed by item id, plus their daily buckets"""
+
+    def __init__(self, kind: str, collection: str, key_field: str, field: str = "views_count"):
+        self.kind = kind  # name of the daily buckets
+        self.collection = collection
+        self.key_field = key_field
+        self.field = field
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._daily: Dict[Tuple[str, str], int] = defaultdict(int)  # (day, key) -> count
+        self.stats = {"added": 0, "flushed": 0, "writes": 0, "unknown": 0, "requeued": 0}
+
+    def add(self, key: str, amount: int = 1):
+        """Count `amount` for an item; written at the next flush"""
+        self._pending[key] += amount
+        self._daily[(rollups.day_key(), key)] += amount
+        self.stats["added"] += amount
+        if len(self._pending) >= MAX_PENDING:
+            _wakeup.set()
+
+    async def _bulk_inc(self, collection, items: list, operation: Callable) -> list:
+        """Apply the increments; returns the ones that did not go through"""
+        if not items:
+            return []
+        try:
+            await collection.bulk_write([operation(key, n) for key, n in items], ordered=False)
+            return []
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logger.error(f"{self.kind} counter flush: {len(failed)} of {len(items)} writes failed")
+            return [items[i] for i in sorted(failed)]
+        except Exception as e:
+            logger.error(f"{self.kind} counter flush failed, retrying at the next one: {e}")
+            return items
+
+    async def flush(self) -> int:
+        """Write the pending increments. Returns the number of items updated."""
+        if not self._pending and not self._daily:
+            return 0
+        totals, self._pending = self._pending, defaultdict(int)
+        daily, self._daily = self._daily, defaultdict(int)
+        db = get_db()
+        written = 0
+        try:
+            # Ids come from public endpoints: only count items that exist
+            keys = list(set(totals) | {key for _, key in daily})
+            known = {
+                doc[self.key_field]
+                async for doc in db[self.collection].find(
+                    {self.key_field: {"$in": keys}}, {"_id": 0, self.key_field: 1}
+                )
+            }
+            self.stats["unknown"] += sum(n for key, n in totals.items() if key not in known)
+            totals = {key: n for key, n in totals.items() if key in known}
+            daily = {bucket: n for bucket, n in daily.items() if bucket[1] in known}
+
+            retry = await self._bulk_inc(
+                db[self.collection], list(totals.items()),
+                lambda key, n: UpdateOne({self.key_field: key}, {"$inc": {self.field: n}})
+            )
+            written = len(totals) - len(retry)
+            self.stats["flushed"] += sum(totals.values()) - sum(n for _, n in retry)
+            self.stats["writes"] += 1
+            totals = dict(retry)
+
+            daily = dict(await self._bulk_inc(
+                db.daily_views, list(daily.items()),
+                lambda bucket, n: UpdateOne(
+                    {"kind": self.kind, "item_id": bucket[1], "date": bucket[0]},
+                    {"$inc": {"count": n}},
+                    upsert=True
+                )
+            ))
+        finally:
+            # Whatever was not written (failure, or cancelled at shutdown)
+            # goes back for the next flush. A write that failed halfway
+            # without saying which operations applied may count some views
+            # twice; dropping them would lose them instead.
+            for key, n in totals.items():
+                self._pending[key] += n
+            for bucket, n in daily.items():
+                self._daily[bucket] += n
+            self.stats["requeued"] += sum(totals.values())
+        return written
+
+
+portfolio_views = CounterBuffer("portfolio_item", "portfolio_items", "item_id")
+provider_views = CounterBuffer("provider", "provider_profiles", "provider_id")
+event_views = CounterBuffer("event", "community_events", "event_id")
+marketplace_views = CounterBuffer("marketplace_item", "marketplace_items", "item_id")
+
+BUFFERS: List[CounterBuffer] = [portfolio_views, provider_views, event_views, marketplace_views]
+
+
+async def flush_all() -> int:
+    written = 0
+    for buffer in BUFFERS:
+        try:
+            written += await buffer.flush()
+        except Exception as e:
+            logger.error(f"{buffer.kind} counter flush error: {e}")
+    return written
+
+
+# ============ WORKER ============
+
+async def _worker_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        await flush_all()
+        # Early flushes while the database is failing would otherwise run on every view
+        await asyncio.sleep(MIN_FLUSH_GAP)
+
+
+def start_worker():
+    """Start the periodic flush (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop the periodic flush and write what is still pending"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+    await flush_all()
+
+
+# ============ READS ============
+
+async def get_daily(kind: str, item_id: str, days: int = 30) -> list:
+    """[{"date", "count"}] for the last `days` days, oldest first (days without views omitted)"""
+    since = rollups.day_key(datetime.now(timezone.utc) - timedelta(days=days - 1))
+    return await get_db().daily_views.find(
+        {"kind": kind, "item_id": item_id, "date": {"$gte": since}},
+        {"_id": 0, "date": 1, "count": 1}
+    ).sort("date", 1).to_list(days)
+
+
+def stats() -> dict:
+    return {
+        "flush_interval_seconds": FLUSH_INTERVAL,
+        "buffers": {
+            buffer.kind: {**buffer.stats, "pending_items": len(buffer._pending), "pending_buckets": len(buffer._daily)}
+            for buffer in BUFFERS
+        },
+    }
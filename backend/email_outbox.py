@@ -0,0 +1,361 @@
+"""
+Email Outbox
+Transactional emails are stored by the request handlers and sent by a
+background worker with bounded concurrency, per-domain rate limits (one
+bucket for transactional and one for bulk mail), exponential backoff and
+dead-lettering
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', '5'))
+# Concurrent sends per process (each holds one pooled SMTP connection)
+CONCURRENCY = int(os.environ.get('EMAIL_OUTBOX_CONCURRENCY', '3'))
+MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', '6'))
+# Emails per minute to one recipient domain, per priority and process
+DOMAIN_RATE = float(os.environ.get('EMAIL_OUTBOX_DOMAIN_RATE', '60'))
+DOMAIN_BURST = 10
+RETRY_BASE = 30  # seconds, doubled on each attempt
+RETRY_MAX = 3600  # seconds
+# A claimed email not finished within this delay is considered abandoned
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+# Due emails are claimed by priority first: bulk sends never hold up
+# transactional emails
+PRIORITY_TRANSACTIONAL = 0
+PRIORITY_BULK = 1
+STATUSES = ("pending", "sending", "sent", "failed", "dead", "cancelled")
+
+_worker_task: Optional[asyncio.Task] = None
+_wakeup = asyncio.Event()
+_buckets: Dict[Tuple[str, int], list] = {}  # (domain, priority) -> [tokens, updated]
+# Lanes out of tokens are not claimed again until their next token
+_throttled: Dict[Tuple[str, int], float] = {}  # (domain, priority) -> monotonic time
+
+_stats = {
+    "queued": 0,
+    "sent": 0,
+    "failed": 0,
+    "dead": 0,
+    "throttled": 0,
+    "not_configured": 0,
+}
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the indexes the outbox relies on"""
+    db = get_db()
+    await db.email_outbox.create_index("email_id", unique=True)
+    await db.email_outbox.create_index([("status", 1), ("priority", 1), ("next_attempt_at", 1)])
+    await db.email_outbox.create_index([("campaign_id", 1), ("status", 1)], sparse=True)
+
+
+def email_domain(to_email: str) -> str:
+    return to_email.rsplit("@", 1)[-1].strip().lower()
+
+
+# ============ OUTBOX ============
+
+def build_email(
+    to_email: str,
+    subject: str,
+    html_content: str,
+    category: Optional[str] = None,
+    text_content: Optional[str] = None,
+    priority: int = PRIORITY_TRANSACTIONAL,
+    send_after: Optional[datetime] = None,
+    **fields
+) -> dict:
+    """Outbox document for one email (extra fields, e.g. campaign_id, are kept)"""
+    now = datetime.now(timezone.utc)
+    return {
+        "email_id": f"email_{uuid.uuid4().hex[:12]}",
+        "to": to_email,
+        "domain": email_domain(to_email),
+        "subject": subject,
+        "html": html_content,
+        "text": text_content,
+        "category": category,
+        "priority": priority,
+        "status": "pending",  # pending, sending, sent, failed, dead, cancelled
+        "attempts": 0,
+        "last_error": None,
+        "created_at": now.isoformat(),
+        "next_attempt_at": (send_after or now).isoformat(),
+        **fields,
+    }
+
+
+async def enqueue(
+    to_email: str,
+    subject: str,
+    html_content: str,
+    category: Optional[str] = None,
+    text_content: Optional[str] = None
+) -> str:
+    """Store an email for the worker. Returns its email_id."""
+    email = build_email(to_email, subject, html_content, category, text_content)
+    await get_db().email_outbox.insert_one(email)
+    _stats["queued"] += 1
+    _wakeup.set()
+    return email["email_id"]
+
+
+async def enqueue_many(emails: list) -> int:
+    """Store emails built with build_email in one round trip"""
+    if not emails:
+        return 0
+    await get_db().email_outbox.insert_many(emails, ordered=False)
+    _stats["queued"] += len(emails)
+    _wakeup.set()
+    return len(emails)
+
+
+async def cancel(query: dict) -> int:
+    """Cancel the emails matching query that have not been sent yet"""
+    result = await get_db().email_outbox.update_many(
+        {**query, "status": {"$in": ["pending", "failed"]}},
+        {"$set": {"status": "cancelled"}, "$unset": {"html": "", "text": ""}}
+    )
+    return result.modified_count
+
+
+async def retry(email_id: str) -> bool:
+    """Put a dead-lettered email back in the queue"""
+    result = await get_db().email_outbox.update_one(
+        {"email_id": email_id, "status": "dead"},
+        {"$set": {
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": datetime.now(timezone.utc).isoformat()
+        }}
+    )
+    if result.modified_count:
+        _wakeup.set()
+    return result.modified_count > 0
+
+
+# ============ RATE LIMIT ============
+
+def _lane(email: dict) -> Tuple[str, int]:
+    """Rate limit bucket of an email: bulk mail never uses up a domain's transactional tokens"""
+    return email["domain"], email.get("priority", PRIORITY_TRANSACTIONAL)
+
+
+def _take_token(lane: Tuple[str, int]) -> float:
+    """0 if an email of `lane` may go now, else the seconds to wait"""
+    now = time.monotonic()
+    rate = DOMAIN_RATE / 60
+    tokens, updated = _buckets.get(lane, (DOMAIN_BURST, now))
+    tokens = min(DOMAIN_BURST, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        _buckets[lane] = [tokens - 1, now]
+        return 0.0
+    _buckets[lane] = [tokens, now]
+    wait = (1 - tokens) / rate
+    _throttled[lane] = now + wait
+    return wait
+
+
+def _throttled_lanes() -> List[Tuple[str, int]]:
+    now = time.monotonic()
+    for lane, until in list(_throttled.items()):
+        if until <= now:
+            del _throttled[lane]
+    return list(_throttled)
+
+
+# ============ WORKER ============
+
+async def _claim_next_email() -> Optional[dict]:
+    """Atomically claim the oldest email that is due, skipping throttled domains"""
+    now = datetime.now(timezone.utc)
+    query = {"$or": [
+        {"status": {"$in": ["pending", "failed"]}, "next_attempt_at": {"$lte": now.isoformat()}},
+        {"status": "sending", "claimed_at": {"$lte": (now - CLAIM_TIMEOUT).isoformat()}}
+    ]}
+    throttled = _throttled_lanes()
+    if throttled:
+        query["$nor"] = [{"domain": domain, "priority": priority} for domain, priority in throttled]
+    return await get_db().email_outbox.find_one_and_update(
+        query,
+        {"$set": {"status": "sending", "claimed_at": now.isoformat()}},
+        projection={"_id": 0},
+        sort=[("priority", 1), ("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _send(email: dict):
+    from email_service import deliver_email, EmailNotConfigured
+
+    db = get_db()
+    wait = _take_token(_lane(email))
+    if wait:
+        _stats["throttled"] += 1
+        await db.email_outbox.update_one(
+            {"email_id": email["email_id"]},
+            {"$set": {
+                "status": "pending",
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=wait)).isoformat()
+            }}
+        )
+        return
+
+    attempts = email.get("attempts", 0) + 1
+    try:
+        await deliver_email(email["to"], email["subject"], email["html"], email.get("text"))
+    except EmailNotConfigured as e:
+        # Not an SMTP error: retrying cannot help, the email is dropped as
+        # it was before the outbox
+        _stats["not_configured"] += 1
+        logger.info(f"Email {email['email_id']} to {email['to']} not sent: {e}")
+        await db.email_outbox.update_one(
+            {"email_id": email["email_id"]},
+            {
+                "$set": {"status": "cancelled", "last_error": str(e)},
+                "$unset": {"html": "", "text": ""}
+            }
+        )
+        return
+    except Exception as e:
+        dead = attempts >= MAX_ATTEMPTS
+        _stats["dead" if dead else "failed"] += 1
+        logger.warning(f"Email {email['email_id']} to {email['to']} failed (attempt {attempts}): {e}")
+        delay = timedelta(seconds=min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX))
+        await db.email_outbox.update_one(
+            {"email_id": email["email_id"]},
+            {"$set": {
+                "status": "dead" if dead else "failed",
+                "attempts": attempts,
+                "last_error": str(e)[:500],
+                "next_attempt_at": (datetime.now(timezone.utc) + delay).isoformat()
+            }}
+        )
+        return
+
+    _stats["sent"] += 1
+    await db.email_outbox.update_one(
+        {"email_id": email["email_id"]},
+        {
+            "$set": {
+                "status": "sent",
+                "attempts": attempts,
+                "sent_at": datetime.now(timezone.utc).isoformat(),
+                "last_error": None
+            },
+            "$unset": {"html": "", "text": ""}
+        }
+    )
+
+
+async def process_outbox() -> int:
+    """Send every due email, CONCURRENCY at a time. Returns the number handled."""
+    slots = asyncio.Semaphore(max(CONCURRENCY, 1))
+    running = set()
+    handled = 0
+
+    async def run(email):
+        try:
+            await _send(email)
+        except Exception as e:
+            logger.error(f"Email outbox error on {email['email_id']}: {e}")
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            email = await _claim_next_email()
+            if not email:
+                slots.release()
+                break
+            task = asyncio.create_task(run(email))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            handled += 1
+    finally:
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    return handled
+
+
+async def _worker_loop():
+    while True:
+        try:
+            await process_outbox()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Email outbox worker error: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_worker():
+    """Start the background worker (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop the background worker; unsent emails stay queued for the next start"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+# ============ METRICS ============
+
+async def status(dead_limit: int = 20) -> dict:
+    """Queue depth by status, oldest waiting email and the latest dead letters"""
+    db = get_db()
+    by_status = {
+        row["_id"]: row["count"]
+        async for row in db.email_outbox.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+    }
+    waiting = await db.email_outbox.find_one(
+        {"status": {"$in": ["pending", "failed"]}},
+        {"_id": 0, "created_at": 1},
+        sort=[("created_at", 1)]
+    )
+    oldest_age = None
+    if waiting:
+        oldest_age = (datetime.now(timezone.utc) - datetime.fromisoformat(waiting["created_at"])).total_seconds()
+    dead = await db.email_outbox.find(
+        {"status": "dead"},
+        {"_id": 0, "html": 0, "text": 0}
+    ).sort("next_attempt_at", -1).to_list(dead_limit)
+    return {
+        "by_status": {s: by_status.get(s, 0) for s in STATUSES},
+        "oldest_waiting_seconds": round(oldest_age, 1) if oldest_age is not None else None,
+        "worker": dict(_stats),
+        "concurrency": CONCURRENCY,
+        "domain_rate_per_minute": DOMAIN_RATE,
+        "dead_letters": dead,
+    }
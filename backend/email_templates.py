@@ -0,0 +1,100 @@
+"""
+Email Templates
+Jinja2 email bodies compiled once per process, wrapped in layouts that are
+pre-rendered at load, with escaping and a generated plain-text alternative
+"""
+import os
+import re
+from html import unescape
+from pathlib import Path
+from typing import Dict, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+
+TEMPLATE_DIR = Path(__file__).parent / "templates" / "email"
+SITE_URL = os.environ.get("SITE_URL", "https://events.creativindustry.cloud")
+CONTACT_EMAIL = "contact@creativindustry.com"
+
+# Stands in for the body while a layout is pre-rendered, then split on
+_CONTENT_MARKER = "\x00content\x00"
+
+_env = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+_layouts: Dict[str, Tuple[str, str, str, str]] = {}  # name -> (html head, html tail, text head, text tail)
+
+
+def _excerpt(value, length: int = 100):
+    value = value or ""
+    return value[:length] + "..." if len(value) > length else value
+
+
+def _nl2br(value):
+    return Markup("<br>\n").join(escape(value or "").split("\n"))
+
+
+_env.filters["excerpt"] = _excerpt
+_env.filters["nl2br"] = _nl2br
+_env.globals.update(site_url=SITE_URL, contact_email=CONTACT_EMAIL)
+
+
+# ============ PLAIN TEXT ============
+
+# Our own templates only: well-formed markup, so a few regexes are enough
+_SKIPPED = re.compile(r"<(head|style|script|title)\b.*?</\1>", re.S | re.I)
+_LINK = re.compile(r'<a\b[^>]*?href="([^"]*)"[^>]*>(.*?)</a>', re.S | re.I)
+_BREAK = re.compile(r"<br\s*/?>", re.I)
+_ITEM = re.compile(r"<li\b[^>]*>", re.I)
+_BLOCK = re.compile(r"</?(p|div|h[1-6]|ul|ol|table|tr)\b[^>]*>", re.I)
+_TAG = re.compile(r"<[^>]+>")
+_WHITESPACE = re.compile(r"\s{2,}|[\t\n\r\f\v]")
+_SPACES = re.compile(r"[ \t]{2,}")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _link_text(match) -> str:
+    href, label = match.group(1), _TAG.sub("", match.group(2)).strip()
+    target = href[len("mailto:"):] if href.startswith("mailto:") else href
+    return f"{label} ({target})" if target and target != label else label
+
+
+def html_to_text(html: str) -> str:
+    """Readable plain-text version of an email body (links kept as URLs)"""
+    text = _SKIPPED.sub("", html)
+    text = _WHITESPACE.sub(" ", text)
+    text = _LINK.sub(_link_text, text)
+    text = _BREAK.sub("\n", text)
+    text = _ITEM.sub("\n- ", text)
+    text = _BLOCK.sub("\n\n", text)
+    text = unescape(_TAG.sub("", text))
+    text = _SPACES.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text)
+
+
+# ============ RENDERING ============
+
+def load():
+    """Compile every template and pre-render the layouts (once per process)"""
+    for name in _env.list_templates(extensions=["html"]):
+        template = _env.get_template(name)
+        if name.startswith("layouts/"):
+            html = template.render(content=Markup(_CONTENT_MARKER))
+            head, tail = html.split(_CONTENT_MARKER)
+            text_head, text_tail = html_to_text(html).split(_CONTENT_MARKER)
+            _layouts[Path(name).stem] = (head, tail, text_head.lstrip("\n"), text_tail.rstrip("\n"))
+
+
+def render(template_name: str, /, layout: str = "base", **context) -> Tuple[str, str]:
+    """Render an email body inside its layout. Returns (html, text)."""
+    if not _layouts:
+        load()
+    content = _env.get_template(template_name).render(**context)
+    head, tail, text_head, text_tail = _layouts[layout]
+    text = text_head + html_to_text(content).strip("\n") + text_tail
+    return head + content + tail, text.strip() + "\n"
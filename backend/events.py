@@ -9,6 +9,10 @@ import uuid
 import os
 import base64
 
+import bootstrap
+import counters
+import http_cache
+
 router = APIRouter(prefix="/api/events", tags=["events"])
 
 # Directory for uploaded images (relative to this file's location)
@@ -89,6 +93,15 @@ async def get_event_image(filename: str):
 
 # ============ EVENTS CRUD ============
 
+async def _count_by_event(collection, event_ids: list) -> dict:
+    """event_id -> number of documents, for a page of events"""
+    rows = await collection.aggregate([
+        {"$match": {"event_id": {"$in": event_ids}}},
+        {"$group": {"_id": "$event_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    return {row["_id"]: row["count"] for row in rows}
+
+
 @router.get("")
 async def get_events(
     page: int = Query(1, ge=1),
@@ -112,20 +125,23 @@ async def get_events(
     events = await db.community_events.find(query, {"_id": 0}).sort("event_date", 1).skip(skip).limit(limit).to_list(limit)
     total = await db.community_events.count_documents(query)
     
-    # Add provider info and stats for each event
-    for event in events:
-        # Get provider info
-        provider = await db.provider_profiles.find_one(
-            {"provider_id": event.get("provider_id")},
-            {"_id": 0, "business_name": 1, "profile_image": 1, "category": 1}
+    # Add provider info and stats for the whole page (one query each)
+    event_ids = [event["event_id"] for event in events]
+    providers = {
+        p["provider_id"]: p
+        async for p in db.provider_profiles.find(
+            {"provider_id": {"$in": list({event.get("provider_id") for event in events})}},
+            {"_id": 0, "provider_id": 1, "business_name": 1, "profile_image": 1, "category": 1}
         )
-        event["provider"] = provider
-        
-        # Get likes count
-        event["likes_count"] = await db.event_likes.count_documents({"event_id": event["event_id"]})
-        
-        # Get comments count
-        event["comments_count"] = await db.event_comments.count_documents({"event_id": event["event_id"]})
+    }
+    likes = await _count_by_event(db.event_likes, event_ids)
+    comments = await _count_by_event(db.event_comments, event_ids)
+    
+    for event in events:
+        provider = providers.get(event.get("provider_id"))
+        event["provider"] = {k: v for k, v in provider.items() if k != "provider_id"} if provider else None
+        event["likes_count"] = likes.get(event["event_id"], 0)
+        event["comments_count"] = comments.get(event["event_id"], 0)
     
     return {
         "events": events,
@@ -144,6 +160,8 @@ async def get_event(event_id: str, request: Request):
     if not event:
         raise HTTPException(status_code=404, detail="Événement non trouvé")
     
+    counters.event_views.add(event_id)
+    
     # Get provider info
     provider = await db.provider_profiles.find_one(
         {"provider_id": event.get("provider_id")},
@@ -227,6 +245,8 @@ async def create_event(request: Request):
     }
     
     await db.community_events.insert_one(event)
+    await http_cache.invalidate("/api/events")
+    bootstrap.mark_stale()
     
     # Remove MongoDB _id before returning
     event.pop("_id", None)
@@ -268,6 +288,8 @@ async def update_event(event_id: str, request: Request):
         {"event_id": event_id},
         {"$set": update_data}
     )
+    await http_cache.invalidate("/api/events")
+    bootstrap.mark_stale()
     
     return {"message": "Événement mis à jour"}
 
@@ -290,6 +312,8 @@ async def delete_event(event_id: str, request: Request):
     await db.community_events.delete_one({"event_id": event_id})
     await db.event_likes.delete_many({"event_id": event_id})
     await db.event_comments.delete_many({"event_id": event_id})
+    await http_cache.invalidate("/api/events")
+    bootstrap.mark_stale()
     
     return {"message": "Événement supprimé"}
 
@@ -0,0 +1,364 @@
+"""
+HTTP Cache
+Shared in-memory cache of public GET responses with strong ETags (304 on
+If-None-Match), Cache-Control per route policy, stale-while-revalidate and
+single-flight recomputation, so a burst of misses runs the endpoint once.
+Invalidations bump a version stamp in cache_versions that every worker
+polls, so edits show up everywhere within POLL_INTERVAL.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from starlette.datastructures import Headers
+
+import settings_service
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = int(os.environ.get('HTTP_CACHE_MAX_ENTRIES', '2000'))
+MAX_BODY_SIZE = 1024 * 1024  # larger responses are not cached
+# How often each worker checks for invalidations made by the others
+POLL_INTERVAL = float(os.environ.get('HTTP_CACHE_POLL_INTERVAL', '2'))
+SEQUENCE_ID = "http"  # _id of the invalidation counter in cache_versions
+
+# Response headers kept with a cached body (CORS and the like are added per request)
+STORED_HEADERS = {b"content-type", b"content-language"}
+
+
+@dataclass(frozen=True)
+class Policy:
+    ttl: float  # seconds a response is served from this cache
+    max_age: int = 0  # seconds browsers may reuse it without asking
+    stale_while_revalidate: int = 0  # seconds a stale copy may be served while it is refreshed
+    versioned: bool = False  # built from settings: keyed on the settings version
+
+    @property
+    def cache_control(self) -> str:
+        directives = ["public", f"max-age={self.max_age}" if self.max_age else "no-cache"]
+        if self.stale_while_revalidate:
+            directives.append(f"stale-while-revalidate={self.stale_while_revalidate}")
+        return ", ".join(directives)
+
+
+# Settings change rarely and bump a version: admin edits show up immediately
+SETTINGS = Policy(ttl=600, max_age=60, stale_while_revalidate=600, versioned=True)
+# Public listings: a few seconds of staleness is fine
+LISTING = Policy(ttl=30, max_age=30, stale_while_revalidate=120)
+# Provider pages: browsers revalidate every time (cheap 304s) so edits show quickly
+DETAIL = Policy(ttl=15, stale_while_revalidate=60)
+
+ROUTES: List[Tuple[re.Pattern, Policy]] = [
+    (re.compile(r"/api/site-content"), SETTINGS),
+    (re.compile(r"/api/admin/public/site-content"), SETTINGS),
+    (re.compile(r"/api/categories/(events|pro)"), SETTINGS),
+    (re.compile(r"/api/subscriptions/plans"), SETTINGS),
+    (re.compile(r"/api/packs"), LISTING),
+    (re.compile(r"/api/packages"), LISTING),
+    (re.compile(r"/api/events"), LISTING),
+    (re.compile(r"/api/providers/[^/]+"), DETAIL),
+    (re.compile(r"/api/providers/[^/]+/page"), DETAIL),
+]
+
+
+@dataclass
+class Entry:
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+    etag: Optional[str]
+    fresh_until: float
+    stale_until: float
+
+    @property
+    def cacheable(self) -> bool:
+        return self.etag is not None
+
+
+_entries: Dict[tuple, Entry] = {}
+_inflight: Dict[tuple, asyncio.Task] = {}
+_background: set = set()
+# Path prefix -> number of its last invalidation, part of the cache key
+_versions: Dict[str, int] = {}
+_state = {"seen": 0}
+_worker_task: Optional[asyncio.Task] = None
+_listeners: List[Callable[[str], None]] = []
+
+_stats = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "not_modified": 0,
+    "uncacheable": 0,
+    "invalidations_published": 0,
+    "invalidations_received": 0,
+}
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the index the invalidation poll relies on"""
+    await get_db().cache_versions.create_index([("kind", 1), ("version", 1)], sparse=True)
+
+
+def policy_for(path: str) -> Optional[Policy]:
+    for pattern, policy in ROUTES:
+        if pattern.fullmatch(path):
+            return policy
+    return None
+
+
+def content_version(path: str) -> int:
+    """Last invalidation of the path or of any of its parents (/api/providers, /api/providers/<id>, ...)"""
+    parts = path.split("/")
+    return max(_versions.get("/".join(parts[:end]), 0) for end in range(3, len(parts) + 1))
+
+
+def _apply(prefix: str, version: int):
+    if version <= _versions.get(prefix, 0):
+        return
+    _versions[prefix] = version
+    for key in [key for key in _entries if key[0] == prefix or key[0].startswith(prefix + "/")]:
+        del _entries[key]
+
+
+async def invalidate(path_prefix: str):
+    """
+    Drop the cached responses under path_prefix (whole path segments) in
+    every worker: here at once, elsewhere at their next poll
+    """
+    prefix = path_prefix.rstrip("/")
+    db = get_db()
+    stamp = await db.cache_versions.find_one_and_update(
+        {"_id": SEQUENCE_ID}, {"$inc": {"seq": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    await db.cache_versions.update_one(
+        {"_id": f"http:{prefix}"},
+        {"$set": {"kind": "http", "prefix": prefix}, "$max": {"version": stamp["seq"]}},
+        upsert=True
+    )
+    _stats["invalidations_published"] += 1
+    _apply(prefix, stamp["seq"])
+
+
+def on_change(listener: Callable[[str], None]):
+    """Call listener(path_prefix) when another worker invalidates a prefix"""
+    _listeners.append(listener)
+
+
+def etag_for(body: bytes) -> str:
+    """Strong ETag of a response body"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header covers etag"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+# ============ FETCH ============
+
+async def _fetch(app, scope: dict, policy: Policy) -> Entry:
+    """Run the endpoint with a bodyless request and capture its response"""
+    status, headers, chunks = 500, [], []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # the response does not depend on the client staying
+
+    async def send(message):
+        nonlocal status, headers
+        if message["type"] == "http.response.start":
+            status, headers = message["status"], list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(dict(scope), receive, send)
+    body = b"".join(chunks)
+    now = time.monotonic()
+    cacheable = (
+        status == 200
+        and len(body) <= MAX_BODY_SIZE
+        and not any(name.lower() in (b"set-cookie", b"cache-control") for name, _ in headers)
+    )
+    if not cacheable:
+        _stats["uncacheable"] += 1
+        return Entry(status, headers, body, None, now, now)
+    headers = [(name, value) for name, value in headers if name.lower() in STORED_HEADERS]
+    return Entry(status, headers, body, etag_for(body), now + policy.ttl,
+                 now + policy.ttl + policy.stale_while_revalidate)
+
+
+async def _refresh(app, key: tuple, scope: dict, policy: Policy) -> Entry:
+    """Fetch once per key however many requests are waiting for it"""
+    task = _inflight.get(key)
+    if task is not None:
+        _stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def run() -> Entry:
+        try:
+            entry = await _fetch(app, scope, policy)
+            if entry.cacheable:
+                if key not in _entries and len(_entries) >= MAX_ENTRIES:
+                    del _entries[next(iter(_entries))]  # oldest first
+                _entries[key] = entry
+            return entry
+        finally:
+            _inflight.pop(key, None)
+
+    task = asyncio.create_task(run())
+    _inflight[key] = task
+    return await asyncio.shield(task)
+
+
+# ============ MIDDLEWARE ============
+
+class HTTPCacheMiddleware:
+    """ASGI middleware serving the ROUTES from the cache"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        policy = policy_for(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = (scope["path"], scope.get("query_string", b""), content_version(scope["path"]))
+        if policy.versioned:
+            key += (settings_service.version(),)
+
+        now = time.monotonic()
+        entry = _entries.get(key)
+        if entry and entry.fresh_until > now:
+            _stats["hits"] += 1
+            state = "HIT"
+        elif entry and entry.stale_until > now:
+            _stats["stale_hits"] += 1
+            state = "STALE"
+            if key not in _inflight:
+                task = asyncio.create_task(self._background_refresh(key, scope, policy))
+                _background.add(task)
+                task.add_done_callback(_background.discard)
+        else:
+            _stats["misses"] += 1
+            state = "MISS"
+            entry = await _refresh(self.app, key, scope, policy)
+
+        await self._respond(entry, policy, state, Headers(scope=scope), send)
+
+    async def _background_refresh(self, key, scope, policy):
+        try:
+            await _refresh(self.app, key, scope, policy)
+        except Exception as e:
+            logger.error(f"HTTP cache refresh of {key[0]} failed: {e}")
+
+    async def _respond(self, entry: Entry, policy: Policy, state: str, request_headers: Headers, send):
+        if not entry.cacheable:
+            await send({"type": "http.response.start", "status": entry.status, "headers": entry.headers})
+            await send({"type": "http.response.body", "body": entry.body})
+            return
+
+        headers = [
+            (b"etag", entry.etag.encode()),
+            (b"cache-control", policy.cache_control.encode()),
+            (b"x-cache", state.encode()),
+        ]
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, entry.etag):
+            _stats["not_modified"] += 1
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        headers += entry.headers + [(b"content-length", str(len(entry.body)).encode())]
+        await send({"type": "http.response.start", "status": entry.status, "headers": headers})
+        await send({"type": "http.response.body", "body": entry.body})
+
+
+# ============ WORKER ============
+
+async def poll() -> int:
+    """Apply the invalidations published since the last poll. Returns their number."""
+    changed = await get_db().cache_versions.find(
+        {"kind": "http", "version": {"$gt": _state["seen"]}}, {"_id": 0, "prefix": 1, "version": 1}
+    ).to_list(None)
+    for doc in changed:
+        _state["seen"] = max(_state["seen"], doc["version"])
+        if doc["version"] > _versions.get(doc["prefix"], 0):
+            _stats["invalidations_received"] += 1
+            _apply(doc["prefix"], doc["version"])
+            for listener in _listeners:
+                listener(doc["prefix"])
+    return len(changed)
+
+
+async def _worker_loop():
+    # Nothing is cached yet: only invalidations from now on matter (replaying
+    # older ones if this read fails is harmless)
+    try:
+        stamp = await get_db().cache_versions.find_one({"_id": SEQUENCE_ID})
+        _state["seen"] = max(_state["seen"], stamp["seq"] if stamp else 0)
+    except Exception as e:
+        logger.error(f"HTTP cache invalidation stamp read error: {e}")
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        try:
+            await poll()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"HTTP cache invalidation poll error: {e}")
+
+
+def start_worker():
+    """Start polling for invalidations (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop polling for invalidations"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+# ============ METRICS ============
+
+def stats() -> dict:
+    lookups = _stats["hits"] + _stats["stale_hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": round((_stats["hits"] + _stats["stale_hits"]) / lookups, 3) if lookups else None,
+        "entries": len(_entries),
+        "invalidated_prefixes": len(_versions),
+        "max_entries": MAX_ENTRIES,
+    }
@@ -0,0 +1,230 @@
+"""
+Message Notifications
+Email notifications for chat messages, coalesced per recipient: unread
+messages wait for a quiet period and go out as one email (or a digest), and
+nothing is sent to recipients who are online or have read them
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+import conversations
+import realtime
+
+logger = logging.getLogger(__name__)
+
+# A digest goes out once no new message arrived for QUIET_PERIOD, and at the
+# latest MAX_DELAY after the first unread message
+QUIET_PERIOD = int(os.environ.get('MESSAGE_NOTIFICATION_QUIET_PERIOD', '300'))  # seconds
+MAX_DELAY = int(os.environ.get('MESSAGE_NOTIFICATION_MAX_DELAY', '1800'))  # seconds
+POLL_INTERVAL = float(os.environ.get('MESSAGE_NOTIFICATION_POLL_INTERVAL', '15'))
+MAX_ITEMS = 50  # messages kept per pending digest
+
+_worker_task: Optional[asyncio.Task] = None
+
+_stats = {
+    "scheduled": 0,
+    "sent_single": 0,
+    "sent_digest": 0,
+    "messages_sent": 0,
+    "suppressed_online": 0,
+    "suppressed_read": 0,
+    "suppressed_disabled": 0,
+    "failed": 0,
+}
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the indexes the scheduler relies on"""
+    db = get_db()
+    await db.pending_message_notifications.create_index("user_id", unique=True)
+    await db.pending_message_notifications.create_index("due_at")
+    await db.pending_message_notifications.create_index("deadline")
+
+
+# ============ SCHEDULING ============
+
+async def schedule(message: dict, sender_name: Optional[str] = None):
+    """
+    Queue the email notification of a stored message. Recipients online right
+    now are skipped; otherwise the message joins the recipient's pending digest
+    and pushes its send time back by QUIET_PERIOD.
+    """
+    receiver_id = message["receiver_id"]
+    if await realtime.is_online(receiver_id):
+        _stats["suppressed_online"] += 1
+        return
+
+    now = datetime.now(timezone.utc)
+    item = {
+        "message_id": message["message_id"],
+        "sender_id": message["sender_id"],
+        "sender_name": sender_name,
+        "preview": (message.get("content") or "")[:200],
+        "created_at": message.get("created_at", now.isoformat()),
+    }
+    await get_db().pending_message_notifications.update_one(
+        {"user_id": receiver_id},
+        {
+            "$setOnInsert": {
+                "first_at": now.isoformat(),
+                "deadline": (now + timedelta(seconds=MAX_DELAY)).isoformat(),
+            },
+            "$set": {"due_at": (now + timedelta(seconds=QUIET_PERIOD)).isoformat()},
+            "$push": {"items": {"$each": [item], "$slice": -MAX_ITEMS}},
+            "$inc": {"count": 1},
+        },
+        upsert=True
+    )
+    _stats["scheduled"] += 1
+
+
+# ============ DELIVERY ============
+
+async def _claim_due() -> Optional[dict]:
+    """Take one due digest; find_one_and_delete keeps workers from sending it twice"""
+    now = datetime.now(timezone.utc).isoformat()
+    return await get_db().pending_message_notifications.find_one_and_delete(
+        {"$or": [{"due_at": {"$lte": now}}, {"deadline": {"$lte": now}}]},
+        {"_id": 0}
+    )
+
+
+async def _sender_names(items: list) -> dict:
+    missing = list({i["sender_id"] for i in items if not i.get("sender_name")})
+    names = {i["sender_id"]: i["sender_name"] for i in items if i.get("sender_name")}
+    if missing:
+        async for user in get_db().users.find({"user_id": {"$in": missing}}, {"_id": 0, "user_id": 1, "name": 1}):
+            names[user["user_id"]] = user.get("name", "")
+    return names
+
+
+async def deliver(pending: dict):
+    """Send (or drop) one claimed digest"""
+    from email_service import send_message_digest_notification, send_new_message_notification
+
+    db = get_db()
+    user_id = pending["user_id"]
+    items = pending.get("items", [])
+    # Messages queued before the MAX_ITEMS cap are counted but not listed
+    dropped = max(pending.get("count", len(items)) - len(items), 0)
+
+    if await realtime.is_online(user_id):
+        _stats["suppressed_online"] += len(items) + dropped
+        return
+
+    # Read state lives in the conversations' read_at watermarks
+    messages = await db.messages.find(
+        {"message_id": {"$in": [i["message_id"] for i in items]}},
+        {"_id": 0, "message_id": 1, "conversation_id": 1, "receiver_id": 1, "created_at": 1, "read": 1}
+    ).to_list(len(items))
+    await conversations.apply_read_state(messages)
+    unread = {m["message_id"] for m in messages if not m["read"]}
+    _stats["suppressed_read"] += len(items) - len(unread)
+    items = [i for i in items if i["message_id"] in unread]
+    if not items:
+        _stats["suppressed_read"] += dropped
+        return
+
+    user = await db.users.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "email": 1, "name": 1, "notification_settings": 1}
+    )
+    settings = (user or {}).get("notification_settings") or {}
+    if not user or not user.get("email") or not settings.get("email_new_message", True):
+        _stats["suppressed_disabled"] += len(items) + dropped
+        return
+
+    names = await _sender_names(items)
+    if len(items) == 1 and not dropped:
+        item = items[0]
+        sent = await send_new_message_notification(
+            user["email"], user.get("name", ""), names.get(item["sender_id"], ""), item["preview"]
+        )
+        kind = "sent_single"
+    else:
+        by_sender = {}
+        for item in reversed(items):  # most recent first
+            entry = by_sender.setdefault(item["sender_id"], {
+                "sender_name": names.get(item["sender_id"], ""),
+                "count": 0,
+                "preview": item["preview"],
+            })
+            entry["count"] += 1
+        sent = await send_message_digest_notification(
+            user["email"], user.get("name", ""), list(by_sender.values()), len(items) + dropped
+        )
+        kind = "sent_digest"
+
+    if sent:
+        _stats[kind] += 1
+        _stats["messages_sent"] += len(items) + dropped
+    else:
+        _stats["failed"] += 1
+
+
+async def process_due() -> int:
+    """Deliver every due digest. Returns the number handled."""
+    handled = 0
+    while True:
+        pending = await _claim_due()
+        if not pending:
+            return handled
+        try:
+            await deliver(pending)
+        except Exception as e:
+            _stats["failed"] += 1
+            logger.error(f"Message notification for {pending.get('user_id')} failed: {e}")
+        handled += 1
+
+
+async def _worker_loop():
+    while True:
+        try:
+            await process_due()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Message notification worker error: {e}")
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def start_worker():
+    """Start the background worker (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop the background worker; pending digests stay stored for the next start"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+async def stats() -> dict:
+    pending = await get_db().pending_message_notifications.count_documents({})
+    sent = _stats["sent_single"] + _stats["sent_digest"]
+    suppressed = _stats["suppressed_online"] + _stats["suppressed_read"] + _stats["suppressed_disabled"]
+    return {
+        **_stats,
+        "emails_sent": sent,
+        "messages_suppressed": suppressed,
+        "pending_digests": pending,
+        "quiet_period": QUIET_PERIOD,
+        "max_delay": MAX_DELAY,
+    }
@@ -0,0 +1,178 @@
+"""
+Message Pipeline
+Post-processing of sent messages (conversation summary, moderation, email
+notification scheduling) on a bounded background queue, off the delivery path
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+import conversations
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.environ.get('MESSAGE_PIPELINE_QUEUE_SIZE', '10000'))
+WORKERS = int(os.environ.get('MESSAGE_PIPELINE_WORKERS', '4'))
+MAX_ATTEMPTS = int(os.environ.get('MESSAGE_PIPELINE_MAX_ATTEMPTS', '3'))
+RETRY_DELAY = 0.5  # seconds, doubled on each attempt
+DRAIN_TIMEOUT = 10  # seconds allowed on shutdown to finish queued jobs
+
+# Steps run in this order; each one is retried on its own
+STEPS = ("summary", "moderation", "email")
+
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+_retries: set = set()
+
+_stats = {
+    "submitted": 0,
+    "processed": 0,
+    "retried": 0,
+    "failed": 0,
+    "inline": 0,
+    "job_seconds": 0.0,
+}
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+# ============ STEPS ============
+
+async def _summary(message: dict, job: dict):
+    # Retrying the unread increment would count the message twice: once it
+    # went through, a retry only redoes the preview
+    if not job.get("counted"):
+        await conversations.count_message(message)
+        job["counted"] = True
+    await conversations.update_preview(message)
+
+
+async def _moderation(message: dict, job: dict):
+    from admin import check_message_for_moderation
+    await check_message_for_moderation(message)
+
+
+async def _email(message: dict, job: dict):
+    import message_notifications
+    await message_notifications.schedule(message, job.get("sender_name"))
+
+
+_HANDLERS = {
+    "summary": _summary,
+    "moderation": _moderation,
+    "email": _email,
+}
+
+
+# ============ QUEUE ============
+
+async def submit(message: dict, steps=STEPS, sender_name: Optional[str] = None):
+    """
+    Queue the post-processing of a stored (and already delivered) message.
+    When the queue is full, or the workers are not running, the job runs in
+    the caller instead, so nothing is dropped and senders feel the backpressure.
+    """
+    job = {"message": message, "steps": list(steps), "attempt": 1, "sender_name": sender_name}
+    _stats["submitted"] += 1
+    if _queue is not None and _workers:
+        try:
+            _queue.put_nowait(job)
+            return
+        except asyncio.QueueFull:
+            pass
+    _stats["inline"] += 1
+    await _process(job)
+
+
+async def _process(job: dict):
+    """Run the remaining steps of a job; failed steps are retried later"""
+    started = time.perf_counter()
+    message = job["message"]
+    failed = []
+    for step in job["steps"]:
+        try:
+            await _HANDLERS[step](message, job)
+        except Exception as e:
+            logger.warning(f"Message pipeline step {step} failed for {message.get('message_id')} "
+                           f"(attempt {job['attempt']}): {e}")
+            failed.append(step)
+    _stats["job_seconds"] += time.perf_counter() - started
+
+    if not failed:
+        _stats["processed"] += 1
+    elif job["attempt"] >= MAX_ATTEMPTS:
+        _stats["failed"] += 1
+        logger.error(f"Message pipeline gave up on {message.get('message_id')}: {failed}")
+    else:
+        _stats["retried"] += 1
+        retry = {**job, "steps": failed, "attempt": job["attempt"] + 1}
+        task = asyncio.create_task(_retry_later(retry, RETRY_DELAY * 2 ** (job["attempt"] - 1)))
+        _retries.add(task)
+        task.add_done_callback(_retries.discard)
+
+
+async def _retry_later(job: dict, delay: float):
+    await asyncio.sleep(delay)
+    if _queue is not None and _workers:
+        await _queue.put(job)
+    else:
+        await _process(job)
+
+
+async def _worker_loop():
+    while True:
+        job = await _queue.get()
+        try:
+            await _process(job)
+        except Exception as e:
+            logger.error(f"Message pipeline worker error: {e}")
+        finally:
+            _queue.task_done()
+
+
+def start_workers():
+    """Start the pipeline workers (once per process)"""
+    global _queue
+    if _workers:
+        return
+    _queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    for _ in range(max(WORKERS, 1)):
+        _workers.append(asyncio.create_task(_worker_loop()))
+
+
+async def stop_workers():
+    """Finish the queued jobs (up to DRAIN_TIMEOUT), then stop the workers"""
+    global _queue
+    if _queue is not None:
+        try:
+            await asyncio.wait_for(_queue.join(), timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Message pipeline stopped with {_queue.qsize()} jobs pending")
+    for task in list(_workers) + list(_retries):
+        task.cancel()
+    for task in list(_workers) + list(_retries):
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _workers.clear()
+    _retries.clear()
+    _queue = None
+
+
+def stats() -> dict:
+    runs = _stats["processed"] + _stats["failed"] + _stats["retried"]
+    return {
+        **{k: v for k, v in _stats.items() if k != "job_seconds"},
+        "queued": _queue.qsize() if _queue is not None else 0,
+        "queue_size": QUEUE_SIZE,
+        "workers": len(_workers),
+        "pending_retries": len(_retries),
+        "avg_job_ms": round(_stats["job_seconds"] / runs * 1000, 2) if runs else 0.0,
+    }
@@ -0,0 +1,175 @@
+"""
+Message Moderation
+Keyword matching for flagged messages: an Aho-Corasick automaton over
+normalized text (accents, case, leetspeak, inserted punctuation), cached
+per process and rebuilt when the settings version changes
+"""
+import string
+import unicodedata
+from collections import deque
+from typing import List, Optional
+
+import settings_service
+
+# Keywords this short only match whole words ("tg" must not hit "mortgage")
+SHORT_KEYWORD_LENGTH = 4
+
+DEFAULT_FLAGGED_KEYWORDS = [
+    # Contact hors plateforme
+    "whatsapp", "telegram", "signal", "viber", "skype",
+    "mon numéro", "mon numero", "appelle-moi", "appelle moi",
+    "contacte-moi", "contacte moi", "mon email", "mon mail",
+    "hors plateforme", "en dehors", "sans passer par",
+    # Paiement hors plateforme
+    "virement", "espèces", "cash", "liquide", "paypal direct",
+    "paiement direct", "sans commission", "éviter les frais",
+    # Contenu inapproprié
+    "arnaque", "escroquerie", "faux", "frauduleux",
+    # Mots vulgaires/offensants (basiques)
+    "merde", "putain", "connard", "salaud", "enculé",
+    "nique", "fdp", "ntm", "tg", "ferme ta gueule"
+]
+
+LEET = str.maketrans({
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b",
+    "@": "a", "$": "s", "€": "e", "!": "i", "|": "l"
+})
+# Leading/trailing punctuation is dropped before the leetspeak mapping
+EDGE_PUNCTUATION = "".join(c for c in string.punctuation if c not in "@$") + "«»“”’…"
+
+_cache = {"version": None, "matcher": None}
+
+
+# ============ NORMALIZATION ============
+
+def normalize(text: str) -> str:
+    """
+    Lowercase, strip accents, undo leetspeak and drop punctuation inside words,
+    then glue runs of single letters ("w h a t s a p p"). Words stay separated
+    by single spaces.
+    """
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold()
+
+    words = []
+    letters = []  # run of single-character words
+    for token in text.split():
+        if not token.isalpha():
+            token = token.strip(EDGE_PUNCTUATION)
+            if any(c.isalpha() for c in token):
+                token = token.translate(LEET)
+            if not token.isalnum():
+                token = "".join(c for c in token if c.isalnum())
+        if len(token) == 1:
+            letters.append(token)
+            continue
+        if letters:
+            words.append("".join(letters))
+            letters = []
+        if token:
+            words.append(token)
+    if letters:
+        words.append("".join(letters))
+    return " ".join(words)
+
+
+# ============ AUTOMATON ============
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over normalized keywords"""
+
+    def __init__(self, keywords: List[str]):
+        self.source = list(keywords)
+        self.keywords = []  # original keyword of each pattern
+        goto = [{}]
+        outputs = [[]]
+
+        for keyword in keywords:
+            pattern = normalize(keyword)
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    outputs.append([])
+                state = next_state
+            if not outputs[state]:  # keep the first keyword of a normalized duplicate
+                outputs[state].append((len(self.keywords), len(pattern)))
+                self.keywords.append(keyword)
+
+        # Failure links, breadth-first; outputs of the suffix state are merged in
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                outputs[next_state] = outputs[next_state] + outputs[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def find(self, text: str) -> List[str]:
+        """Keywords present in text, in order of first appearance"""
+        text = normalize(text)
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        found = {}
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                for index, length in outputs[state]:
+                    if index in found:
+                        continue
+                    if length <= SHORT_KEYWORD_LENGTH:
+                        start = end - length + 1
+                        if (start > 0 and text[start - 1] != " ") or (end + 1 < len(text) and text[end + 1] != " "):
+                            continue
+                    found[index] = end
+        return [self.keywords[index] for index in sorted(found, key=found.get)]
+
+
+# ============ CACHE ============
+
+async def get_matcher() -> Optional[KeywordMatcher]:
+    """Matcher for the current keyword config (None when moderation is off)"""
+    version = settings_service.version()
+    if version is not None and _cache["version"] == version:
+        return _cache["matcher"]
+
+    config = await settings_service.moderation_config()
+    if not config or not config.get("enabled", True):
+        matcher = None
+    else:
+        keywords = config.get("keywords", DEFAULT_FLAGGED_KEYWORDS)
+        current = _cache["matcher"]
+        if current is not None and current.source == keywords:
+            matcher = current
+        else:
+            matcher = KeywordMatcher(keywords)
+    _cache.update(version=settings_service.version(), matcher=matcher)
+    return matcher
+
+
+async def find_keywords(content: str) -> List[str]:
+    matcher = await get_matcher()
+    if matcher is None or not content:
+        return []
+    return matcher.find(content)
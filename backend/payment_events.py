@@ -0,0 +1,384 @@
+"""
+Stripe Webhook Event Pipeline
+Records webhook events keyed by Stripe event ID, acknowledges them immediately
+and applies them exactly once from a background worker
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import conversations
+import rollups
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.environ.get('PAYMENT_EVENTS_POLL_INTERVAL', '2'))
+MAX_ATTEMPTS = int(os.environ.get('PAYMENT_EVENTS_MAX_ATTEMPTS', '8'))
+# A claimed event not finished within this delay is considered abandoned
+# (worker crashed or was restarted) and can be claimed again
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+_worker_task: Optional[asyncio.Task] = None
+_wakeup = asyncio.Event()
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the indexes the pipeline relies on"""
+    db = get_db()
+    await db.stripe_events.create_index("event_id", unique=True)
+    await db.stripe_events.create_index([("status", 1), ("next_attempt_at", 1)])
+    await db.payment_transactions.create_index("session_id")
+    await db.marketplace_transactions.create_index("session_id")
+
+
+# ============ EVENT STORE ============
+
+async def record_webhook_event(
+    event_id: str,
+    event_type: str,
+    session_id: Optional[str],
+    payment_status: Optional[str],
+    metadata: Optional[dict] = None
+) -> bool:
+    """Store a webhook event. Returns False if the event was already recorded."""
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+
+    try:
+        await db.stripe_events.insert_one({
+            "event_id": event_id,
+            "event_type": event_type,
+            "session_id": session_id,
+            "payment_status": payment_status,
+            "metadata": metadata or {},
+            "status": "pending",  # pending, processing, processed, failed
+            "attempts": 0,
+            "last_error": None,
+            "received_at": now,
+            "next_attempt_at": now,
+            "processed_at": None
+        })
+    except DuplicateKeyError:
+        logger.info(f"Duplicate Stripe event ignored: {event_id}")
+        return False
+
+    _wakeup.set()
+    return True
+
+
+# ============ APPLY PAYMENTS (IDEMPOTENT) ============
+
+# Set with the pending -> paid transition; each flag turns True once its
+# side effect has been claimed (see _run_once)
+PENDING_SIDE_EFFECTS = {"provider_notified": False, "revenue_recorded": False, "payer_notified": False}
+
+def compute_booking_payment_status(booking: dict) -> str:
+    """Derive the booking payment status from the amount already paid"""
+    total_amount = float(booking['total_amount'])
+    deposit_paid = float(booking.get('deposit_paid', 0))
+
+    if deposit_paid >= total_amount:
+        return "paid"
+    if deposit_paid >= float(booking.get('deposit_required', total_amount * 0.3)):
+        return "partial"
+    return "pending"
+
+
+async def apply_booking_payment(session_id: str) -> Optional[dict]:
+    """
+    Mark a booking transaction as paid and credit its booking.
+    Every step is guarded by the state it changes, so concurrent or repeated
+    calls (webhook retries, status polls, worker restarts) apply it only once.
+    Returns the transaction if it is paid, None otherwise.
+    """
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+
+    # 1. pending -> paid transition on the transaction; the side effects
+    #    below are marked pending along with it
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$nin": ["paid", "refunded"]}},
+        {"$set": {"payment_status": "paid", "paid_at": now, "updated_at": now, **PENDING_SIDE_EFFECTS}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not transaction:
+        transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+        if not transaction or transaction['payment_status'] != 'paid':
+            return None
+
+    # 2. Credit the booking once per transaction
+    booking = await db.bookings.find_one_and_update(
+        {
+            "booking_id": transaction['booking_id'],
+            "applied_transaction_ids": {"$ne": transaction['transaction_id']}
+        },
+        {
+            "$inc": {"deposit_paid": transaction['amount']},
+            "$push": {"applied_transaction_ids": transaction['transaction_id']},
+            "$set": {"updated_at": now}
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not booking:
+        booking = await db.bookings.find_one({"booking_id": transaction['booking_id']}, {"_id": 0})
+    if booking:
+        # Only write the status if no other payment landed in between;
+        # a later increment computes its own status. Rewritten on every
+        # call, in case a previous one stopped right after the credit.
+        await db.bookings.update_one(
+            {"booking_id": booking['booking_id'], "deposit_paid": booking['deposit_paid']},
+            {"$set": {"payment_status": compute_booking_payment_status(booking)}}
+        )
+
+    # 3. Side effects, each run once
+    if booking:
+        await _run_once(
+            "payment_transactions", transaction, "provider_notified",
+            lambda: _send_payment_message(transaction, booking)
+        )
+    await _run_once(
+        "payment_transactions", transaction, "revenue_recorded",
+        lambda: rollups.record_payment(transaction['amount'], transaction.get('paid_at') or now)
+    )
+    await _run_once(
+        "payment_transactions", transaction, "payer_notified",
+        lambda: notify_payment_confirmed(transaction['user_id'], {
+            "type": "booking",
+            "session_id": session_id,
+            "transaction_id": transaction['transaction_id'],
+            "booking_id": transaction['booking_id'],
+            "amount": transaction['amount'],
+            "booking_payment_status": compute_booking_payment_status(booking) if booking else None
+        })
+    )
+
+    return transaction
+
+
+async def _run_once(collection: str, transaction: dict, flag: str, action: Callable[[], Awaitable]):
+    """
+    Run a side effect of a paid transaction once. The flag is claimed before
+    the action and released if it fails, so the next retry runs it again.
+    Transactions paid before the flag existed never have it pending.
+    """
+    db = get_db()
+    claimed = await db[collection].update_one(
+        {"transaction_id": transaction['transaction_id'], flag: False},
+        {"$set": {flag: True}}
+    )
+    if not claimed.modified_count:
+        return
+    try:
+        await action()
+    except BaseException:
+        await db[collection].update_one(
+            {"transaction_id": transaction['transaction_id']},
+            {"$set": {flag: False}}
+        )
+        raise
+
+
+async def notify_payment_confirmed(user_id: str, payload: dict):
+    """Push the confirmation to the payer's Socket.IO room and drop cached status"""
+    from server import sio, payment_status_cache
+
+    payment_status_cache.pop(payload["session_id"], None)
+    if payload.get("inquiry_id"):
+        payment_status_cache.pop(payload["inquiry_id"], None)
+
+    try:
+        await sio.emit('payment_confirmed', {**payload, "status": "paid"}, room=user_id)
+    except Exception as e:
+        logger.warning(f"Payment confirmation push failed: {e}")
+
+
+async def _send_payment_message(transaction: dict, booking: dict):
+    """Post the 'payment received' message in the client/provider conversation"""
+    db = get_db()
+
+    provider = await db.provider_profiles.find_one(
+        {"provider_id": booking['provider_id']},
+        {"_id": 0, "user_id": 1}
+    )
+    payer = await db.users.find_one(
+        {"user_id": transaction['user_id']},
+        {"_id": 0, "name": 1}
+    )
+    if not provider:
+        return
+
+    payer_name = payer['name'] if payer else booking.get('client_name', 'Le client')
+    payment_msg = f"💳 Paiement reçu !\n\n{payer_name} a effectué un paiement de {transaction['amount']}€"
+    if transaction.get('payment_type') == 'installment':
+        payment_msg += f" (versement {transaction['installment_number']}/{transaction['total_installments']})"
+    payment_msg += f"\n\nRéférence: {transaction['booking_id']}\nTotal payé: {booking.get('deposit_paid', 0)}€ / {booking['total_amount']}€"
+
+    await conversations.insert_message({
+        "message_id": f"msg_{uuid.uuid4().hex[:12]}",
+        "sender_id": transaction['user_id'],
+        "receiver_id": provider['user_id'],
+        "content": payment_msg,
+        "read": False,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+
+
+async def apply_marketplace_payment(session_id: str) -> Optional[dict]:
+    """Mark a marketplace transaction as paid and close the sale (idempotent)"""
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+
+    transaction = await db.marketplace_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+        {"$set": {"payment_status": "paid", "paid_at": now, "updated_at": now, "payer_notified": False}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not transaction:
+        transaction = await db.marketplace_transactions.find_one({"session_id": session_id}, {"_id": 0})
+        if not transaction or transaction['payment_status'] != 'paid':
+            return None
+
+    # Plain $set updates: replaying them is harmless
+    await db.marketplace_items.update_one(
+        {"item_id": transaction['item_id']},
+        {"$set": {"status": "sold"}}
+    )
+    await db.marketplace_inquiries.update_one(
+        {"inquiry_id": transaction['inquiry_id']},
+        {"$set": {"status": "paid"}}
+    )
+
+    await _run_once(
+        "marketplace_transactions", transaction, "payer_notified",
+        lambda: notify_payment_confirmed(transaction['buyer_id'], {
+            "type": "marketplace",
+            "session_id": session_id,
+            "transaction_id": transaction['transaction_id'],
+            "inquiry_id": transaction['inquiry_id'],
+            "amount": transaction['amount'],
+            "item_title": transaction.get('item_title')
+        })
+    )
+
+    return transaction
+
+
+async def apply_paid_session(session_id: str, metadata: Optional[dict] = None) -> Optional[dict]:
+    """Apply a paid checkout session to whichever transaction owns it"""
+    if (metadata or {}).get("type") == "marketplace":
+        return await apply_marketplace_payment(session_id)
+
+    transaction = await apply_booking_payment(session_id)
+    if transaction is None:
+        transaction = await apply_marketplace_payment(session_id)
+    return transaction
+
+
+# ============ WORKER ============
+
+async def _claim_next_event() -> Optional[dict]:
+    """Atomically claim the oldest event that is due"""
+    db = get_db()
+    now = datetime.now(timezone.utc)
+
+    return await db.stripe_events.find_one_and_update(
+        {"$or": [
+            {"status": {"$in": ["pending", "failed"]}, "next_attempt_at": {"$lte": now.isoformat()}},
+            {"status": "processing", "claimed_at": {"$lte": (now - CLAIM_TIMEOUT).isoformat()}}
+        ]},
+        {"$set": {"status": "processing", "claimed_at": now.isoformat()}, "$inc": {"attempts": 1}},
+        projection={"_id": 0},
+        sort=[("received_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def process_event(event: dict):
+    """Apply a single stored event"""
+    if event.get("payment_status") == "paid" and event.get("session_id"):
+        await apply_paid_session(event["session_id"], event.get("metadata"))
+
+
+async def process_pending_events() -> int:
+    """Drain every due event. Returns the number of events handled."""
+    db = get_db()
+    handled = 0
+
+    while True:
+        event = await _claim_next_event()
+        if not event:
+            return handled
+
+        try:
+            await process_event(event)
+            await db.stripe_events.update_one(
+                {"event_id": event["event_id"]},
+                {"$set": {
+                    "status": "processed",
+                    "processed_at": datetime.now(timezone.utc).isoformat(),
+                    "last_error": None
+                }}
+            )
+        except Exception as e:
+            logger.error(f"Stripe event {event['event_id']} failed: {e}")
+            attempts = event.get("attempts", 1)
+            delay = timedelta(seconds=min(2 ** attempts, 600))
+            await db.stripe_events.update_one(
+                {"event_id": event["event_id"]},
+                {"$set": {
+                    "status": "failed" if attempts < MAX_ATTEMPTS else "dead",
+                    "last_error": str(e),
+                    "next_attempt_at": (datetime.now(timezone.utc) + delay).isoformat()
+                }}
+            )
+        handled += 1
+
+
+async def _worker_loop():
+    while True:
+        try:
+            await process_pending_events()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Stripe event worker error: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_worker():
+    """Start the background worker (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop the background worker"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
@@ -0,0 +1,459 @@
+"""
+Payment Gateway Client
+One gateway client per process for every Stripe call (checkout, status, webhooks,
+subscriptions) with timeouts, retries with jitter, a circuit breaker and latency
+metrics. Set PAYMENT_GATEWAY=fake to use the in-process fake gateway.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = float(os.environ.get('PAYMENT_GATEWAY_TIMEOUT', '10'))
+MAX_RETRIES = int(os.environ.get('PAYMENT_GATEWAY_MAX_RETRIES', '2'))
+BACKOFF_BASE = 0.2  # seconds
+BACKOFF_MAX = 2.0
+BREAKER_THRESHOLD = int(os.environ.get('PAYMENT_GATEWAY_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('PAYMENT_GATEWAY_BREAKER_COOLDOWN', '30'))
+
+
+class PaymentGatewayError(Exception):
+    """Raised when the payment provider call failed"""
+
+
+class CircuitOpenError(PaymentGatewayError):
+    """Raised without calling the provider while the circuit breaker is open"""
+
+
+@dataclass
+class CheckoutSession:
+    session_id: str
+    url: str
+
+
+@dataclass
+class CheckoutStatus:
+    status: str  # open, complete, expired
+    payment_status: str  # unpaid, paid, no_payment_required
+    metadata: dict = field(default_factory=dict)
+    subscription: Optional[str] = None
+
+
+@dataclass
+class WebhookEvent:
+    event_id: str
+    event_type: str
+    session_id: Optional[str]
+    payment_status: Optional[str]
+    metadata: dict = field(default_factory=dict)
+
+
+# ============ RESILIENCE ============
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets one trial call through after the cooldown"""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError("Service de paiement temporairement indisponible")
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def release(self):
+        """The call failed for a reason that says nothing about the provider's health"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class LatencyMetrics:
+    """Per-operation call counters and latency percentiles over recent calls"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self.operations = {}
+
+    def _op(self, name: str) -> dict:
+        if name not in self.operations:
+            self.operations[name] = {
+                "calls": 0, "errors": 0, "retries": 0, "rejected": 0,
+                "latencies": deque(maxlen=self.window)
+            }
+        return self.operations[name]
+
+    def record(self, name: str, elapsed_ms: float, ok: bool):
+        op = self._op(name)
+        op["calls"] += 1
+        op["latencies"].append(elapsed_ms)
+        if not ok:
+            op["errors"] += 1
+
+    def record_retry(self, name: str):
+        self._op(name)["retries"] += 1
+
+    def record_rejected(self, name: str):
+        self._op(name)["rejected"] += 1
+
+    def snapshot(self) -> dict:
+        result = {}
+        for name, op in self.operations.items():
+            latencies = sorted(op["latencies"])
+
+            def pct(p):
+                if not latencies:
+                    return None
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+            result[name] = {
+                "calls": op["calls"],
+                "errors": op["errors"],
+                "retries": op["retries"],
+                "rejected": op["rejected"],
+                "p50_ms": pct(0.50),
+                "p95_ms": pct(0.95),
+                "p99_ms": pct(0.99)
+            }
+        return result
+
+
+# ============ GATEWAYS ============
+
+class PaymentGateway:
+    """Common call wrapper; implementations provide the _do_* coroutines"""
+
+    name = "base"
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.metrics = LatencyMetrics()
+
+    async def _call(self, op: str, fn: Callable[[], Awaitable], retries: int = MAX_RETRIES,
+                    breaker: bool = True):
+        attempt = 0
+        while True:
+            if breaker:
+                try:
+                    self.breaker.before_call()
+                except CircuitOpenError:
+                    self.metrics.record_rejected(op)
+                    raise
+
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(fn(), timeout=TIMEOUT)
+            except Exception as e:
+                self.metrics.record(op, (time.perf_counter() - start) * 1000, ok=False)
+                transient = self._is_transient(e)
+                # Client errors (bad request, card declined, bad signature)
+                # mean the provider answered: only outages open the breaker
+                if breaker and transient:
+                    self.breaker.record_failure()
+                elif breaker:
+                    self.breaker.release()
+                if attempt >= retries or not transient:
+                    logger.error(f"Payment gateway {op} failed: {e}")
+                    if isinstance(e, PaymentGatewayError):
+                        raise
+                    raise PaymentGatewayError(str(e)) from e
+                # Exponential backoff with full jitter
+                attempt += 1
+                self.metrics.record_retry(op)
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+                continue
+
+            self.metrics.record(op, (time.perf_counter() - start) * 1000, ok=True)
+            if breaker:
+                self.breaker.record_success()
+            return result
+
+    def _is_transient(self, error: Exception) -> bool:
+        """Timeouts and connection errors (plus 5xx and rate limits for Stripe)"""
+        return isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError))
+
+    def stats(self) -> dict:
+        return {
+            "gateway": self.name,
+            "circuit": self.breaker.state,
+            "operations": self.metrics.snapshot()
+        }
+
+    # The checkout client takes no idempotency key: a retry after a timeout
+    # could create a second session, so creation is not retried
+    async def create_checkout_session(self, amount: float, currency: str, success_url: str,
+                                      cancel_url: str, metadata: dict) -> CheckoutSession:
+        return await self._call("create_checkout_session", lambda: self._do_create_checkout_session(
+            amount, currency, success_url, cancel_url, metadata), retries=0)
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        return await self._call("get_checkout_status", lambda: self._do_get_checkout_status(session_id))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]) -> WebhookEvent:
+        # Signature checks are local: never retried, and anyone can post a bad
+        # payload, so they stay out of the circuit breaker
+        return await self._call("handle_webhook", lambda: self._do_handle_webhook(body, signature),
+                                retries=0, breaker=False)
+
+    async def create_subscription_session(self, customer_email: str, line_item: dict, success_url: str,
+                                          cancel_url: str, metadata: dict) -> CheckoutSession:
+        idempotency_key = f"sub_{uuid.uuid4().hex}"
+        return await self._call("create_subscription_session", lambda: self._do_create_subscription_session(
+            customer_email, line_item, success_url, cancel_url, metadata, idempotency_key))
+
+    async def retrieve_checkout_session(self, session_id: str) -> CheckoutStatus:
+        return await self._call("retrieve_checkout_session", lambda: self._do_retrieve_checkout_session(session_id))
+
+    async def cancel_subscription_at_period_end(self, subscription_id: str):
+        return await self._call("cancel_subscription", lambda: self._do_cancel_subscription(subscription_id))
+
+
+class StripeGateway(PaymentGateway):
+    """
+    Stripe gateway. One-off checkouts go through emergentintegrations (which
+    supports the platform proxy keys); subscriptions use the Stripe SDK with a
+    persistent HTTPX connection pool. Both clients are created once.
+    """
+
+    name = "stripe"
+
+    def __init__(self, api_key: Optional[str], secret_key: Optional[str], webhook_url: str):
+        super().__init__()
+        self.api_key = api_key
+        self.webhook_url = webhook_url
+        self._checkout = None
+        self._client = None
+        self._secret_key = secret_key
+
+    @property
+    def checkout(self):
+        if self._checkout is None:
+            if not self.api_key:
+                raise PaymentGatewayError("Payment not configured")
+            from emergentintegrations.payments.stripe.checkout import StripeCheckout
+            self._checkout = StripeCheckout(api_key=self.api_key, webhook_url=self.webhook_url)
+        return self._checkout
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self._secret_key:
+                raise PaymentGatewayError("Paiement non configuré")
+            import stripe
+            self._client = stripe.StripeClient(
+                self._secret_key,
+                http_client=stripe.HTTPXClient(timeout=TIMEOUT),
+                max_network_retries=0  # retries are handled by _call
+            )
+        return self._client
+
+    def _is_transient(self, error: Exception) -> bool:
+        import stripe
+        if isinstance(error, (stripe.APIConnectionError, stripe.RateLimitError)):
+            return True
+        if isinstance(error, stripe.APIError) and (error.http_status or 500) >= 500:
+            return True
+        return super()._is_transient(error)
+
+    async def _do_create_checkout_session(self, amount, currency, success_url, cancel_url, metadata):
+        from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
+        session = await self.checkout.create_checkout_session(CheckoutSessionRequest(
+            amount=amount,
+            currency=currency,
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata=metadata
+        ))
+        return CheckoutSession(session_id=session.session_id, url=session.url)
+
+    async def _do_get_checkout_status(self, session_id):
+        status = await self.checkout.get_checkout_status(session_id)
+        return CheckoutStatus(
+            status=status.status,
+            payment_status=status.payment_status,
+            metadata=getattr(status, 'metadata', None) or {}
+        )
+
+    async def _do_handle_webhook(self, body, signature):
+        event = await self.checkout.handle_webhook(body, signature)
+        return WebhookEvent(
+            event_id=getattr(event, 'event_id', None) or f"{event.event_type}:{event.session_id}",
+            event_type=event.event_type,
+            session_id=event.session_id,
+            payment_status=event.payment_status,
+            metadata=getattr(event, 'metadata', None) or {}
+        )
+
+    async def _do_create_subscription_session(self, customer_email, line_item, success_url,
+                                              cancel_url, metadata, idempotency_key):
+        session = await self.client.v1.checkout.sessions.create_async(
+            params={
+                "payment_method_types": ["card"],
+                "mode": "subscription",
+                "customer_email": customer_email,
+                "line_items": [line_item],
+                "success_url": success_url,
+                "cancel_url": cancel_url,
+                "metadata": metadata
+            },
+            options={"idempotency_key": idempotency_key}
+        )
+        return CheckoutSession(session_id=session.id, url=session.url)
+
+    async def _do_retrieve_checkout_session(self, session_id):
+        session = await self.client.v1.checkout.sessions.retrieve_async(session_id)
+        return CheckoutStatus(
+            status=session.status,
+            payment_status=session.payment_status,
+            metadata=dict(session.metadata or {}),
+            subscription=session.subscription
+        )
+
+    async def _do_cancel_subscription(self, subscription_id):
+        return await self.client.v1.subscriptions.update_async(
+            subscription_id,
+            params={"cancel_at_period_end": True}
+        )
+
+
+class FakePaymentGateway(PaymentGateway):
+    """
+    In-process gateway for tests and benchmarks: sessions live in memory,
+    complete_session() marks one paid and returns the matching webhook event.
+    Webhook bodies are plain JSON ({"id", "type", "data": {"object": ...}}).
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.sessions = {}
+
+    async def _simulate_latency(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _do_create_checkout_session(self, amount, currency, success_url, cancel_url, metadata):
+        await self._simulate_latency()
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            "amount": amount, "currency": currency, "metadata": dict(metadata),
+            "status": "open", "payment_status": "unpaid", "subscription": None
+        }
+        return CheckoutSession(
+            session_id=session_id,
+            url=success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+        )
+
+    async def _do_get_checkout_status(self, session_id):
+        await self._simulate_latency()
+        session = self.sessions.get(session_id)
+        if not session:
+            raise PaymentGatewayError(f"No such checkout session: {session_id}")
+        return CheckoutStatus(
+            status=session["status"],
+            payment_status=session["payment_status"],
+            metadata=session["metadata"],
+            subscription=session["subscription"]
+        )
+
+    async def _do_handle_webhook(self, body, signature):
+        payload = json.loads(body)
+        session = payload.get("data", {}).get("object", {})
+        return WebhookEvent(
+            event_id=payload["id"],
+            event_type=payload.get("type", "checkout.session.completed"),
+            session_id=session.get("id"),
+            payment_status=session.get("payment_status"),
+            metadata=session.get("metadata", {})
+        )
+
+    async def _do_create_subscription_session(self, customer_email, line_item, success_url,
+                                              cancel_url, metadata, idempotency_key):
+        session = await self._do_create_checkout_session(
+            line_item["price_data"]["unit_amount"] / 100, line_item["price_data"]["currency"],
+            success_url, cancel_url, metadata
+        )
+        self.sessions[session.session_id]["subscription"] = f"sub_fake_{uuid.uuid4().hex[:12]}"
+        return session
+
+    async def _do_retrieve_checkout_session(self, session_id):
+        return await self._do_get_checkout_status(session_id)
+
+    async def _do_cancel_subscription(self, subscription_id):
+        await self._simulate_latency()
+        return {"id": subscription_id, "cancel_at_period_end": True}
+
+    def complete_session(self, session_id: str) -> dict:
+        """Mark a session paid and return the webhook event Stripe would send"""
+        session = self.sessions[session_id]
+        session["status"] = "complete"
+        session["payment_status"] = "paid"
+        return {
+            "id": f"evt_fake_{uuid.uuid4().hex}",
+            "type": "checkout.session.completed",
+            "data": {"object": {
+                "id": session_id,
+                "payment_status": "paid",
+                "metadata": session["metadata"]
+            }}
+        }
+
+
+_gateway: Optional[PaymentGateway] = None
+
+
+def get_payment_gateway(base_url: Optional[str] = None) -> PaymentGateway:
+    """Return the process-wide gateway, creating it on first use"""
+    global _gateway
+    if _gateway is None:
+        if os.environ.get('PAYMENT_GATEWAY', 'stripe') == 'fake':
+            _gateway = FakePaymentGateway(latency=float(os.environ.get('FAKE_GATEWAY_LATENCY', '0')))
+        else:
+            webhook_url = os.environ.get('STRIPE_WEBHOOK_URL')
+            if not webhook_url and base_url:
+                webhook_url = f"{base_url.rstrip('/')}/api/webhook/stripe"
+            _gateway = StripeGateway(
+                api_key=os.environ.get('STRIPE_API_KEY'),
+                secret_key=os.environ.get('STRIPE_SECRET_KEY'),
+                webhook_url=webhook_url
+            )
+    return _gateway
+
+
+def set_payment_gateway(gateway: Optional[PaymentGateway]):
+    """Replace the process-wide gateway (tests and benchmarks)"""
+    global _gateway
+    _gateway = gateway
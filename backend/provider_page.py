@@ -0,0 +1,56 @@
+"""
+Provider Page
+Everything a provider page shows in one request: the sections are fetched
+concurrently, can be selected with ?fields=, and the response is cached per
+provider (see http_cache) until one of its sections changes in any worker
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+import http_cache
+
+router = APIRouter(prefix="/api/providers", tags=["providers"])
+
+SECTIONS = ("profile", "services", "packs", "portfolio", "reviews", "availability", "presence")
+
+
+async def invalidate(provider_id: Optional[str]):
+    """Drop the cached page (and profile) of a provider in every worker after a write to one of its sections"""
+    if provider_id:
+        await http_cache.invalidate(f"/api/providers/{provider_id}")
+
+
+@router.get("/{provider_id}/page")
+async def get_provider_page(
+    provider_id: str,
+    fields: Optional[str] = Query(None, description="Comma-separated sections, all by default"),
+    month: Optional[str] = Query(None, description="Availability month (YYYY-MM), current month by default"),
+    reviews_limit: int = Query(10, ge=0, le=50)
+):
+    """Provider profile, services, packs, portfolio, reviews, availability and presence"""
+    from server import (
+        get_provider, get_provider_services, get_provider_packs, get_provider_portfolio,
+        get_provider_reviews, get_month_availability_status, get_provider_country_presence
+    )
+
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(SECTIONS)
+    unknown = set(selected) - set(SECTIONS)
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Sections invalides: {', '.join(sorted(unknown)) or 'aucune'}")
+
+    month = month or datetime.now(timezone.utc).strftime("%Y-%m")
+    loaders = {
+        "profile": lambda: get_provider(provider_id),
+        "services": lambda: get_provider_services(provider_id, include_inactive=False),
+        "packs": lambda: get_provider_packs(provider_id),
+        "portfolio": lambda: get_provider_portfolio(provider_id),
+        "reviews": lambda: get_provider_reviews(provider_id, limit=reviews_limit, skip=0),
+        "availability": lambda: get_month_availability_status(provider_id, month=month),
+        "presence": lambda: get_provider_country_presence(provider_id),
+    }
+    sections = [section for section in SECTIONS if section in selected]
+    results = await asyncio.gather(*(loaders[section]() for section in sections))
+    return {"provider_id": provider_id, **dict(zip(sections, results))}
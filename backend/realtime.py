@@ -0,0 +1,589 @@
+"""
+Real-time Layer
+Socket.IO server factory with a pluggable client manager and cluster-wide
+presence, so several workers or nodes can share the connected sockets.
+
+Settings:
+- SOCKETIO_MESSAGE_QUEUE: empty (single process, in-memory), a redis:// /
+  rediss:// / valkey:// URL, or a mongodb:// URL ("mongo" reuses MONGO_URL)
+- SOCKETIO_CHANNEL: pub/sub channel shared by every node
+- SOCKETIO_TRANSPORTS: "websocket,polling" by default. Long-polling needs
+  sticky sessions; behind a load balancer without them use "websocket".
+- SOCKETIO_MSGPACK: "1" (default) lets clients connecting with
+  ?serializer=msgpack use the msgpack parser; others keep JSON
+- SOCKETIO_HTTP_COMPRESSION / SOCKETIO_COMPRESSION_THRESHOLD: gzip/deflate of
+  long-polling responses. WebSocket frames use permessage-deflate, negotiated
+  by uvicorn (--ws-per-message-deflate, on by default).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from http.cookies import CookieError, SimpleCookie
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+import socketio
+from engineio import packet as eio_packet
+from socketio import packet
+from socketio.async_pubsub_manager import AsyncPubSubManager
+from socketio.msgpack_packet import MsgPackPacket
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process in the presence collections
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+HEARTBEAT_INTERVAL = 15  # seconds
+NODE_TIMEOUT = timedelta(seconds=60)
+MAX_PRESENCE_QUERY = 100  # user ids per online-status query
+
+TYPING_TIMEOUT = 6.0  # seconds without a typing event before "stopped" is sent
+TYPING_RATE = 5.0  # typing events accepted per second and socket
+TYPING_BURST = 10
+
+_heartbeat_task: Optional[asyncio.Task] = None
+_server: Optional[socketio.AsyncServer] = None
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+# ============ CLIENT MANAGERS ============
+
+class AsyncMongoManager(AsyncPubSubManager):
+    """
+    MongoDB-backed client manager: messages are appended to a capped
+    collection and every node tails it. For deployments without Redis.
+    """
+
+    name = 'asyncmongo'
+
+    def __init__(self, url: str, db_name: str, channel: str = 'socketio',
+                 capped_size: int = 16 * 1024 * 1024, write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self.db_name = db_name
+        self.capped_size = capped_size
+        self.collection = None
+
+    async def _get_collection(self):
+        if self.collection is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            from pymongo.errors import CollectionInvalid
+
+            db = AsyncIOMotorClient(self.url)[self.db_name]
+            name = f"{self.channel}_pubsub"
+            try:
+                await db.create_collection(name, capped=True, size=self.capped_size)
+            except CollectionInvalid:
+                pass  # created by another node
+            self.collection = db[name]
+        return self.collection
+
+    async def _publish(self, data):
+        collection = await self._get_collection()
+        await collection.insert_one({
+            "channel": self.channel,
+            "data": self.json.dumps(data),
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    async def _listen(self):
+        from pymongo import CursorType
+
+        collection = await self._get_collection()
+        # Only messages published after this node subscribed
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+
+        while True:
+            query = {"channel": self.channel}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        yield doc["data"]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._get_logger().error(f"Mongo pub/sub listen error: {e}")
+            await asyncio.sleep(1)  # empty collection or lost cursor
+
+
+def create_client_manager():
+    """Client manager for SOCKETIO_MESSAGE_QUEUE (None = in-memory, single process)"""
+    url = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+    channel = os.environ.get('SOCKETIO_CHANNEL', 'socketio')
+    if not url:
+        return None
+    if url == 'mongo':
+        url = os.environ['MONGO_URL']
+    if url.startswith(('mongodb://', 'mongodb+srv://')):
+        return AsyncMongoManager(url, os.environ['DB_NAME'], channel=channel)
+    return socketio.AsyncRedisManager(url, channel=channel)
+
+
+# ============ SERIALIZATION ============
+
+class NegotiatingServer(socketio.AsyncServer):
+    """
+    Socket.IO server that speaks msgpack to clients connecting with
+    ?serializer=msgpack (socket.io-msgpack-parser) and JSON to everyone else.
+    A broadcast is encoded once per format, not once per recipient. Binary
+    attachments are only supported for JSON clients.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.msgpack_sids: Set[str] = set()
+
+    async def _handle_eio_connect(self, eio_sid, environ):
+        if parse_qs(environ.get("QUERY_STRING", "")).get("serializer") == ["msgpack"]:
+            self.msgpack_sids.add(eio_sid)
+        return await super()._handle_eio_connect(eio_sid, environ)
+
+    async def _handle_eio_disconnect(self, eio_sid, reason):
+        try:
+            return await super()._handle_eio_disconnect(eio_sid, reason)
+        finally:
+            self.msgpack_sids.discard(eio_sid)
+
+    async def _handle_eio_message(self, eio_sid, data):
+        if eio_sid not in self.msgpack_sids:
+            return await super()._handle_eio_message(eio_sid, data)
+        pkt = MsgPackPacket(encoded_packet=data)
+        if pkt.packet_type == packet.CONNECT:
+            await self._handle_connect(eio_sid, pkt.namespace, pkt.data)
+        elif pkt.packet_type == packet.DISCONNECT:
+            await self._handle_disconnect(eio_sid, pkt.namespace, self.reason.CLIENT_DISCONNECT)
+        elif pkt.packet_type == packet.EVENT:
+            await self._handle_event(eio_sid, pkt.namespace, pkt.id, pkt.data)
+        elif pkt.packet_type == packet.ACK:
+            await self._handle_ack(eio_sid, pkt.namespace, pkt.id, pkt.data)
+        else:
+            raise ValueError(f"Unexpected packet type {pkt.packet_type} from msgpack client")
+
+    @staticmethod
+    def _as_msgpack(pkt) -> bytes:
+        packet_type = {packet.BINARY_EVENT: packet.EVENT, packet.BINARY_ACK: packet.ACK}.get(
+            pkt.packet_type, pkt.packet_type)
+        return MsgPackPacket(packet_type, data=pkt.data, namespace=pkt.namespace, id=pkt.id).encode()
+
+    async def _send_packet(self, eio_sid, pkt):
+        if eio_sid in self.msgpack_sids:
+            await self.eio.send(eio_sid, self._as_msgpack(pkt))
+        else:
+            await super()._send_packet(eio_sid, pkt)
+
+    async def _send_eio_packet(self, eio_sid, eio_pkt):
+        # Broadcasts arrive here JSON-encoded once for all recipients; the
+        # msgpack bytes are made on first use and kept on the shared packet.
+        # Engine.IO packets cache their transport encoding, so each msgpack
+        # recipient gets its own packet object.
+        if eio_sid in self.msgpack_sids and eio_pkt.packet_type == eio_packet.MESSAGE:
+            encoded = getattr(eio_pkt, "msgpack_data", None)
+            if encoded is None:
+                if eio_pkt.binary:
+                    logger.warning("Binary attachment not sent to a msgpack client")
+                    return
+                decoded = self.packet_class(encoded_packet=eio_pkt.data)
+                if decoded.attachment_count:
+                    logger.warning("Binary attachment not sent to a msgpack client")
+                    return
+                encoded = eio_pkt.msgpack_data = self._as_msgpack(decoded)
+            eio_pkt = eio_packet.Packet(eio_packet.MESSAGE, encoded)
+        await super()._send_eio_packet(eio_sid, eio_pkt)
+
+
+def create_server(**kwargs) -> socketio.AsyncServer:
+    """Socket.IO server configured from the environment"""
+    transports = os.environ.get('SOCKETIO_TRANSPORTS', 'websocket,polling')
+    options = {
+        "async_mode": "asgi",
+        "cors_allowed_origins": "*",
+        "logger": False,
+        "engineio_logger": False,
+        "transports": [t.strip() for t in transports.split(',') if t.strip()],
+        "http_compression": os.environ.get('SOCKETIO_HTTP_COMPRESSION', '1') not in ('0', 'false'),
+        "compression_threshold": int(os.environ.get('SOCKETIO_COMPRESSION_THRESHOLD', '1024')),
+    }
+    manager = create_client_manager()
+    if manager is not None:
+        options["client_manager"] = manager
+    options.update(kwargs)
+
+    server_class = NegotiatingServer
+    if os.environ.get('SOCKETIO_MSGPACK', '1') in ('0', 'false'):
+        server_class = socketio.AsyncServer
+
+    global _server
+    _server = server_class(**options)
+    return _server
+
+
+# ============ HANDSHAKE ============
+
+def session_token_from(environ: dict, auth=None) -> Optional[str]:
+    """Session token of a handshake: auth payload, then cookie, then Bearer header"""
+    if isinstance(auth, dict) and auth.get("token"):
+        return auth["token"]
+    cookie = environ.get("HTTP_COOKIE")
+    if cookie:
+        try:
+            morsel = SimpleCookie(cookie).get("session_token")
+        except CookieError:
+            morsel = None
+        if morsel and morsel.value:
+            return morsel.value
+    header = environ.get("HTTP_AUTHORIZATION", "")
+    if header.startswith("Bearer "):
+        return header.split(" ", 1)[1]
+    return None
+
+
+def session_key(session_token: str) -> str:
+    """Stored instead of the token itself to find the sockets of a session"""
+    return hashlib.sha256(session_token.encode()).hexdigest()[:24]
+
+
+async def disconnect_sockets(user_id: str, session_token: Optional[str] = None) -> int:
+    """
+    Disconnect a user's sockets on every node (only those opened with
+    session_token, if given). Called when sessions are revoked.
+    """
+    if _server is None:
+        return 0
+    query = {"user_id": user_id}
+    if session_token:
+        query["session"] = session_key(session_token)
+    sids = set(await get_db().socket_connections.distinct("sid", query))
+    if not session_token:
+        sids |= presence.sids_for(user_id)
+    for sid in sids:
+        try:
+            await _server.disconnect(sid)
+        except Exception as e:
+            logger.warning(f"Could not disconnect socket {sid}: {e}")
+    return len(sids)
+
+
+# ============ PRESENCE ============
+
+class PresenceRegistry:
+    """
+    Sockets of this node indexed both ways (user -> sids, sid -> user), so a
+    user can have several devices connected and connect/disconnect/online
+    checks are O(1). last_seen holds each user's latest activity (epoch).
+    """
+
+    def __init__(self):
+        self._sids: Dict[str, Set[str]] = {}
+        self._users: Dict[str, str] = {}
+        self._last_seen: Dict[str, float] = {}
+
+    def add(self, sid: str, user_id: str, now: Optional[float] = None) -> bool:
+        """Attach a socket to a user. True if it is the user's first socket here."""
+        previous = self._users.get(sid)
+        if previous == user_id:
+            return False
+        if previous is not None:
+            self.remove(sid, now)
+        self._users[sid] = user_id
+        sids = self._sids.setdefault(user_id, set())
+        sids.add(sid)
+        self._last_seen[user_id] = now or time.time()
+        return len(sids) == 1
+
+    def remove(self, sid: str, now: Optional[float] = None) -> Optional[str]:
+        """Detach a socket; returns its user (None if the sid never joined)"""
+        user_id = self._users.pop(sid, None)
+        if user_id is None:
+            return None
+        sids = self._sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids[user_id]
+        self._last_seen[user_id] = now or time.time()
+        return user_id
+
+    def touch(self, user_id: str, now: Optional[float] = None):
+        self._last_seen[user_id] = now or time.time()
+
+    def user_for(self, sid: str) -> Optional[str]:
+        return self._users.get(sid)
+
+    def sids_for(self, user_id: str) -> Set[str]:
+        return set(self._sids.get(user_id, ()))
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self._sids
+
+    def online(self, user_ids: Iterable[str]) -> Set[str]:
+        return {user_id for user_id in user_ids if user_id in self._sids}
+
+    def last_seen(self, user_id: str) -> Optional[float]:
+        return self._last_seen.get(user_id)
+
+    @property
+    def user_count(self) -> int:
+        return len(self._sids)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+# Sockets of this process
+presence = PresenceRegistry()
+
+
+# ============ TYPING INDICATORS ============
+
+class TypingThrottle:
+    """
+    Coalesces typing events per (sender, receiver) conversation: the first
+    "typing" is forwarded at once, repeats only push back its expiry, and
+    "stopped" is forwarded once, when the client says so or when no event came
+    for `timeout` seconds. Each socket is rate-limited with a token bucket;
+    stops bypass it so an indicator never lingers.
+    """
+
+    def __init__(self, emit: Callable[[str, str, bool], Awaitable], timeout: float = TYPING_TIMEOUT,
+                 rate: float = TYPING_RATE, burst: int = TYPING_BURST, clock=time.monotonic):
+        self._emit = emit  # async (sender_id, receiver_id, is_typing)
+        self.timeout = timeout
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._deadlines: Dict[Tuple[str, str], float] = {}
+        self._buckets: Dict[str, list] = {}  # sid -> [tokens, updated_at]
+        self._by_sid: Dict[str, Set[Tuple[str, str]]] = {}
+        self._tasks: set = set()
+        self.counters = {"received": 0, "emitted": 0, "suppressed": 0, "rate_limited": 0, "expired": 0}
+
+    def _allow(self, sid: str, now: float) -> bool:
+        bucket = self._buckets.get(sid)
+        if bucket is None:
+            bucket = self._buckets[sid] = [float(self.burst), now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    async def update(self, sid: str, sender_id: str, receiver_id: str, is_typing: bool) -> bool:
+        """Handle one typing event; True if it was forwarded to the receiver"""
+        self.counters["received"] += 1
+        key = (sender_id, receiver_id)
+        now = self._clock()
+
+        if not is_typing:
+            if self._deadlines.pop(key, None) is None:
+                self.counters["suppressed"] += 1
+                return False
+            await self._send(sender_id, receiver_id, False)
+            return True
+
+        if not self._allow(sid, now):
+            self.counters["rate_limited"] += 1
+            return False
+        self._by_sid.setdefault(sid, set()).add(key)
+        if key in self._deadlines:
+            self._deadlines[key] = now + self.timeout
+            self.counters["suppressed"] += 1
+            return False
+
+        self._deadlines[key] = now + self.timeout
+        asyncio.get_running_loop().call_later(self.timeout, self._expire, key)
+        await self._send(sender_id, receiver_id, True)
+        return True
+
+    def _expire(self, key: Tuple[str, str]):
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return
+        remaining = deadline - self._clock()
+        if remaining > 0:  # pushed back by later events
+            asyncio.get_running_loop().call_later(remaining, self._expire, key)
+            return
+        del self._deadlines[key]
+        self.counters["expired"] += 1
+        self._spawn(self._send(key[0], key[1], False))
+
+    async def forget_socket(self, sid: str):
+        """Stop the indicators a disconnected socket started"""
+        self._buckets.pop(sid, None)
+        for key in self._by_sid.pop(sid, ()):
+            if self._deadlines.pop(key, None) is not None:
+                await self._send(key[0], key[1], False)
+
+    async def _send(self, sender_id: str, receiver_id: str, is_typing: bool):
+        self.counters["emitted"] += 1
+        try:
+            await self._emit(sender_id, receiver_id, is_typing)
+        except Exception as e:
+            logger.warning(f"Typing indicator emit failed: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict:
+        return {**self.counters, "active": len(self._deadlines)}
+
+
+async def _emit_typing(sender_id: str, receiver_id: str, is_typing: bool):
+    if _server is not None:
+        await _server.emit('user_typing', {'user_id': sender_id, 'is_typing': is_typing}, room=receiver_id)
+
+
+typing_throttle = TypingThrottle(_emit_typing)
+
+
+def stats() -> dict:
+    """Socket and typing-indicator counters of this process"""
+    return {
+        "node_id": NODE_ID,
+        "sockets": len(presence),
+        "users": presence.user_count,
+        "typing": typing_throttle.stats()
+    }
+
+
+# ============ CLUSTER PRESENCE ============
+
+async def ensure_indexes():
+    db = get_db()
+    await db.socket_connections.create_index("sid", unique=True)
+    await db.socket_connections.create_index("user_id")
+    await db.socket_connections.create_index("node_id")
+    await db.socket_nodes.create_index("node_id", unique=True)
+
+
+async def register_connection(sid: str, user_id: str, session_token: Optional[str] = None):
+    """Record that a socket of this node belongs to user_id"""
+    presence.add(sid, user_id)
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+    fields = {"user_id": user_id, "node_id": NODE_ID, "connected_at": now}
+    if session_token:
+        fields["session"] = session_key(session_token)
+    await db.socket_connections.update_one({"sid": sid}, {"$set": fields}, upsert=True)
+
+
+async def unregister_connection(sid: str) -> Optional[str]:
+    """Forget a socket and stamp its user's last_seen; returns the user, if any"""
+    user_id = presence.remove(sid)
+    if user_id is None:
+        return None
+    db = get_db()
+    await db.socket_connections.delete_one({"sid": sid})
+    await db.users.update_one(
+        {"user_id": user_id},
+        {"$set": {"last_seen": datetime.now(timezone.utc).isoformat()}}
+    )
+    return user_id
+
+
+async def is_online(user_id: str) -> bool:
+    """True if the user has a socket on any node"""
+    if presence.is_online(user_id):
+        return True
+    return await get_db().socket_connections.count_documents({"user_id": user_id}, limit=1) > 0
+
+
+async def online_users(user_ids: Iterable[str]) -> set:
+    """The subset of user_ids with a socket on any node"""
+    user_ids = set(user_ids)
+    online = presence.online(user_ids)
+    others = list(user_ids - online)
+    if others:
+        online |= set(await get_db().socket_connections.distinct("user_id", {"user_id": {"$in": others}}))
+    return online
+
+
+async def get_presence(user_ids: Iterable[str]) -> dict:
+    """{user_id: {"online", "last_seen"}} for up to MAX_PRESENCE_QUERY users"""
+    user_ids = list(dict.fromkeys(user_ids))[:MAX_PRESENCE_QUERY]
+    online = await online_users(user_ids)
+    stored = {
+        doc["user_id"]: doc.get("last_seen")
+        for doc in await get_db().users.find(
+            {"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "last_seen": 1}
+        ).to_list(None)
+    }
+
+    result = {}
+    for user_id in user_ids:
+        last_seen = stored.get(user_id)
+        local = presence.last_seen(user_id)
+        if local is not None:
+            local = datetime.fromtimestamp(local, timezone.utc).isoformat()
+            if last_seen is None or local > last_seen:
+                last_seen = local
+        result[user_id] = {"online": user_id in online, "last_seen": last_seen}
+    return result
+
+
+async def _heartbeat():
+    """Keep this node alive and drop the sockets of nodes that stopped heartbeating"""
+    db = get_db()
+    now = datetime.now(timezone.utc)
+    await db.socket_nodes.update_one(
+        {"node_id": NODE_ID},
+        {"$set": {"heartbeat_at": now.isoformat()}},
+        upsert=True
+    )
+    dead = await db.socket_nodes.distinct(
+        "node_id", {"heartbeat_at": {"$lt": (now - NODE_TIMEOUT).isoformat()}}
+    )
+    if dead:
+        await db.socket_connections.delete_many({"node_id": {"$in": dead}})
+        await db.socket_nodes.delete_many({"node_id": {"$in": dead}})
+        logger.info(f"Dropped presence of stale nodes: {dead}")
+
+
+async def _heartbeat_loop():
+    while True:
+        try:
+            await _heartbeat()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Presence heartbeat failed: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def start_presence():
+    """Start this node's heartbeat (once per process)"""
+    global _heartbeat_task
+    if _heartbeat_task is None or _heartbeat_task.done():
+        _heartbeat_task = asyncio.create_task(_heartbeat_loop())
+
+
+async def stop_presence():
+    """Stop the heartbeat and forget this node's sockets"""
+    global _heartbeat_task
+    if _heartbeat_task:
+        _heartbeat_task.cancel()
+        try:
+            await _heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        _heartbeat_task = None
+
+    db = get_db()
+    await db.socket_connections.delete_many({"node_id": NODE_ID})
+    await db.socket_nodes.delete_one({"node_id": NODE_ID})
@@ -0,0 +1,127 @@
+"""
+Review Stats
+Per-provider review count, rating sum, verified count and 1-5 star histogram
+kept on the provider profile with atomic increments, instead of re-aggregating
+every review on each write and page view; reconcile() rebuilds them
+"""
+import logging
+from typing import Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+STARS = ("1", "2", "3", "4", "5")
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+def empty_stats() -> dict:
+    return {"count": 0, "sum": 0, "verified_count": 0, "histogram": {star: 0 for star in STARS}}
+
+
+def average(stats: dict) -> float:
+    return round(stats["sum"] / stats["count"], 1) if stats.get("count") else 0.0
+
+
+# ============ INCREMENTAL UPDATES ============
+
+async def record_review(review: dict, sign: int = 1):
+    """
+    Count a new review (sign=1) or a removed one (sign=-1) and refresh the
+    profile's rating / total_reviews from the updated stats
+    """
+    db = get_db()
+    star = str(min(max(int(review["rating"]), 1), 5))
+    updated = await db.provider_profiles.find_one_and_update(
+        {"provider_id": review["provider_id"]},
+        {"$inc": {
+            "review_stats.count": sign,
+            "review_stats.sum": sign * review["rating"],
+            "review_stats.verified_count": sign if review.get("is_verified") else 0,
+            f"review_stats.histogram.{star}": sign,
+        }},
+        projection={"_id": 0, "review_stats": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        return
+
+    # Only write the rating if no other review landed in between;
+    # a later increment writes its own
+    stats = updated["review_stats"]
+    await db.provider_profiles.update_one(
+        {"provider_id": review["provider_id"], "review_stats.count": stats["count"], "review_stats.sum": stats["sum"]},
+        {"$set": {"rating": average(stats), "total_reviews": stats["count"]}}
+    )
+
+
+# ============ READS ============
+
+async def get_stats(provider_id: str) -> dict:
+    """Stats of one provider, with every star present in the histogram"""
+    profile = await get_db().provider_profiles.find_one(
+        {"provider_id": provider_id}, {"_id": 0, "review_stats": 1}
+    )
+    stats = empty_stats()
+    stored: Optional[dict] = (profile or {}).get("review_stats")
+    if stored:
+        stats.update({k: stored.get(k, 0) for k in ("count", "sum", "verified_count")})
+        stats["histogram"].update(stored.get("histogram", {}))
+    return stats
+
+
+# ============ RECONCILE ============
+
+async def reconcile() -> dict:
+    """Recompute every provider's stats, rating and total_reviews from the reviews"""
+    db = get_db()
+    rows = await db.reviews.aggregate([
+        {"$group": {
+            "_id": {"provider_id": "$provider_id", "rating": "$rating"},
+            "count": {"$sum": 1},
+            "verified": {"$sum": {"$cond": [{"$eq": ["$is_verified", True]}, 1, 0]}}
+        }}
+    ], allowDiskUse=True).to_list(None)
+
+    providers = {}
+    for row in rows:
+        stats = providers.setdefault(row["_id"]["provider_id"], empty_stats())
+        rating = row["_id"]["rating"] or 0
+        stats["count"] += row["count"]
+        stats["sum"] += rating * row["count"]
+        stats["verified_count"] += row["verified"]
+        star = str(min(max(int(rating), 1), 5))
+        stats["histogram"][star] += row["count"]
+
+    if providers:
+        await db.provider_profiles.bulk_write([
+            UpdateOne({"provider_id": provider_id}, {"$set": {
+                "review_stats": stats, "rating": average(stats), "total_reviews": stats["count"]
+            }})
+            for provider_id, stats in providers.items()
+        ], ordered=False)
+    # Providers whose reviews are all gone
+    reset = await db.provider_profiles.update_many(
+        {"provider_id": {"$nin": list(providers)}},
+        {"$set": {"review_stats": empty_stats(), "rating": 0.0, "total_reviews": 0}}
+    )
+
+    reviews = sum(stats["count"] for stats in providers.values())
+    logger.info(f"Review stats rebuilt: {len(providers)} providers, {reviews} reviews")
+    return {"providers": len(providers), "reviews": reviews, "reset": reset.modified_count}
+
+
+async def ensure_populated():
+    """Build the stats once on a database that predates them"""
+    db = get_db()
+    try:
+        if await db.provider_profiles.count_documents({"review_stats": {"$exists": True}}, limit=1) == 0 and \
+                await db.reviews.count_documents({}, limit=1) > 0:
+            await reconcile()
+    except Exception as e:
+        logger.error(f"Review stats rebuild failed: {e}")
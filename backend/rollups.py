@@ -0,0 +1,341 @@
+"""
+Stats Rollups
+Daily and monthly counters (signups, bookings, GMV, revenue, subscriptions)
+kept up to date on writes and rebuilt from the source collections every night
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Union
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# Hour (UTC) of the nightly rebuild, which also absorbs deletions
+BACKFILL_HOUR = int(os.environ.get('ROLLUP_BACKFILL_HOUR', '3'))
+
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+async def ensure_indexes():
+    """Create the indexes the rollups rely on"""
+    db = get_db()
+    await db.daily_stats.create_index("date", unique=True)
+    await db.monthly_stats.create_index("month", unique=True)
+
+
+def day_key(when: Union[str, datetime, None] = None) -> str:
+    """YYYY-MM-DD bucket of a timestamp (ISO string or datetime, default now)"""
+    if when is None:
+        when = datetime.now(timezone.utc)
+    if isinstance(when, datetime):
+        return when.astimezone(timezone.utc).strftime("%Y-%m-%d")
+    return when[:10]
+
+
+# ============ INCREMENTAL UPDATES ============
+
+async def increment(counters: dict, when: Union[str, datetime, None] = None):
+    """
+    Add counters (dotted paths allowed) to the day and month buckets of `when`.
+    Never raises: a lost increment is corrected by the nightly rebuild.
+    """
+    counters = {k: v for k, v in counters.items() if v}
+    if not counters:
+        return
+
+    db = get_db()
+    day = day_key(when)
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.daily_stats.update_one(
+            {"date": day},
+            {"$inc": counters, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        await db.monthly_stats.update_one(
+            {"month": day[:7]},
+            {"$inc": counters, "$set": {"updated_at": now}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Stats rollup update failed: {e}")
+
+
+async def record_user_created(user_type: str, created_at=None):
+    await increment({"new_users": 1, f"new_users_by_type.{user_type}": 1}, created_at)
+
+
+async def record_user_type_change(old_type: str, new_type: str, user_created_at=None):
+    """Move a user between types in the bucket of their signup day"""
+    if old_type == new_type:
+        return
+    await increment({
+        f"new_users_by_type.{old_type}": -1,
+        f"new_users_by_type.{new_type}": 1
+    }, user_created_at)
+
+
+async def record_provider_created(created_at=None):
+    await increment({"new_providers": 1}, created_at)
+
+
+def bucket_key(value) -> str:
+    """Make a status/category usable as a field name"""
+    return str(value or "unknown").replace(".", "_").lstrip("$") or "unknown"
+
+
+def booking_counters(booking: dict, sign: int = 1) -> dict:
+    """Status-dependent contribution of a booking to its creation-day bucket"""
+    status = bucket_key(booking.get("status"))
+    return {
+        f"bookings_by_status.{status}": sign,
+        f"gmv_by_status.{status}": sign * round(float(booking.get("total_amount") or 0), 2),
+        f"commission_by_status.{status}": sign * round(float(booking.get("platform_commission") or 0), 2)
+    }
+
+
+async def record_booking_created(booking: dict):
+    provider = await get_db().provider_profiles.find_one(
+        {"provider_id": booking.get("provider_id")},
+        {"_id": 0, "category": 1}
+    )
+    category = bucket_key(provider.get("category") if provider else None)
+    await increment({
+        "new_bookings": 1,
+        f"bookings_by_category.{category}": 1,
+        **booking_counters(booking)
+    }, booking.get("created_at"))
+
+
+async def record_booking_changed(before: dict, after: dict):
+    """Move a booking's status/amount contribution after an update"""
+    counters = booking_counters(before, -1)
+    for path, value in booking_counters(after).items():
+        counters[path] = round(counters.get(path, 0) + value, 2)
+    await increment(counters, before.get("created_at"))
+
+
+async def record_payment(amount: float, paid_at=None):
+    await increment({"revenue": round(float(amount), 2), "payments": 1}, paid_at)
+
+
+async def record_subscription_change(started_plan: Optional[str] = None, ended_plan: Optional[str] = None,
+                                     when=None):
+    """A subscription became active (started_plan) and/or stopped being active (ended_plan)"""
+    counters = {}
+    if started_plan:
+        counters[f"subscriptions_started.{started_plan}"] = 1
+    if ended_plan:
+        counters[f"subscriptions_ended.{ended_plan}"] = 1
+    await increment(counters, when)
+
+
+# ============ BACKFILL ============
+
+def _day_expr(field: str) -> dict:
+    return {"$substr": [{"$ifNull": [field, ""]}, 0, 10]}
+
+
+async def _count_by_day(collection, match: dict, day_field: str, sub_field: Optional[str] = None,
+                        sum_field: Optional[str] = None) -> list:
+    group_id = {"day": _day_expr(day_field)}
+    if sub_field:
+        group_id["sub"] = sub_field
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": group_id,
+            "count": {"$sum": 1},
+            "total": {"$sum": sum_field if sum_field else 0}
+        }}
+    ]
+    return await collection.aggregate(pipeline).to_list(None)
+
+
+def _add(bucket: dict, path: str, value):
+    """Add value at a dotted path of a nested dict"""
+    keys = path.split(".")
+    for key in keys[:-1]:
+        bucket = bucket.setdefault(key, {})
+    bucket[keys[-1]] = bucket.get(keys[-1], 0) + value
+
+
+async def compute_daily_counters() -> dict:
+    """Recompute every day bucket from the source collections: {date: counters}"""
+    db = get_db()
+    days = {}
+
+    def add(day, path, value):
+        if len(day) == 10 and value:
+            _add(days.setdefault(day, {}), path, value)
+
+    for row in await _count_by_day(db.users, {}, "$created_at", sub_field="$user_type"):
+        add(row["_id"]["day"], "new_users", row["count"])
+        add(row["_id"]["day"], f"new_users_by_type.{row['_id'].get('sub') or 'client'}", row["count"])
+
+    for row in await _count_by_day(db.provider_profiles, {}, "$created_at"):
+        add(row["_id"]["day"], "new_providers", row["count"])
+
+    for row in await db.bookings.aggregate([
+        {"$group": {
+            "_id": {"day": _day_expr("$created_at"), "status": "$status"},
+            "count": {"$sum": 1},
+            "gmv": {"$sum": "$total_amount"},
+            "commission": {"$sum": "$platform_commission"}
+        }}
+    ]).to_list(None):
+        day, status = row["_id"]["day"], bucket_key(row["_id"].get("status"))
+        add(day, "new_bookings", row["count"])
+        add(day, f"bookings_by_status.{status}", row["count"])
+        add(day, f"gmv_by_status.{status}", round(row["gmv"] or 0, 2))
+        add(day, f"commission_by_status.{status}", round(row["commission"] or 0, 2))
+
+    for row in await db.bookings.aggregate([
+        {"$lookup": {
+            "from": "provider_profiles",
+            "localField": "provider_id",
+            "foreignField": "provider_id",
+            "as": "provider"
+        }},
+        {"$group": {
+            "_id": {"day": _day_expr("$created_at"), "category": {"$arrayElemAt": ["$provider.category", 0]}},
+            "count": {"$sum": 1}
+        }}
+    ]).to_list(None):
+        add(row["_id"]["day"], f"bookings_by_category.{bucket_key(row['_id'].get('category'))}", row["count"])
+
+    paid_day = {"$ifNull": ["$paid_at", "$created_at"]}
+    for row in await _count_by_day(db.payment_transactions, {"payment_status": "paid"}, paid_day, sum_field="$amount"):
+        add(row["_id"]["day"], "revenue", round(row["total"], 2))
+        add(row["_id"]["day"], "payments", row["count"])
+
+    for row in await _count_by_day(db.subscriptions, {}, "$created_at", sub_field="$plan_id"):
+        add(row["_id"]["day"], f"subscriptions_started.{row['_id'].get('sub')}", row["count"])
+    ended = {"status": {"$ne": "active"}}
+    for row in await _count_by_day(db.subscriptions, ended, "$updated_at", sub_field="$plan_id"):
+        add(row["_id"]["day"], f"subscriptions_ended.{row['_id'].get('sub')}", row["count"])
+
+    return days
+
+
+async def rebuild_rollups() -> dict:
+    """Replace the day and month buckets with freshly computed counters"""
+    db = get_db()
+    now = datetime.now(timezone.utc).isoformat()
+
+    days = await compute_daily_counters()
+    months = {}
+    for day, counters in days.items():
+        month = months.setdefault(day[:7], {})
+        for path, value in flatten(counters).items():
+            _add(month, path, value)
+
+    if days:
+        await db.daily_stats.bulk_write([
+            ReplaceOne({"date": day}, {"date": day, **counters, "updated_at": now}, upsert=True)
+            for day, counters in days.items()
+        ], ordered=False)
+    if months:
+        await db.monthly_stats.bulk_write([
+            ReplaceOne({"month": month}, {"month": month, **counters, "updated_at": now}, upsert=True)
+            for month, counters in months.items()
+        ], ordered=False)
+
+    # Buckets whose source documents are all gone
+    await db.daily_stats.delete_many({"date": {"$nin": list(days)}})
+    await db.monthly_stats.delete_many({"month": {"$nin": list(months)}})
+
+    logger.info(f"Stats rollups rebuilt: {len(days)} days, {len(months)} months")
+    return {"days": len(days), "months": len(months)}
+
+
+# ============ READS ============
+
+def flatten(counters: dict, prefix: str = "") -> dict:
+    """{"a": {"b": 1}} -> {"a.b": 1}"""
+    flat = {}
+    for key, value in counters.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def sum_buckets(buckets: list) -> dict:
+    """Add up counters of several rollup documents"""
+    total = {}
+    for bucket in buckets:
+        for path, value in flatten({k: v for k, v in bucket.items() if k not in ("_id", "date", "month")}).items():
+            _add(total, path, value)
+    return total
+
+
+async def get_totals(since_month: Optional[str] = None) -> dict:
+    """All-time counters (or from a YYYY-MM month on) summed from monthly buckets"""
+    db = get_db()
+    query = {"month": {"$gte": since_month}} if since_month else {}
+    buckets = await db.monthly_stats.find(query, {"_id": 0, "updated_at": 0}).to_list(None)
+    return sum_buckets(buckets)
+
+
+async def get_daily_stats(start: str, end: str) -> list:
+    """Day buckets between two YYYY-MM-DD dates (inclusive); days without activity are absent"""
+    db = get_db()
+    return await db.daily_stats.find(
+        {"date": {"$gte": start, "$lte": end}},
+        {"_id": 0, "updated_at": 0}
+    ).sort("date", 1).to_list(None)
+
+
+# ============ NIGHTLY BACKFILL ============
+
+async def _backfill_loop():
+    # First start on an existing database: build the buckets right away
+    try:
+        if await get_db().monthly_stats.count_documents({}, limit=1) == 0:
+            await rebuild_rollups()
+    except Exception as e:
+        logger.error(f"Stats rollup rebuild failed: {e}")
+
+    while True:
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=BACKFILL_HOUR, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+
+        try:
+            await rebuild_rollups()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Stats rollup rebuild failed: {e}")
+
+
+def start_backfill():
+    """Schedule the nightly rebuild (once per process)"""
+    global _backfill_task
+    if _backfill_task is None or _backfill_task.done():
+        _backfill_task = asyncio.create_task(_backfill_loop())
+
+
+async def stop_backfill():
+    global _backfill_task
+    if _backfill_task:
+        _backfill_task.cancel()
+        try:
+            await _backfill_task
+        except asyncio.CancelledError:
+            pass
+        _backfill_task = None
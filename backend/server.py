@@ -5,7 +5,10 @@ from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+import time
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 import uuid
@@ -31,6 +34,20 @@ from models import (
     CountryPresence, CountryPresenceCreate, CountryPresenceUpdate,
     PortfolioItem, PortfolioItemCreate, PortfolioItemUpdate
 )
+import rollups
+import conversations
+import realtime
+import message_pipeline
+import message_notifications
+import smtp_transport
+import email_outbox
+import email_templates
+import settings_service
+import http_cache
+import bootstrap
+import review_stats
+import provider_page
+import counters
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -44,13 +61,8 @@ db = client[os.environ['DB_NAME']]
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
-# Socket.IO setup
-sio = socketio.AsyncServer(
-    async_mode='asgi',
-    cors_allowed_origins='*',
-    logger=False,
-    engineio_logger=False
-)
+# Socket.IO setup (client manager and transports come from SOCKETIO_* settings)
+sio = realtime.create_server()
 socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
 
 # Configure logging
@@ -72,6 +84,11 @@ async def get_current_user(request: Request) -> User:
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    session_doc, user_doc = await load_session(session_token)
+    return User(**user_doc)
+
+async def load_session(session_token: str):
+    """Validate a session token; returns (session_doc, user_doc) or raises 401/404"""
     session_doc = await db.user_sessions.find_one(
         {"session_token": session_token},
         {"_id": 0}
@@ -99,7 +116,8 @@ async def get_current_user(request: Request) -> User:
     if isinstance(user_doc['created_at'], str):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
     
-    return User(**user_doc)
+    session_doc["expires_at"] = expires_at
+    return session_doc, user_doc
 
 # Optional auth (doesn't throw error if not authenticated)
 async def get_current_user_optional(request: Request) -> Optional[User]:
@@ -113,17 +131,13 @@ async def get_current_user_optional(request: Request) -> Optional[User]:
 @api_router.get("/site-content")
 async def get_site_content():
     """Get public site content (contact info, etc.)"""
-    # Check in site_content collection first (admin panel saves here)
-    doc = await db.site_content.find_one({"type": "homepage"}, {"_id": 0})
+    # Homepage content first (admin panel saves here)
+    doc = await settings_service.homepage()
     if doc:
         return doc
     
     # Fallback to site_settings
-    settings_doc = await db.site_settings.find_one({"key": "site_content"}, {"_id": 0})
-    if settings_doc:
-        return settings_doc.get("value", {})
-    
-    return {}
+    return await settings_service.get("site_content") or {}
 
 
 @api_router.get("/categories/{mode}")
@@ -132,11 +146,9 @@ async def get_public_categories(mode: str):
     if mode not in ["events", "pro"]:
         raise HTTPException(status_code=400, detail="Mode invalide")
     
-    key = f"categories_{mode}"
-    doc = await db.site_settings.find_one({"key": key}, {"_id": 0})
-    
-    if doc:
-        return doc.get("value", [])
+    categories = await settings_service.categories(mode)
+    if categories is not None:
+        return categories
     
     # Default categories
     if mode == "events":
@@ -236,12 +248,12 @@ async def register(request: Request, response: Response):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.users.insert_one(user_doc)
+    await rollups.record_user_created(user_doc['user_type'], user_doc['created_at'])
     
     # Send welcome email
     try:
         from email_service import send_welcome_email_client
-        import asyncio
-        asyncio.create_task(send_welcome_email_client(email, name))
+        await send_welcome_email_client(email, name)
     except Exception as e:
         print(f"Welcome email error: {e}")
     
@@ -470,6 +482,7 @@ async def create_session(request: Request, response: Response):
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         await db.users.insert_one(user_doc)
+        await rollups.record_user_created(user_doc['user_type'], user_doc['created_at'])
     
     # Create session
     session_token = user_data['session_token']
@@ -509,6 +522,7 @@ async def logout(request: Request, response: Response, current_user: User = Depe
     session_token = request.cookies.get('session_token')
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        await realtime.disconnect_sockets(current_user.user_id, session_token)
     response.delete_cookie("session_token", path="/")
     return {"message": "Logged out"}
 
@@ -522,6 +536,7 @@ async def update_user_type(user_type: str, current_user: User = Depends(get_curr
         {"user_id": current_user.user_id},
         {"$set": {"user_type": user_type}}
     )
+    await rollups.record_user_type_change(current_user.user_type, user_type, current_user.created_at)
     
     return {"message": "User type updated", "user_type": user_type}
 
@@ -623,6 +638,7 @@ async def delete_account(
         await db.marketplace_items.delete_many({"seller_id": provider_id})
         # Delete provider profile
         await db.provider_profiles.delete_one({"provider_id": provider_id})
+        await provider_page.invalidate(provider_id)
     
     # 2. Delete user's bookings (as client)
     await db.bookings.delete_many({"client_id": user_id})
@@ -645,8 +661,9 @@ async def delete_account(
     # 8. Delete user's notifications
     await db.notifications.delete_many({"user_id": user_id})
     
-    # 9. Delete user's sessions
-    await db.sessions.delete_many({"user_id": user_id})
+    # 9. Delete user's sessions and drop their open sockets
+    await db.user_sessions.delete_many({"user_id": user_id})
+    await realtime.disconnect_sockets(user_id)
     
     # 10. Delete user's payment transactions
     await db.payment_transactions.delete_many({"user_id": user_id})
@@ -668,6 +685,15 @@ async def get_user_by_id(user_id: str, current_user: User = Depends(get_current_
     
     return User(**user_doc)
 
+@api_router.get("/presence")
+async def get_presence(
+    user_ids: str = Query(..., description="Comma-separated user ids"),
+    current_user: User = Depends(get_current_user)
+):
+    """Online status and last_seen of up to 100 users"""
+    ids = [user_id.strip() for user_id in user_ids.split(",") if user_id.strip()]
+    return {"users": await realtime.get_presence(ids)}
+
 @api_router.patch("/users/me", response_model=User)
 async def update_current_user(
     update_data: UserUpdate,
@@ -764,16 +790,18 @@ async def create_provider_profile(
         "verified": False,
         "rating": 0.0,
         "total_reviews": 0,
+        "review_stats": review_stats.empty_stats(),
         "created_at": datetime.now(timezone.utc).isoformat()
     })
     
     await db.provider_profiles.insert_one(profile_doc)
+    await rollups.record_provider_created(profile_doc['created_at'])
+    await rollups.record_user_type_change(current_user.user_type, "provider", current_user.created_at)
     
     # Send welcome email to provider
     try:
         from email_service import send_welcome_email_provider
-        import asyncio
-        asyncio.create_task(send_welcome_email_provider(current_user.email, current_user.name))
+        await send_welcome_email_provider(current_user.email, current_user.name)
     except Exception as e:
         print(f"Provider welcome email error: {e}")
     
@@ -911,6 +939,7 @@ async def update_my_provider_profile(
             {"provider_id": provider["provider_id"]},
             {"$set": update_dict}
         )
+        await provider_page.invalidate(provider["provider_id"])
     
     return {"success": True}
 
@@ -967,6 +996,12 @@ async def get_provider(provider_id: str):
         provider['created_at'] = datetime.fromisoformat(provider['created_at'])
     return ProviderProfile(**provider)
 
+@api_router.post("/providers/{provider_id}/view")
+async def increment_provider_view(provider_id: str):
+    """Increment view count for a provider profile (the profile GET is cached, so pages report views here)"""
+    counters.provider_views.add(provider_id)
+    return {"success": True}
+
 @api_router.get("/providers/user/{user_id}", response_model=ProviderProfile)
 async def get_provider_by_user(user_id: str):
     provider = await db.provider_profiles.find_one(
@@ -997,6 +1032,7 @@ async def update_provider(
             {"provider_id": provider_id},
             {"$set": update_dict}
         )
+        await provider_page.invalidate(provider_id)
     
     updated = await db.provider_profiles.find_one({"provider_id": provider_id}, {"_id": 0})
     if isinstance(updated['created_at'], str):
@@ -1059,6 +1095,7 @@ async def create_country_presence(
     }
     
     await db.country_presences.insert_one(presence_doc)
+    await provider_page.invalidate(provider['provider_id'])
     presence_doc.pop('_id', None)
     presence_doc['created_at'] = datetime.fromisoformat(presence_doc['created_at'])
     
@@ -1087,6 +1124,7 @@ async def update_country_presence(
             {"presence_id": presence_id},
             {"$set": update_dict}
         )
+        await provider_page.invalidate(provider['provider_id'])
     
     updated = await db.country_presences.find_one({"presence_id": presence_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
@@ -1111,6 +1149,7 @@ async def delete_country_presence(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.country_presences.delete_one({"presence_id": presence_id})
+    await provider_page.invalidate(provider['provider_id'])
     return {"message": "Presence deleted"}
 
 # ============ AVAILABILITY ROUTES ============
@@ -1148,6 +1187,7 @@ async def set_availability(
         )
     else:
         await db.availability.insert_one(avail_doc)
+    await provider_page.invalidate(provider['provider_id'])
     
     return {"message": "Availability updated"}
 
@@ -1314,11 +1354,8 @@ async def check_provider_availability(provider_id: str, date: str):
 # ============ BOOKING ROUTES ============
 
 async def get_commission_settings():
-    """Get commission settings from database"""
-    settings = await db.site_settings.find_one({"key": "commission"}, {"_id": 0})
-    if settings:
-        return settings.get("value", {"enabled": False, "rate": 0})
-    return {"enabled": False, "rate": 0}
+    """Get commission settings (served from memory)"""
+    return await settings_service.commission()
 
 @api_router.post("/bookings", response_model=Booking)
 async def create_booking(
@@ -1401,11 +1438,12 @@ async def create_booking(
     })
     
     await db.bookings.insert_one(booking_doc)
+    await rollups.record_booking_created(booking_doc)
+    await provider_page.invalidate(booking_doc.get('provider_id'))
     
     # Send email notification to provider
     try:
         from email_service import send_new_booking_notification
-        import asyncio
         
         # Get provider info
         provider = await db.provider_profiles.find_one(
@@ -1425,11 +1463,11 @@ async def create_booking(
                     "location": booking_doc.get('location', ''),
                     "amount": base_amount
                 }
-                asyncio.create_task(send_new_booking_notification(
+                await send_new_booking_notification(
                     provider_user['email'],
                     provider['business_name'],
                     notification_data
-                ))
+                )
     except Exception as e:
         print(f"Booking notification error: {e}")
     
@@ -1523,13 +1561,15 @@ async def update_booking(
             {"booking_id": booking_id},
             {"$set": update_dict}
         )
+        if update_dict.get('status', old_status) != old_status:
+            await rollups.record_booking_changed(booking, {**booking, **update_dict})
+            await provider_page.invalidate(booking.get('provider_id'))
     
     # Send notification if status changed
     new_status = update_dict.get('status')
     if new_status and new_status != old_status:
         try:
             from email_service import send_booking_confirmed_notification, send_booking_rejected_notification
-            import asyncio
             
             # Get client info
             client = await db.users.find_one({"user_id": booking['client_id']}, {"_id": 0})
@@ -1545,17 +1585,17 @@ async def update_booking(
                 }
                 
                 if new_status == 'confirmed':
-                    asyncio.create_task(send_booking_confirmed_notification(
+                    await send_booking_confirmed_notification(
                         client['email'],
                         client['name'],
                         notification_data
-                    ))
+                    )
                 elif new_status in ['cancelled', 'rejected']:
-                    asyncio.create_task(send_booking_rejected_notification(
+                    await send_booking_rejected_notification(
                         client['email'],
                         client['name'],
                         notification_data
-                    ))
+                    )
         except Exception as e:
             print(f"Booking status notification error: {e}")
     
@@ -1600,6 +1640,7 @@ async def create_service(
     })
     
     await db.services.insert_one(service_doc)
+    await provider_page.invalidate(provider['provider_id'])
     
     service_doc['created_at'] = datetime.fromisoformat(service_doc['created_at'])
     service_doc['updated_at'] = datetime.fromisoformat(service_doc['updated_at'])
@@ -1678,6 +1719,7 @@ async def update_service(
             {"service_id": service_id},
             {"$set": update_dict}
         )
+        await provider_page.invalidate(provider['provider_id'])
     
     updated = await db.services.find_one({"service_id": service_id}, {"_id": 0})
     if isinstance(updated['created_at'], str):
@@ -1702,6 +1744,7 @@ async def delete_service(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.services.delete_one({"service_id": service_id})
+    await provider_page.invalidate(provider['provider_id'])
     return {"message": "Service deleted"}
 
 @api_router.post("/services/reorder")
@@ -1719,6 +1762,7 @@ async def reorder_services(
             {"service_id": item['service_id'], "provider_id": provider['provider_id']},
             {"$set": {"display_order": item['display_order'], "updated_at": datetime.now(timezone.utc).isoformat()}}
         )
+    await provider_page.invalidate(provider['provider_id'])
     
     return {"message": "Services reordered"}
 
@@ -1758,7 +1802,7 @@ async def create_quote_request(
     if quote_data.message:
         notification_content += f"\n\nMessage: {quote_data.message}"
     
-    await db.messages.insert_one({
+    await conversations.insert_message({
         "message_id": message_id,
         "sender_id": current_user.user_id,
         "receiver_id": provider['user_id'],
@@ -1894,6 +1938,7 @@ async def client_accept_quote(
     }
     
     await db.bookings.insert_one(booking_doc)
+    await rollups.record_booking_created(booking_doc)
     
     # Block the date for the provider
     await db.availability.update_one(
@@ -1907,11 +1952,12 @@ async def client_accept_quote(
         }},
         upsert=True
     )
+    await provider_page.invalidate(quote['provider_id'])
     
     # Notify provider via message
     if provider:
         message_id = f"msg_{uuid.uuid4().hex[:12]}"
-        await db.messages.insert_one({
+        await conversations.insert_message({
             "message_id": message_id,
             "sender_id": current_user.user_id,
             "receiver_id": provider['user_id'],
@@ -1973,69 +2019,44 @@ async def send_message(
         "created_at": datetime.now(timezone.utc).isoformat()
     })
     
-    await db.messages.insert_one(message_doc)
+    # Fast path: store and deliver
+    await conversations.insert_message(message_doc, summary=False)
+    await sio.emit('new_message', message_doc, room=message_data.receiver_id)
     
-    # Check message for moderation (flag inappropriate content)
-    try:
-        from admin import check_message_for_moderation
-        await check_message_for_moderation(message_doc)
-    except Exception as e:
-        print(f"Moderation check error: {e}")
-    
-    # Send email notification to receiver
-    try:
-        from email_service import send_new_message_notification
-        import asyncio
-        
-        receiver = await db.users.find_one({"user_id": message_data.receiver_id}, {"_id": 0})
-        if receiver:
-            asyncio.create_task(send_new_message_notification(
-                receiver['email'],
-                receiver['name'],
-                current_user.name,
-                message_doc.get('content', '')
-            ))
-    except Exception as e:
-        print(f"Message notification error: {e}")
+    # Conversation summary, moderation and the email digest run in the background
+    await message_pipeline.submit(message_doc, sender_name=current_user.name)
     
     # Prepare response
     response_doc = message_doc.copy()
     response_doc['created_at'] = datetime.fromisoformat(message_doc['created_at'])
     
-    # Emit via Socket.IO if receiver is connected
-    receiver_id = message_data.receiver_id
-    if receiver_id in connected_users:
-        await sio.emit('new_message', message_doc, room=receiver_id)
-    
     return Message(**response_doc)
 
 @api_router.get("/messages/conversations")
-async def get_conversations(current_user: User = Depends(get_current_user)):
-    """Get list of users the current user has conversations with"""
-    messages = await db.messages.find(
-        {"$or": [
-            {"sender_id": current_user.user_id},
-            {"receiver_id": current_user.user_id}
-        ]},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Get unique user IDs
-    user_ids = set()
-    for msg in messages:
-        if msg['sender_id'] != current_user.user_id:
-            user_ids.add(msg['sender_id'])
-        if msg['receiver_id'] != current_user.user_id:
-            user_ids.add(msg['receiver_id'])
+async def get_conversations(
+    limit: int = Query(50, ge=1, le=100),
+    before: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get the users the current user has conversations with, most recent first.
+    Each entry also carries the conversation summary (last message, unread count);
+    pass the last entry's updated_at as `before` to get the next page.
+    """
+    rows = await conversations.get_inbox(current_user.user_id, limit=limit, before=before)
     
-    # Get user details
     users = []
-    for user_id in user_ids:
-        user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-        if user_doc:
-            if isinstance(user_doc['created_at'], str):
-                user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
-            users.append(User(**user_doc))
+    for row in rows:
+        user_doc = row['user']
+        if isinstance(user_doc.get('created_at'), str):
+            user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+        users.append({
+            **User(**user_doc).model_dump(),
+            "conversation_id": row['conversation_id'],
+            "last_message": row.get('last_message'),
+            "unread_count": row.get('unread', {}).get(current_user.user_id, 0),
+            "updated_at": row['updated_at']
+        })
     
     return users
 
@@ -2048,19 +2069,30 @@ async def get_recent_messages(current_user: User = Depends(get_current_user)):
         {"_id": 0}
     ).sort("created_at", -1).limit(5).to_list(5)
     
-    # Get total unread count
-    unread_count = await db.messages.count_documents({
-        "receiver_id": current_user.user_id,
-        "read": False
-    })
+    # Get total unread count from the conversation summaries
+    unread_count = await conversations.get_unread_total(current_user.user_id)
+    await conversations.apply_read_state(recent_messages)
     
     # Enrich messages with sender info
+    sender_ids = list({msg['sender_id'] for msg in recent_messages})
+    senders = {
+        u['user_id']: u for u in await db.users.find(
+            {"user_id": {"$in": sender_ids}},
+            {"_id": 0, "user_id": 1, "name": 1, "picture": 1}
+        ).to_list(len(sender_ids))
+    }
+    providers = {
+        p['user_id']: p for p in await db.provider_profiles.find(
+            {"user_id": {"$in": sender_ids}},
+            {"_id": 0, "user_id": 1, "business_name": 1}
+        ).to_list(len(sender_ids))
+    }
+    
     enriched_messages = []
     for msg in recent_messages:
-        sender = await db.users.find_one({"user_id": msg['sender_id']}, {"_id": 0, "password_hash": 0})
+        sender = senders.get(msg['sender_id'])
         if sender:
-            # Check if sender is a provider
-            provider = await db.provider_profiles.find_one({"user_id": msg['sender_id']}, {"_id": 0})
+            provider = providers.get(msg['sender_id'])
             enriched_messages.append({
                 "message_id": msg['message_id'],
                 "content": msg['content'][:100] + "..." if len(msg['content']) > 100 else msg['content'],
@@ -2079,24 +2111,48 @@ async def get_recent_messages(current_user: User = Depends(get_current_user)):
         "unread_count": unread_count
     }
 
+@api_router.get("/messages/sync")
+async def sync_messages(
+    since: Optional[str] = None,
+    limit: int = Query(conversations.DEFAULT_PAGE_SIZE, ge=1, le=conversations.MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Delta sync: messages sent or received after the `since` cursor, oldest first.
+    Call without `since` to get a starting cursor; keep calling with the returned
+    cursor while has_more is true. read_at holds the read watermarks of the
+    conversations involved.
+    """
+    try:
+        return await conversations.get_changes(current_user.user_id, since=since, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @api_router.get("/messages/{other_user_id}", response_model=List[Message])
 async def get_messages(
     other_user_id: str,
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(conversations.DEFAULT_PAGE_SIZE, ge=1, le=conversations.MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user)
 ):
-    messages = await db.messages.find(
-        {"$or": [
-            {"sender_id": current_user.user_id, "receiver_id": other_user_id},
-            {"sender_id": other_user_id, "receiver_id": current_user.user_id}
-        ]},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(1000)
+    """
+    Get one page of a thread, oldest first. The newest page is returned by default;
+    the X-Next-Cursor header, passed back as `before`, gives the previous page.
+    """
+    try:
+        messages, next_cursor = await conversations.get_history(
+            current_user.user_id, other_user_id, limit=limit, before=before
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    # Mark as read
-    await db.messages.update_many(
-        {"sender_id": other_user_id, "receiver_id": current_user.user_id, "read": False},
-        {"$set": {"read": True}}
-    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    
+    # Opening the thread moves the read watermark
+    if not before:
+        await conversations.mark_read(current_user.user_id, other_user_id)
     
     for m in messages:
         if isinstance(m['created_at'], str):
@@ -2184,11 +2240,8 @@ async def get_marketplace_item(item_id: str):
     if not item:
         raise HTTPException(status_code=404, detail="Article non trouvé")
     
-    # Increment view count
-    await db.marketplace_items.update_one(
-        {"item_id": item_id},
-        {"$inc": {"views_count": 1}}
-    )
+    # Increment view count (written in bulk by the counters worker)
+    counters.marketplace_views.add(item_id)
     
     if isinstance(item.get('created_at'), str):
         item['created_at'] = datetime.fromisoformat(item['created_at'])
@@ -2401,17 +2454,10 @@ async def create_marketplace_checkout(
     amount = inquiry.get('offer_amount') or item['price']
     amount = round(float(amount), 2)
     
-    # Initialize Stripe
-    api_key = os.environ.get('STRIPE_API_KEY')
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Paiement non configuré")
-    
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
     success_url = f"{origin_url}/marketplace/payment/success?inquiry_id={inquiry_id}"
     cancel_url = f"{origin_url}/marketplace"
     
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+    gateway = get_payment_gateway(str(request.base_url))
     
     transaction_id = f"mkt_txn_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc).isoformat()
@@ -2426,14 +2472,13 @@ async def create_marketplace_checkout(
     }
     
     try:
-        checkout_request = CheckoutSessionRequest(
+        session = await gateway.create_checkout_session(
             amount=amount,
             currency="eur",
             success_url=success_url,
             cancel_url=cancel_url,
             metadata=metadata
         )
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
         
         # Store transaction
         transaction_doc = {
@@ -2469,12 +2514,8 @@ async def get_marketplace_payment_status(
     request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """Check marketplace payment status"""
-    # Find transaction
-    transaction = await db.marketplace_transactions.find_one(
-        {"inquiry_id": inquiry_id},
-        {"_id": 0}
-    )
+    """Check marketplace payment status (database read, see get_payment_status)"""
+    transaction = await get_cached_transaction("marketplace_transactions", "inquiry_id", inquiry_id)
     
     if not transaction:
         return {"status": "not_found", "paid": False}
@@ -2483,7 +2524,15 @@ async def get_marketplace_payment_status(
     if transaction['buyer_id'] != current_user.user_id and transaction['seller_id'] != current_user.user_id:
         raise HTTPException(status_code=403, detail="Non autorisé")
     
-    # If already paid, return cached status
+    if (
+        transaction['payment_status'] == 'pending'
+        and transaction.get('session_id')
+        and await claim_stripe_reconcile("marketplace_transactions", transaction['session_id'])
+    ):
+        await reconcile_checkout_session(request, transaction['session_id'])
+        payment_status_cache.pop(inquiry_id, None)
+        transaction = await get_cached_transaction("marketplace_transactions", "inquiry_id", inquiry_id)
+    
     if transaction['payment_status'] == 'paid':
         return {
             "status": "paid",
@@ -2492,49 +2541,6 @@ async def get_marketplace_payment_status(
             "item_title": transaction['item_title']
         }
     
-    # Poll Stripe for status
-    api_key = os.environ.get('STRIPE_API_KEY')
-    if not api_key or not transaction.get('session_id'):
-        return {"status": transaction['payment_status'], "paid": False}
-    
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-    
-    try:
-        checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(transaction['session_id'])
-        
-        if checkout_status.payment_status == "paid":
-            # Update transaction
-            await db.marketplace_transactions.update_one(
-                {"inquiry_id": inquiry_id},
-                {"$set": {
-                    "payment_status": "paid",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            # Update item status to sold
-            await db.marketplace_items.update_one(
-                {"item_id": transaction['item_id']},
-                {"$set": {"status": "sold"}}
-            )
-            
-            # Update inquiry status
-            await db.marketplace_inquiries.update_one(
-                {"inquiry_id": inquiry_id},
-                {"$set": {"status": "paid"}}
-            )
-            
-            return {
-                "status": "paid",
-                "paid": True,
-                "amount": transaction['amount'],
-                "item_title": transaction['item_title']
-            }
-    except Exception as e:
-        logger.error(f"Error checking payment: {e}")
-    
     return {"status": transaction['payment_status'], "paid": False}
 
 # ============ MARKETPLACE IMAGE UPLOAD ============
@@ -2787,6 +2793,7 @@ async def create_package(
     }
     
     await db.event_packages.insert_one(package_doc)
+    await http_cache.invalidate("/api/packages")
     package_doc['created_at'] = datetime.fromisoformat(package_doc['created_at'])
     return EventPackage(**package_doc)
 
@@ -2830,6 +2837,7 @@ async def update_package(
             {"package_id": package_id},
             {"$set": update_dict}
         )
+        await http_cache.invalidate("/api/packages")
     
     updated = await db.event_packages.find_one({"package_id": package_id}, {"_id": 0})
     if isinstance(updated['created_at'], str):
@@ -2869,6 +2877,8 @@ async def book_package(
             "updated_at": now.isoformat()
         }
         await db.bookings.insert_one(booking_doc)
+        await rollups.record_booking_created(booking_doc)
+        await provider_page.invalidate(provider['provider_id'])
         booking_ids.append(booking_id)
     
     # Return first booking as reference
@@ -2879,7 +2889,8 @@ async def book_package(
 
 # ============ PAYMENT ROUTES (STRIPE) ============
 
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from payment_gateway import get_payment_gateway, PaymentGatewayError
+from payment_events import record_webhook_event, apply_paid_session
 
 @api_router.post("/payments/create-checkout")
 async def create_checkout_session(
@@ -2945,18 +2956,11 @@ async def create_checkout_session(
     # Round to 2 decimals
     amount = round(amount, 2)
     
-    # Initialize Stripe
-    api_key = os.environ.get('STRIPE_API_KEY')
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Payment not configured")
-    
-    # Build webhook and redirect URLs
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
+    # Build redirect URLs
     success_url = f"{origin_url}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{origin_url}/dashboard"
     
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+    gateway = get_payment_gateway(str(request.base_url))
     
     # Create transaction record BEFORE creating checkout session
     transaction_id = f"txn_{uuid.uuid4().hex[:12]}"
@@ -2975,14 +2979,13 @@ async def create_checkout_session(
     
     try:
         # Create Stripe checkout session
-        checkout_request = CheckoutSessionRequest(
+        session = await gateway.create_checkout_session(
             amount=amount,
             currency="eur",
             success_url=success_url,
             cancel_url=cancel_url,
             metadata=metadata
         )
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
         
         # Store transaction in database
         transaction_doc = {
@@ -3012,18 +3015,114 @@ async def create_checkout_session(
         logger.error(f"Stripe error: {e}")
         raise HTTPException(status_code=500, detail=f"Payment error: {str(e)}")
 
+# Transactions read by the status endpoints are cached for a few seconds;
+# payment_events drops the entry as soon as a payment is applied.
+PAYMENT_STATUS_CACHE_TTL = 3
+PAYMENT_STATUS_CACHE_SIZE = 10000
+# When no webhook has arrived, Stripe is asked at most once per interval
+STRIPE_RECONCILE_INTERVAL = int(os.environ.get('STRIPE_RECONCILE_INTERVAL', '15'))
+
+class TTLCache:
+    """
+    Bounded cache whose entries expire after `ttl` seconds. Entries are kept
+    in expiry order, so expired ones are evicted from the front on every write
+    and the oldest go first once `max_size` is reached.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        now = time.monotonic()
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else default
+
+    def __len__(self):
+        return len(self._entries)
+
+payment_status_cache = TTLCache(PAYMENT_STATUS_CACHE_TTL, PAYMENT_STATUS_CACHE_SIZE)
+
+async def get_cached_transaction(collection: str, key_field: str, key: str) -> Optional[dict]:
+    """Read a transaction through the short-lived status cache"""
+    cached = payment_status_cache.get(key)
+    if cached:
+        return cached
+    
+    transaction = await db[collection].find_one({key_field: key}, {"_id": 0})
+    if transaction:
+        payment_status_cache.set(key, transaction)
+    return transaction
+
+async def claim_stripe_reconcile(collection: str, session_id: str) -> bool:
+    """Let a single request (across workers) check a pending session with Stripe per interval"""
+    now = datetime.now(timezone.utc)
+    threshold = (now - timedelta(seconds=STRIPE_RECONCILE_INTERVAL)).isoformat()
+    result = await db[collection].update_one(
+        {
+            "session_id": session_id,
+            "payment_status": "pending",
+            "created_at": {"$lte": threshold},
+            "$or": [
+                {"last_reconciled_at": {"$exists": False}},
+                {"last_reconciled_at": {"$lte": threshold}}
+            ]
+        },
+        {"$set": {"last_reconciled_at": now.isoformat()}}
+    )
+    return result.modified_count == 1
+
+async def reconcile_checkout_session(request: Request, session_id: str):
+    """Fallback when the webhook is late: ask Stripe once and apply the result"""
+    try:
+        checkout_status = await get_payment_gateway(str(request.base_url)).get_checkout_status(session_id)
+    except PaymentGatewayError as e:
+        logger.error(f"Error checking payment status: {e}")
+        return
+    
+    if checkout_status.payment_status == "paid":
+        await apply_paid_session(session_id, checkout_status.metadata)
+    elif checkout_status.status == "expired":
+        for collection in ("payment_transactions", "marketplace_transactions"):
+            await db[collection].update_one(
+                {"session_id": session_id, "payment_status": "pending"},
+                {"$set": {
+                    "payment_status": "expired",
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }}
+            )
+
 @api_router.get("/payments/status/{session_id}")
 async def get_payment_status(
     session_id: str,
     request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """Check payment status and update booking if paid"""
-    # Find transaction
-    transaction = await db.payment_transactions.find_one(
-        {"session_id": session_id},
-        {"_id": 0}
-    )
+    """
+    Check payment status.
+    Payments are applied by the webhook worker and pushed to the payer as a
+    'payment_confirmed' Socket.IO event; this endpoint only reads the database.
+    """
+    transaction = await get_cached_transaction("payment_transactions", "session_id", session_id)
     
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
@@ -3032,166 +3131,43 @@ async def get_payment_status(
     if transaction['user_id'] != current_user.user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # If already processed, return cached status
-    if transaction['payment_status'] in ['paid', 'failed', 'refunded']:
-        return {
-            "status": transaction['payment_status'],
-            "amount": transaction['amount'],
-            "booking_id": transaction['booking_id']
-        }
+    if transaction['payment_status'] == 'pending' and await claim_stripe_reconcile("payment_transactions", session_id):
+        await reconcile_checkout_session(request, session_id)
+        payment_status_cache.pop(session_id, None)
+        transaction = await get_cached_transaction("payment_transactions", "session_id", session_id)
     
-    # Poll Stripe for status
-    api_key = os.environ.get('STRIPE_API_KEY')
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-    
-    try:
-        checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-        
-        new_status = "pending"
-        if checkout_status.payment_status == "paid":
-            new_status = "paid"
-        elif checkout_status.status == "expired":
-            new_status = "expired"
-        
-        # Update transaction if status changed
-        if new_status != transaction['payment_status']:
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": {
-                    "payment_status": new_status,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            # If paid, update booking
-            if new_status == "paid":
-                booking = await db.bookings.find_one(
-                    {"booking_id": transaction['booking_id']},
-                    {"_id": 0}
-                )
-                if booking:
-                    new_deposit_paid = float(booking.get('deposit_paid', 0)) + transaction['amount']
-                    total_amount = float(booking['total_amount'])
-                    
-                    # Determine new payment status
-                    if new_deposit_paid >= total_amount:
-                        booking_payment_status = "paid"
-                    elif new_deposit_paid >= float(booking.get('deposit_required', total_amount * 0.3)):
-                        booking_payment_status = "partial"
-                    else:
-                        booking_payment_status = "pending"
-                    
-                    await db.bookings.update_one(
-                        {"booking_id": transaction['booking_id']},
-                        {"$set": {
-                            "deposit_paid": new_deposit_paid,
-                            "payment_status": booking_payment_status,
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }}
-                    )
-                    
-                    # Send notification message to provider
-                    provider = await db.provider_profiles.find_one(
-                        {"provider_id": booking['provider_id']},
-                        {"_id": 0}
-                    )
-                    if provider:
-                        message_id = f"msg_{uuid.uuid4().hex[:12]}"
-                        payment_msg = f"💳 Paiement reçu !\n\n{current_user.name} a effectué un paiement de {transaction['amount']}€"
-                        if transaction['payment_type'] == 'installment':
-                            payment_msg += f" (versement {transaction['installment_number']}/{transaction['total_installments']})"
-                        payment_msg += f"\n\nRéférence: {transaction['booking_id']}\nTotal payé: {new_deposit_paid}€ / {total_amount}€"
-                        
-                        await db.messages.insert_one({
-                            "message_id": message_id,
-                            "sender_id": current_user.user_id,
-                            "receiver_id": provider['user_id'],
-                            "content": payment_msg,
-                            "read": False,
-                            "created_at": datetime.now(timezone.utc).isoformat()
-                        })
-        
-        return {
-            "status": new_status,
-            "payment_status": checkout_status.payment_status,
-            "amount": transaction['amount'],
-            "booking_id": transaction['booking_id']
-        }
-    except Exception as e:
-        logger.error(f"Error checking payment status: {e}")
-        return {
-            "status": transaction['payment_status'],
-            "amount": transaction['amount'],
-            "booking_id": transaction['booking_id']
-        }
+    return {
+        "status": transaction['payment_status'],
+        "amount": transaction['amount'],
+        "booking_id": transaction['booking_id']
+    }
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhook events"""
-    api_key = os.environ.get('STRIPE_API_KEY')
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Payment not configured")
-    
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-    
+    """
+    Handle Stripe webhook events.
+    Events are stored by Stripe event ID and acknowledged right away;
+    the payment_events worker applies them.
+    """
     try:
         body = await request.body()
         signature = request.headers.get("Stripe-Signature")
         
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        # Process webhook event
-        if webhook_response.payment_status == "paid":
-            session_id = webhook_response.session_id
-            
-            # Find and update transaction
-            transaction = await db.payment_transactions.find_one(
-                {"session_id": session_id},
-                {"_id": 0}
-            )
-            
-            if transaction and transaction['payment_status'] != 'paid':
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {"$set": {
-                        "payment_status": "paid",
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-                
-                # Update booking
-                booking = await db.bookings.find_one(
-                    {"booking_id": transaction['booking_id']},
-                    {"_id": 0}
-                )
-                if booking:
-                    new_deposit_paid = float(booking.get('deposit_paid', 0)) + transaction['amount']
-                    total_amount = float(booking['total_amount'])
-                    
-                    if new_deposit_paid >= total_amount:
-                        booking_payment_status = "paid"
-                    elif new_deposit_paid >= float(booking.get('deposit_required', total_amount * 0.3)):
-                        booking_payment_status = "partial"
-                    else:
-                        booking_payment_status = "pending"
-                    
-                    await db.bookings.update_one(
-                        {"booking_id": transaction['booking_id']},
-                        {"$set": {
-                            "deposit_paid": new_deposit_paid,
-                            "payment_status": booking_payment_status,
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }}
-                    )
-        
-        return {"status": "received"}
-    except Exception as e:
+        event = await get_payment_gateway(str(request.base_url)).handle_webhook(body, signature)
+    except PaymentGatewayError as e:
         logger.error(f"Webhook error: {e}")
         return {"status": "error", "message": str(e)}
+    
+    # Let a storage failure surface as a 5xx so Stripe retries the delivery
+    recorded = await record_webhook_event(
+        event_id=event.event_id,
+        event_type=event.event_type,
+        session_id=event.session_id,
+        payment_status=event.payment_status,
+        metadata=event.metadata
+    )
+    
+    return {"status": "received", "duplicate": not recorded}
 
 @api_router.get("/payments/booking/{booking_id}")
 async def get_booking_payments(
@@ -3306,28 +3282,21 @@ async def get_file(filename: str):
 @api_router.get("/reviews/provider/{provider_id}")
 async def get_provider_reviews(provider_id: str, limit: int = 20, skip: int = 0):
     """Get all reviews for a provider"""
-    reviews = await db.reviews.find(
-        {"provider_id": provider_id},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit)
-    
-    # Calculate stats
-    total_reviews = await db.reviews.count_documents({"provider_id": provider_id})
-    verified_count = await db.reviews.count_documents({"provider_id": provider_id, "is_verified": True})
-    
-    # Calculate average rating
-    pipeline = [
-        {"$match": {"provider_id": provider_id}},
-        {"$group": {"_id": None, "avg_rating": {"$avg": "$rating"}}}
-    ]
-    avg_result = await db.reviews.aggregate(pipeline).to_list(length=1)
-    avg_rating = round(avg_result[0]["avg_rating"], 1) if avg_result else 0
+    # Stats are maintained on the profile (see review_stats)
+    reviews, stats = await asyncio.gather(
+        db.reviews.find(
+            {"provider_id": provider_id},
+            {"_id": 0}
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+        review_stats.get_stats(provider_id)
+    )
     
     return {
         "reviews": reviews,
-        "total": total_reviews,
-        "verified_count": verified_count,
-        "average_rating": avg_rating
+        "total": stats["count"],
+        "verified_count": stats["verified_count"],
+        "average_rating": review_stats.average(stats),
+        "histogram": stats["histogram"]
     }
 
 @api_router.post("/reviews")
@@ -3383,24 +3352,12 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
     await db.reviews.insert_one(review_doc)
     
     # Update provider's rating
-    pipeline = [
-        {"$match": {"provider_id": review_data.provider_id}},
-        {"$group": {"_id": None, "avg_rating": {"$avg": "$rating"}, "count": {"$sum": 1}}}
-    ]
-    stats = await db.reviews.aggregate(pipeline).to_list(length=1)
-    if stats:
-        await db.provider_profiles.update_one(
-            {"provider_id": review_data.provider_id},
-            {"$set": {
-                "rating": round(stats[0]["avg_rating"], 1),
-                "total_reviews": stats[0]["count"]
-            }}
-        )
+    await review_stats.record_review(review_doc)
+    await provider_page.invalidate(review_data.provider_id)
     
     # Send email notification to provider
     try:
         from email_service import send_new_review_notification
-        import asyncio
         
         provider = await db.provider_profiles.find_one({"provider_id": review_data.provider_id}, {"_id": 0})
         if provider:
@@ -3411,11 +3368,11 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
                     "rating": review_data.rating,
                     "comment": review_data.comment
                 }
-                asyncio.create_task(send_new_review_notification(
+                await send_new_review_notification(
                     provider_user['email'],
                     provider['business_name'],
                     review_notification
-                ))
+                )
     except Exception as e:
         print(f"Review notification error: {e}")
     
@@ -3443,6 +3400,7 @@ async def respond_to_review(review_id: str, request: Request, current_user: User
         {"review_id": review_id},
         {"$set": {"provider_response": response_text}}
     )
+    await provider_page.invalidate(review["provider_id"])
     
     return {"success": True}
 
@@ -3516,6 +3474,7 @@ async def create_portfolio_item(item_data: PortfolioItemCreate, current_user: Us
     }
     
     await db.portfolio_items.insert_one(item_doc)
+    await provider_page.invalidate(provider["provider_id"])
     
     return {"item_id": item_id}
 
@@ -3537,6 +3496,7 @@ async def update_portfolio_item(item_id: str, item_data: PortfolioItemUpdate, cu
             {"item_id": item_id},
             {"$set": update_data}
         )
+        await provider_page.invalidate(provider["provider_id"])
     
     return {"success": True}
 
@@ -3554,6 +3514,7 @@ async def delete_portfolio_item(item_id: str, current_user: User = Depends(get_c
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item non trouvé")
+    await provider_page.invalidate(provider["provider_id"])
     
     return {"success": True}
 
@@ -3613,11 +3574,8 @@ async def upload_portfolio_video(
 
 @api_router.post("/portfolio/{item_id}/view")
 async def increment_portfolio_view(item_id: str):
-    """Increment view count for a portfolio item"""
-    await db.portfolio_items.update_one(
-        {"item_id": item_id},
-        {"$inc": {"views_count": 1}}
-    )
+    """Increment view count for a portfolio item (written in bulk by the counters worker)"""
+    counters.portfolio_views.add(item_id)
     return {"success": True}
 
 @api_router.get("/portfolio/my-items")
@@ -3662,15 +3620,21 @@ async def get_all_packs(event_type: str = None):
     
     packs = await db.provider_packs.find(query, {"_id": 0}).sort("created_at", -1).to_list(length=100)
     
-    # Enrich with provider info
+    # Enrich with provider info (one query for all packs)
+    provider_ids = list({pack["provider_id"] for pack in packs})
+    providers = {
+        p["provider_id"]: p
+        async for p in db.provider_profiles.find(
+            {"provider_id": {"$in": provider_ids}},
+            {"_id": 0, "provider_id": 1, "business_name": 1, "category": 1, "location": 1,
+             "profile_image": 1, "rating": 1, "verified": 1}
+        )
+    }
     result = []
     for pack in packs:
-        provider = await db.provider_profiles.find_one(
-            {"provider_id": pack["provider_id"]}, 
-            {"_id": 0, "business_name": 1, "category": 1, "location": 1, "profile_image": 1, "rating": 1, "verified": 1}
-        )
+        provider = providers.get(pack["provider_id"])
         if provider:
-            pack["provider"] = provider
+            pack["provider"] = {k: v for k, v in provider.items() if k != "provider_id"}
             result.append(pack)
     
     return result
@@ -3707,6 +3671,9 @@ async def create_provider_pack(
     }
     
     await db.provider_packs.insert_one(pack_doc)
+    await http_cache.invalidate("/api/packs")
+    bootstrap.mark_stale()
+    await provider_page.invalidate(provider_id)
     
     return {"pack_id": pack_id}
 
@@ -3732,14 +3699,15 @@ async def submit_contact_form(request: Request):
     
     # Try to send email notification
     try:
-        site_content = await db.site_settings.find_one({"key": "site_content"})
-        if site_content and site_content.get("value", {}).get("contact", {}).get("email"):
-            admin_email = site_content["value"]["contact"]["email"]
-            from email_service import send_email
-            await send_email(
+        site_content = await settings_service.get("site_content") or {}
+        if site_content.get("contact", {}).get("email"):
+            admin_email = site_content["contact"]["email"]
+            from email_service import queue_email
+            await queue_email(
                 to_email=admin_email,
                 subject=f"Nouveau message de contact: {body.get('subject')}",
-                body=f"""
+                category="contact",
+                html_content=f"""
                 <h2>Nouveau message de contact</h2>
                 <p><strong>Nom:</strong> {body.get('name')}</p>
                 <p><strong>Email:</strong> {body.get('email')}</p>
@@ -3778,6 +3746,9 @@ async def update_provider_pack(
             {"pack_id": pack_id},
             {"$set": update_data}
         )
+        await http_cache.invalidate("/api/packs")
+        bootstrap.mark_stale()
+        await provider_page.invalidate(provider["provider_id"])
     
     return {"success": True}
 
@@ -3798,77 +3769,112 @@ async def delete_provider_pack(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Pack non trouvé")
+    await http_cache.invalidate("/api/packs")
+    bootstrap.mark_stale()
+    await provider_page.invalidate(provider["provider_id"])
     
     return {"success": True}
 
 # ============ REAL-TIME MESSAGING WITH SOCKET.IO ============
 
-# Track connected users: {user_id: sid}
-connected_users = {}
+# Every emit targets the user's room. With SOCKETIO_MESSAGE_QUEUE set, the
+# client manager relays it to the worker/node holding the user's sockets, and
+# presence is tracked cluster-wide in the socket_connections collection.
+# The session is validated once at connect; events use the identity bound to
+# the socket, never a user id taken from the payload.
 
 @sio.event
-async def connect(sid, environ):
-    logger.info(f"Client {sid} connected")
+async def connect(sid, environ, auth=None):
+    """Authenticate the handshake (session cookie, auth token or Bearer header)"""
+    session_token = realtime.session_token_from(environ, auth)
+    if not session_token:
+        raise socketio.exceptions.ConnectionRefusedError("Not authenticated")
+    try:
+        session_doc, user_doc = await load_session(session_token)
+    except HTTPException as e:
+        raise socketio.exceptions.ConnectionRefusedError(e.detail)
+    
+    user_id = user_doc["user_id"]
+    await sio.save_session(sid, {
+        "user_id": user_id,
+        "expires_at": session_doc["expires_at"]
+    })
+    await sio.enter_room(sid, user_id)
+    try:
+        await realtime.register_connection(sid, user_id, session_token)
+    except Exception as e:
+        logger.warning(f"Presence update failed for {user_id}: {e}")
+    logger.info(f"User {user_id} connected (sid: {sid})")
+
+async def socket_user(sid) -> Optional[str]:
+    """User bound to a socket at connect; drops the socket once its session expired"""
+    session = await sio.get_session(sid)
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    if session["expires_at"] < datetime.now(timezone.utc):
+        await sio.disconnect(sid)
+        return None
+    return user_id
 
 @sio.event
 async def disconnect(sid):
-    # Remove user from connected_users
-    user_to_remove = None
-    for user_id, s in connected_users.items():
-        if s == sid:
-            user_to_remove = user_id
-            break
-    if user_to_remove:
-        del connected_users[user_to_remove]
+    await realtime.typing_throttle.forget_socket(sid)
+    try:
+        await realtime.unregister_connection(sid)
+    except Exception as e:
+        logger.warning(f"Presence cleanup failed for {sid}: {e}")
     logger.info(f"Client {sid} disconnected")
 
 @sio.event
-async def join_room(sid, data):
-    """User joins their personal room for receiving messages"""
-    user_id = data.get('user_id')
+async def join_room(sid, data=None):
+    """(Re)join the personal room; the socket already joins it at connect"""
+    user_id = await socket_user(sid)
     if user_id:
-        connected_users[user_id] = sid
         await sio.enter_room(sid, user_id)
+        try:
+            await realtime.register_connection(sid, user_id)
+        except Exception as e:
+            logger.warning(f"Presence update failed for {user_id}: {e}")
         logger.info(f"User {user_id} joined room (sid: {sid})")
 
 @sio.event
-async def leave_room(sid, data):
+async def leave_room(sid, data=None):
     """User leaves their room"""
-    user_id = data.get('user_id')
+    user_id = await socket_user(sid)
     if user_id:
         await sio.leave_room(sid, user_id)
-        if user_id in connected_users:
-            del connected_users[user_id]
+        try:
+            await realtime.unregister_connection(sid)
+        except Exception as e:
+            logger.warning(f"Presence cleanup failed for {sid}: {e}")
         logger.info(f"User {user_id} left room")
 
 @sio.event
 async def send_message(sid, data):
     """Handle real-time message sending"""
     try:
-        sender_id = data.get('sender_id')
+        sender_id = await socket_user(sid)
+        if not sender_id:
+            return
         receiver_id = data.get('receiver_id')
         content = data.get('content', '')
         attachments = data.get('attachments', [])
         
-        if not sender_id or not receiver_id:
-            await sio.emit('error', {'message': 'sender_id and receiver_id required'}, room=sid)
+        if not receiver_id:
+            await sio.emit('error', {'message': 'receiver_id required'}, room=sid)
             return
         
         if not content and not attachments:
             await sio.emit('error', {'message': 'Message content or attachment required'}, room=sid)
             return
         
-        # Create conversation_id for grouping messages
-        sorted_ids = sorted([sender_id, receiver_id])
-        conversation_id = f"conv_{sorted_ids[0]}_{sorted_ids[1]}"
-        
         # Create message in database
         message_id = f"msg_{uuid.uuid4().hex[:12]}"
         now = datetime.now(timezone.utc).isoformat()
         
         message_doc = {
             "message_id": message_id,
-            "conversation_id": conversation_id,
             "sender_id": sender_id,
             "receiver_id": receiver_id,
             "content": content,
@@ -3877,14 +3883,8 @@ async def send_message(sid, data):
             "created_at": now
         }
         
-        await db.messages.insert_one(message_doc)
-        
-        # Check for inappropriate content (moderation)
-        try:
-            from admin import check_message_for_moderation
-            await check_message_for_moderation(message_doc)
-        except Exception as mod_err:
-            logger.warning(f"Moderation check failed: {mod_err}")
+        await conversations.insert_message(message_doc, summary=False)
+        realtime.presence.touch(sender_id)
         
         # Prepare response message
         response_msg = {
@@ -3900,9 +3900,11 @@ async def send_message(sid, data):
         # Emit to sender (confirmation)
         await sio.emit('message_sent', response_msg, room=sid)
         
-        # Emit to receiver (if connected)
-        if receiver_id in connected_users:
-            await sio.emit('new_message', response_msg, room=receiver_id)
+        # Emit to receiver (on any worker)
+        await sio.emit('new_message', response_msg, room=receiver_id)
+        
+        # Conversation summary and moderation run in the background
+        await message_pipeline.submit(message_doc, steps=("summary", "moderation"))
         
         logger.info(f"Message sent from {sender_id} to {receiver_id}")
         
@@ -3914,37 +3916,31 @@ async def send_message(sid, data):
 async def mark_read(sid, data):
     """Mark messages as read"""
     try:
-        reader_id = data.get('reader_id')
+        reader_id = await socket_user(sid)
         sender_id = data.get('sender_id')
         
         if reader_id and sender_id:
-            await db.messages.update_many(
-                {"sender_id": sender_id, "receiver_id": reader_id, "read": False},
-                {"$set": {"read": True}}
-            )
+            read_at = await conversations.mark_read(reader_id, sender_id)
             
             # Notify sender that messages were read
-            if sender_id in connected_users:
-                await sio.emit('messages_read', {
-                    'reader_id': reader_id,
-                    'sender_id': sender_id
-                }, room=sender_id)
+            await sio.emit('messages_read', {
+                'reader_id': reader_id,
+                'sender_id': sender_id,
+                'read_at': read_at
+            }, room=sender_id)
                 
     except Exception as e:
         logger.error(f"Error marking messages read: {e}")
 
 @sio.event
 async def typing(sid, data):
-    """Broadcast typing indicator"""
-    sender_id = data.get('sender_id')
+    """Forward typing indicators, coalesced per conversation (see realtime.TypingThrottle)"""
+    sender_id = await socket_user(sid)
     receiver_id = data.get('receiver_id')
-    is_typing = data.get('is_typing', False)
+    is_typing = bool(data.get('is_typing', False))
     
-    if receiver_id in connected_users:
-        await sio.emit('user_typing', {
-            'user_id': sender_id,
-            'is_typing': is_typing
-        }, room=receiver_id)
+    if sender_id and receiver_id:
+        await realtime.typing_throttle.update(sid, sender_id, receiver_id, is_typing)
 
 # Include router
 app.include_router(api_router)
@@ -3954,10 +3950,17 @@ from subscriptions import router as subscriptions_router
 from admin import router as admin_router
 from admin_auth import router as admin_auth_router
 from events import router as events_router
+from campaigns import router as campaigns_router
 app.include_router(subscriptions_router)
 app.include_router(admin_router)
 app.include_router(admin_auth_router)
 app.include_router(events_router)
+app.include_router(campaigns_router)
+app.include_router(provider_page.router)
+app.include_router(bootstrap.router)
+
+# Public GETs served from the shared response cache (added first: CORS wraps it)
+app.add_middleware(http_cache.HTTPCacheMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -3965,8 +3968,51 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.on_event("startup")
+async def start_background_workers():
+    import payment_events
+    import campaigns
+    await payment_events.ensure_indexes()
+    payment_events.start_worker()
+    await rollups.ensure_indexes()
+    rollups.start_backfill()
+    await conversations.ensure_indexes()
+    asyncio.create_task(conversations.ensure_populated())
+    asyncio.create_task(review_stats.ensure_populated())
+    await realtime.ensure_indexes()
+    realtime.start_presence()
+    message_pipeline.start_workers()
+    await message_notifications.ensure_indexes()
+    message_notifications.start_worker()
+    await email_outbox.ensure_indexes()
+    email_outbox.start_worker()
+    email_templates.load()
+    await settings_service.load()
+    settings_service.start_worker()
+    await http_cache.ensure_indexes()
+    http_cache.start_worker()
+    bootstrap.start_worker()
+    await counters.ensure_indexes()
+    counters.start_worker()
+    campaigns.start_worker()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    import payment_events
+    import campaigns
+    await payment_events.stop_worker()
+    await rollups.stop_backfill()
+    await message_pipeline.stop_workers()
+    await message_notifications.stop_worker()
+    await email_outbox.stop_worker()
+    await settings_service.stop_worker()
+    await http_cache.stop_worker()
+    await bootstrap.stop_worker()
+    await counters.stop_worker()
+    await campaigns.stop_worker()
+    await smtp_transport.close()
+    await realtime.stop_presence()
     client.close()
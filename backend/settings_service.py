@@ -0,0 +1,179 @@
+"""
+Settings Service
+site_settings, the homepage content and the moderation config loaded once per
+process and served from memory; admin writes bump a version stamp that every
+worker polls, so all of them reload within POLL_INTERVAL
+"""
+import asyncio
+import copy
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How often each worker checks the version stamp (one tiny query)
+POLL_INTERVAL = float(os.environ.get('SETTINGS_POLL_INTERVAL', '5'))
+VERSION_ID = "settings"  # _id of the stamp in cache_versions
+
+_settings: Dict[str, Any] = {}  # site_settings key -> value
+_homepage: Dict[str, Any] = {}  # site_content {"type": "homepage"} document
+_moderation: Dict[str, Any] = {}  # moderation_config {"type": "keywords"} document
+_state = {"version": None, "loaded_at": None}
+_lock = asyncio.Lock()
+_worker_task: Optional[asyncio.Task] = None
+_listeners: List[Callable[[], None]] = []
+
+_stats = {
+    "loads": 0,
+    "changes_published": 0,
+    "changes_received": 0,
+}
+
+
+def get_db():
+    """Get database connection"""
+    from server import db
+    return db
+
+
+# ============ LOADING ============
+
+async def _read_version() -> int:
+    doc = await get_db().cache_versions.find_one({"_id": VERSION_ID})
+    return doc["version"] if doc else 0
+
+
+async def load():
+    """(Re)load every setting from the database"""
+    global _settings, _homepage, _moderation
+    async with _lock:
+        db = get_db()
+        # Version first: a change landing during the load is picked up by the next poll
+        version = await _read_version()
+        settings = {doc["key"]: doc.get("value") async for doc in db.site_settings.find({}, {"_id": 0})}
+        homepage = await db.site_content.find_one({"type": "homepage"}, {"_id": 0})
+        moderation = await db.moderation_config.find_one({"type": "keywords"}, {"_id": 0})
+
+        _settings, _homepage, _moderation = settings, homepage or {}, moderation or {}
+        previous = _state["version"]
+        _state.update(version=version, loaded_at=datetime.now(timezone.utc).isoformat())
+        _stats["loads"] += 1
+
+    if previous is not None and version != previous:
+        for listener in _listeners:
+            listener()
+
+
+async def _ensure_loaded():
+    if _state["version"] is None:
+        await load()
+
+
+async def notify_changed():
+    """Call after writing a setting: reloads here and tells the other workers"""
+    await get_db().cache_versions.update_one(
+        {"_id": VERSION_ID}, {"$inc": {"version": 1}}, upsert=True
+    )
+    _stats["changes_published"] += 1
+    await load()
+
+
+def on_change(listener: Callable[[], None]):
+    """Call listener() whenever a reload brings a new settings version"""
+    _listeners.append(listener)
+
+
+def version() -> Optional[int]:
+    """Version of the settings in memory (None before the first load)"""
+    return _state["version"]
+
+
+# ============ ACCESSORS ============
+# Values are copied: callers may change what they get back
+
+async def get(key: str, default: Any = None) -> Any:
+    """Raw site_settings value for `key`"""
+    await _ensure_loaded()
+    if key not in _settings:
+        return default
+    return copy.deepcopy(_settings[key])
+
+
+async def commission() -> Dict[str, Any]:
+    """{"enabled": bool, "rate": percent} applied to bookings"""
+    return await get("commission") or {"enabled": False, "rate": 0}
+
+
+async def categories(mode: str) -> Optional[List[dict]]:
+    """Categories of a mode ("events" or "pro"), None when never edited"""
+    return await get(f"categories_{mode}")
+
+
+async def subscription_plans() -> Optional[List[dict]]:
+    """Plans edited by the admins, None when the defaults apply"""
+    return await get("subscription_plans") or None
+
+
+async def email_config() -> Optional[dict]:
+    """Stored SMTP config, None when never saved"""
+    return await get("email_config")
+
+
+async def homepage() -> Optional[dict]:
+    """Homepage content saved from the admin panel"""
+    await _ensure_loaded()
+    return copy.deepcopy(_homepage) if _homepage else None
+
+
+async def moderation_config() -> Optional[dict]:
+    """Keyword moderation config, None when never saved"""
+    await _ensure_loaded()
+    return copy.deepcopy(_moderation) if _moderation else None
+
+
+# ============ WORKER ============
+
+async def _worker_loop():
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        try:
+            if await _read_version() != _state["version"]:
+                _stats["changes_received"] += 1
+                await load()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Settings reload error: {e}")
+
+
+def start_worker():
+    """Start polling the version stamp (once per process)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop polling the version stamp"""
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+# ============ METRICS ============
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "version": _state["version"],
+        "loaded_at": _state["loaded_at"],
+        "keys": sorted(_settings),
+        "poll_interval_seconds": POLL_INTERVAL,
+    }
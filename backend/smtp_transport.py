@@ -0,0 +1,157 @@
+"""
+SMTP Transport
+Shared pool of authenticated SMTP connections, reused across emails instead
+of a new TCP + STARTTLS + AUTH session per send
+"""
+import asyncio
+import logging
+import os
+import time
+from email.message import Message
+from typing import List, Optional, Tuple
+
+import aiosmtplib
+
+import settings_service
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', '3'))
+# Servers drop idle sessions (often after 60-300s); recycle ours before that
+IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', '45'))  # seconds
+# Some providers limit the messages accepted per session
+MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+SEND_TIMEOUT = 30  # seconds
+
+# Errors after which the send is retried once on a fresh connection
+RECONNECT_ERRORS = (aiosmtplib.SMTPServerDisconnected, ConnectionError, asyncio.TimeoutError)
+
+_pool: Optional["SMTPPool"] = None
+
+_stats = {
+    "sent": 0,
+    "failed": 0,
+    "connections_opened": 0,
+    "reconnects": 0,
+}
+
+
+# ============ CONFIG ============
+
+async def load_email_config() -> Optional[dict]:
+    """Stored email config (site_settings, served from memory); None when never saved"""
+    return await settings_service.email_config()
+
+
+# ============ POOL ============
+
+def _pool_key(config: dict) -> Tuple:
+    return (config["smtp_host"], int(config["smtp_port"]), config.get("smtp_user"),
+            config.get("smtp_password"), config.get("start_tls"))
+
+
+class SMTPPool:
+    """Up to `size` authenticated connections to one SMTP server"""
+
+    def __init__(self, config: dict, size: Optional[int] = None):
+        self.key = _pool_key(config)
+        self.config = config
+        self._slots = asyncio.Semaphore(size or POOL_SIZE)
+        self._idle: List[Tuple[aiosmtplib.SMTP, float, int]] = []  # (connection, last used, messages sent)
+        self.closed = False
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        port = int(self.config["smtp_port"])
+        use_tls = port == 465
+        connection = aiosmtplib.SMTP(
+            hostname=self.config["smtp_host"],
+            port=port,
+            username=self.config.get("smtp_user") or None,
+            password=self.config.get("smtp_password") or None,
+            use_tls=use_tls,
+            start_tls=self.config.get("start_tls", not use_tls),
+            timeout=SEND_TIMEOUT,
+        )
+        await connection.connect()
+        _stats["connections_opened"] += 1
+        return connection
+
+    async def _acquire(self) -> Tuple[aiosmtplib.SMTP, int]:
+        now = time.monotonic()
+        while self._idle:
+            connection, last_used, sent = self._idle.pop()
+            if connection.is_connected and now - last_used < IDLE_TIMEOUT:
+                return connection, sent
+            await _quit(connection)
+        return await self._connect(), 0
+
+    async def send(self, message: Message):
+        async with self._slots:
+            connection, sent = await self._acquire()
+            try:
+                try:
+                    await connection.send_message(message)
+                except RECONNECT_ERRORS as e:
+                    # Dropped by the server while idle: one retry on a new session
+                    logger.info(f"SMTP connection lost ({e!r}), reconnecting")
+                    _stats["reconnects"] += 1
+                    await _quit(connection)
+                    connection, sent = await self._connect(), 0
+                    await connection.send_message(message)
+            except BaseException:
+                await _quit(connection)
+                raise
+            sent += 1
+            if sent >= MAX_MESSAGES_PER_CONNECTION or self.closed:
+                await _quit(connection)
+            else:
+                self._idle.append((connection, time.monotonic(), sent))
+
+    async def close(self):
+        self.closed = True
+        idle, self._idle = self._idle, []
+        for connection, _, _ in idle:
+            await _quit(connection)
+
+
+async def _quit(connection: aiosmtplib.SMTP):
+    if not connection.is_connected:
+        return
+    try:
+        await asyncio.wait_for(connection.quit(), timeout=5)
+    except Exception:
+        connection.close()
+
+
+async def send_message(message: Message, config: dict):
+    """
+    Send a MIME message with the given SMTP config over a pooled connection.
+    Raises the aiosmtplib error on failure.
+    """
+    global _pool
+    if _pool is None or _pool.key != _pool_key(config):
+        old, _pool = _pool, SMTPPool(config)
+        if old is not None:
+            await old.close()
+    try:
+        await _pool.send(message)
+    except Exception:
+        _stats["failed"] += 1
+        raise
+    _stats["sent"] += 1
+
+
+async def close():
+    """Close the pooled connections (on shutdown)"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "idle_connections": len(_pool._idle) if _pool is not None else 0,
+        "pool_size": POOL_SIZE,
+    }
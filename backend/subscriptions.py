@@ -6,11 +6,12 @@ from fastapi import APIRouter, HTTPException, Request, Depends
 from datetime import datetime, timezone, timedelta
 import uuid
 import os
-import stripe
 from motor.motor_asyncio import AsyncIOMotorClient
 
-# Stripe configuration
-stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+from payment_gateway import get_payment_gateway, PaymentGatewayError
+import rollups
+import settings_service
+import provider_page
 
 router = APIRouter(prefix="/api/subscriptions", tags=["subscriptions"])
 
@@ -95,16 +96,8 @@ def get_db():
 @router.get("/plans")
 async def get_subscription_plans():
     """Get all available subscription plans from database or defaults"""
-    db = get_db()
-    
-    # Try to get plans from database
-    plans_doc = await db.site_settings.find_one({"key": "subscription_plans"}, {"_id": 0})
-    
-    if plans_doc and plans_doc.get("value"):
-        plans = plans_doc["value"]
-    else:
-        # Use default plans
-        plans = list(SUBSCRIPTION_PLANS.values())
+    # Plans edited by the admins, else the defaults
+    plans = await settings_service.subscription_plans() or list(SUBSCRIPTION_PLANS.values())
     
     return {
         "plans": plans,
@@ -114,13 +107,8 @@ async def get_subscription_plans():
 
 async def get_plan_by_id(plan_id: str):
     """Helper function to get a plan by ID from database or defaults"""
-    db = get_db()
-    
-    # Try to get plans from database
-    plans_doc = await db.site_settings.find_one({"key": "subscription_plans"}, {"_id": 0})
-    
-    if plans_doc and plans_doc.get("value"):
-        plans = plans_doc["value"]
+    plans = await settings_service.subscription_plans()
+    if plans:
         for plan in plans:
             if plan.get("plan_id") == plan_id:
                 return plan
@@ -160,6 +148,7 @@ async def admin_update_plans(request: Request):
         {"$set": {"key": "subscription_plans", "value": plans}},
         upsert=True
     )
+    await settings_service.notify_changed()
     
     return {"message": "Plans mis à jour avec succès"}
 
@@ -245,11 +234,9 @@ async def create_subscription_checkout(request: Request):
     
     try:
         # Create Stripe checkout session for subscription
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="subscription",
+        checkout_session = await get_payment_gateway(str(request.base_url)).create_subscription_session(
             customer_email=current_user.email,
-            line_items=[{
+            line_item={
                 "price_data": {
                     "currency": "eur",
                     "product_data": {
@@ -262,7 +249,7 @@ async def create_subscription_checkout(request: Request):
                     }
                 },
                 "quantity": 1
-            }],
+            },
             success_url=f"{origin_url}/dashboard?subscription=success&session_id={{CHECKOUT_SESSION_ID}}",
             cancel_url=f"{origin_url}/dashboard?subscription=cancelled",
             metadata={
@@ -275,10 +262,10 @@ async def create_subscription_checkout(request: Request):
         
         return {
             "checkout_url": checkout_session.url,
-            "session_id": checkout_session.id
+            "session_id": checkout_session.session_id
         }
         
-    except stripe.error.StripeError as e:
+    except PaymentGatewayError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -298,7 +285,7 @@ async def activate_subscription(request: Request):
     
     try:
         # Retrieve Stripe session
-        session = stripe.checkout.Session.retrieve(session_id)
+        session = await get_payment_gateway(str(request.base_url)).retrieve_checkout_session(session_id)
         
         if session.payment_status != "paid":
             raise HTTPException(status_code=400, detail="Paiement non complété")
@@ -316,10 +303,17 @@ async def activate_subscription(request: Request):
             period_end = now + timedelta(days=30)
         
         # Cancel any existing subscription
-        await db.subscriptions.update_many(
+        previous = await db.subscriptions.find(
             {"provider_id": provider_id, "status": "active"},
-            {"$set": {"status": "cancelled", "updated_at": now.isoformat()}}
-        )
+            {"_id": 0, "subscription_id": 1, "plan_id": 1}
+        ).to_list(None)
+        for sub in previous:
+            result = await db.subscriptions.update_one(
+                {"subscription_id": sub["subscription_id"], "status": "active"},
+                {"$set": {"status": "cancelled", "updated_at": now.isoformat()}}
+            )
+            if result.modified_count:
+                await rollups.record_subscription_change(ended_plan=sub.get("plan_id"), when=now)
         
         # Create new subscription
         subscription_id = f"sub_{uuid.uuid4().hex[:12]}"
@@ -340,6 +334,7 @@ async def activate_subscription(request: Request):
         }
         
         await db.subscriptions.insert_one(subscription_doc)
+        await rollups.record_subscription_change(started_plan=plan_id, when=now)
         
         # Update provider profile with subscription info
         await db.provider_profiles.update_one(
@@ -349,6 +344,7 @@ async def activate_subscription(request: Request):
                 "subscription_status": "active"
             }}
         )
+        await provider_page.invalidate(provider_id)
         
         return {
             "success": True,
@@ -356,7 +352,7 @@ async def activate_subscription(request: Request):
             "plan": SUBSCRIPTION_PLANS[plan_id]
         }
         
-    except stripe.error.StripeError as e:
+    except PaymentGatewayError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -389,11 +385,10 @@ async def cancel_subscription(request: Request):
     # Cancel in Stripe if applicable
     if subscription.get("external_subscription_id") and subscription.get("payment_provider") == "stripe":
         try:
-            stripe.Subscription.modify(
-                subscription["external_subscription_id"],
-                cancel_at_period_end=True
+            await get_payment_gateway(str(request.base_url)).cancel_subscription_at_period_end(
+                subscription["external_subscription_id"]
             )
-        except stripe.error.StripeError:
+        except PaymentGatewayError:
             pass  # Continue even if Stripe fails
     
     # Update subscription
@@ -0,0 +1,46 @@
+"""
+Shared fixtures for the in-process tests
+The backend modules are imported directly and server.db is swapped for an
+in-memory mongomock database, so these tests need no running server
+"""
+import os
+import sys
+
+import mongomock.collection
+import pytest
+from pymongo import ReturnDocument
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+# mongomock's find_one_and_* modify the first match of the query, not the
+# sorted one, when the projection drops _id, and skip a match whose
+# projection is empty: resolve the _id first, project the result here
+_find_and_modify = mongomock.collection.Collection._find_and_modify
+
+
+def _find_and_modify_sorted(self, query, projection=None, update=None, upsert=False, sort=None, *args, **kwargs):
+    found = self.find_one(query, projection={"_id": 1}, sort=sort)
+    if not found:
+        return _find_and_modify(self, query, projection, update, upsert, sort, *args, **kwargs)
+    query = {"_id": found["_id"]}
+    before = self.find_one(query, projection)
+    _find_and_modify(self, query, {"_id": 1}, update, upsert, sort, *args, **kwargs)
+    return_document = args[0] if args else kwargs.get("return_document", ReturnDocument.BEFORE)
+    if kwargs.get("remove") or not (return_document is ReturnDocument.AFTER or kwargs.get("new")):
+        return before
+    return self.find_one(query, projection)
+
+
+mongomock.collection.Collection._find_and_modify = _find_and_modify_sorted
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Empty in-memory database behind every module's get_db()"""
+    from mongomock_motor import AsyncMongoMockClient
+    import server
+    database = AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,62 @@
+"""
+Analytics Tests
+Series built from the day buckets are gap-filled and bucketed per granularity
+"""
+import asyncio
+
+import analytics
+import rollups
+
+DAY1 = "2026-03-30T10:00:00+00:00"
+
+
+class TestBuildSeries:
+    """Missing days are zeros; weeks start on Monday and months on the 1st"""
+
+    BUCKETS = [
+        {"date": "2026-03-30", "new_users": 2, "new_users_by_type": {"client": 2},
+         "bookings_by_status": {"confirmed": 1}, "gmv_by_status": {"confirmed": 100.5, "cancelled": 40.0},
+         "revenue": 30.25},
+        {"date": "2026-04-06", "new_users": 1, "new_users_by_type": {"provider": 1}, "revenue": 10.0},
+    ]
+
+    def test_days_are_gap_filled(self):
+        series = analytics.build_series(self.BUCKETS, "2026-03-29", "2026-04-07", "day")
+        assert len(series["periods"]) == 10
+        assert series["signups"]["total"] == [0, 2, 0, 0, 0, 0, 0, 0, 1, 0]
+        assert series["signups"]["provider"] == [0, 0, 0, 0, 0, 0, 0, 0, 1, 0]
+        assert series["gmv"][1] == 100.5  # cancelled bookings are not GMV
+        assert series["bookings"]["total"] == [0] * 10
+
+    def test_weeks_start_on_monday(self):
+        series = analytics.build_series(self.BUCKETS, "2026-03-29", "2026-04-07", "week")
+        assert series["periods"] == ["2026-03-23", "2026-03-30", "2026-04-06"]
+        assert series["signups"]["total"] == [0, 2, 1]
+        assert series["revenue"] == [0.0, 30.25, 10.0]
+
+    def test_months(self):
+        series = analytics.build_series(self.BUCKETS, "2026-03-01", "2026-04-30", "month")
+        assert series["periods"] == ["2026-03-01", "2026-04-01"]
+        assert series["signups"]["total"] == [2, 1]
+        assert series["bookings"]["by_status"] == {"confirmed": [1, 0]}
+
+    def test_empty_range(self):
+        series = analytics.build_series([], "2026-04-01", "2026-04-03", "day")
+        assert series["periods"] == ["2026-04-01", "2026-04-02", "2026-04-03"]
+        assert series["revenue"] == [0, 0, 0]
+        assert series["gmv"] == [0.0, 0.0, 0.0]
+
+    def test_cached_per_range(self, db, monkeypatch):
+        monkeypatch.setattr(analytics, "_cache", {})
+
+        async def scenario():
+            await rollups.record_payment(20.0, DAY1)
+            first = await analytics.get_analytics("2026-03-30", "2026-03-31")
+            await rollups.record_payment(5.0, DAY1)
+            cached = await analytics.get_analytics("2026-03-30", "2026-03-31")
+            analytics.clear_cache()
+            return first, cached, await analytics.get_analytics("2026-03-30", "2026-03-31")
+
+        first, cached, fresh = asyncio.run(scenario())
+        assert cached is first
+        assert fresh["revenue"] == [25.0, 0]
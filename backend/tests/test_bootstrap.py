@@ -0,0 +1,117 @@
+"""
+Bootstrap Tests
+The landing payload is served from memory with an ETag, answered with 304
+when current, and rebuilt in the background when a source changes
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import admin
+import bootstrap
+
+
+@pytest.fixture
+def landing(db, monkeypatch):
+    """Bootstrap app whose payload lists the published events"""
+    monkeypatch.setattr(bootstrap, "_payload", {"body": None, "etag": None, "built_at": None})
+    monkeypatch.setattr(bootstrap, "_stats", dict.fromkeys(bootstrap._stats, 0))
+    monkeypatch.setattr(bootstrap, "_stale", asyncio.Event())
+    monkeypatch.setattr(bootstrap, "_worker_task", None)
+    monkeypatch.setattr(bootstrap, "DEBOUNCE", 0)
+
+    async def collect():
+        events = await db.community_events.find({"status": "published"}, {"_id": 0}).to_list(None)
+        return {"site_content": {"title": "Bienvenue"}, "events": events}
+    monkeypatch.setattr(bootstrap, "_collect", collect)
+
+    app = FastAPI()
+    app.include_router(bootstrap.router)
+    app.include_router(admin.router)
+    app.dependency_overrides[admin.get_admin_user] = lambda: {"admin_id": "admin_1"}
+    asyncio.run(db.community_events.insert_one({"event_id": "evt_1", "status": "published"}))
+    return app
+
+
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def _rebuilt(builds: int):
+    """Wait for the worker to finish a build past `builds`"""
+    for _ in range(200):
+        if bootstrap._stats["builds"] > builds:
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+class TestConditionalRequests:
+    """Clients holding the current ETag get an empty 304"""
+
+    def test_not_modified(self, landing):
+        async def scenario():
+            async with _client(landing) as client:
+                first = await client.get("/api/bootstrap")
+                again = await client.get("/api/bootstrap", headers={"If-None-Match": first.headers["etag"]})
+                other = await client.get("/api/bootstrap", headers={"If-None-Match": '"outdated"'})
+                return first, again, other
+
+        first, again, other = asyncio.run(scenario())
+        assert first.status_code == 200
+        assert first.json()["events"] == [{"event_id": "evt_1", "status": "published"}]
+        assert first.headers["cache-control"] == bootstrap.CACHE_CONTROL
+        assert (again.status_code, again.content) == (304, b"")
+        assert again.headers["etag"] == first.headers["etag"]
+        assert other.status_code == 200
+        assert bootstrap._stats["not_modified"] == 1
+        assert bootstrap._stats["builds"] == 1
+
+
+class TestRebuild:
+    """mark_stale rebuilds the payload; a rebuild with the same content keeps the ETag"""
+
+    def test_rebuilt_after_mark_stale(self, db, landing):
+        async def scenario():
+            async with _client(landing) as client:
+                first = await client.get("/api/bootstrap")
+                bootstrap.start_worker()
+                try:
+                    assert await _rebuilt(1)  # the start build
+                    await db.community_events.insert_one({"event_id": "evt_2", "status": "published"})
+                    bootstrap.mark_stale()
+                    assert await _rebuilt(2)
+                finally:
+                    await bootstrap.stop_worker()
+                return first, await client.get("/api/bootstrap", headers={"If-None-Match": first.headers["etag"]})
+
+        first, after = asyncio.run(scenario())
+        assert after.status_code == 200
+        assert after.headers["etag"] != first.headers["etag"]
+        assert [e["event_id"] for e in after.json()["events"]] == ["evt_1", "evt_2"]
+
+    def test_unchanged_builds(self, landing):
+        async def scenario():
+            return await bootstrap.build(), await bootstrap.build()
+
+        assert asyncio.run(scenario()) == (True, False)
+        assert bootstrap._stats["builds"] == 2
+        assert bootstrap._stats["unchanged_builds"] == 1
+
+    @pytest.mark.parametrize("method,path,body", [
+        ("DELETE", "/api/admin/community-events/evt_1", None),
+        ("PATCH", "/api/admin/community-events/evt_1/status", {"status": "hidden"}),
+    ])
+    def test_admin_moderation_marks_stale(self, landing, method, path, body):
+        async def scenario():
+            await bootstrap.build()
+            async with _client(landing) as client:
+                response = await client.request(method, path, json=body)
+            return response, bootstrap._stale.is_set(), await bootstrap.build()
+
+        response, stale, changed = asyncio.run(scenario())
+        assert response.status_code == 200
+        assert stale
+        assert changed
@@ -0,0 +1,113 @@
+"""
+Email Campaign Tests
+Campaign emails are paced within the outbox domain limit and their
+preparation survives a restart
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import campaigns
+import email_outbox
+
+
+@pytest.fixture
+def providers(db, monkeypatch):
+    """Providers to remind; the segment is simplified (mongomock lacks $trim)"""
+    monkeypatch.setattr(campaigns, "segment_pipeline", lambda missing: [
+        {"$match": {"user_type": "provider"}},
+        {"$project": {"_id": 0, "user_id": 1, "email": 1, "name": 1}},
+    ])
+
+    async def insert(count, domain="gmail.com"):
+        await db.users.insert_many([
+            {"user_id": f"user_{domain}_{i}", "email": f"pro{i}@{domain}", "name": f"Pro {i}", "user_type": "provider"}
+            for i in range(count)
+        ])
+    return insert
+
+
+def _campaign(rate=300):
+    return {
+        "campaign_id": "campaign_test",
+        "subject": "Complétez votre profil",
+        "message": "Votre fiche est incomplète",
+        "segment": {"missing": list(campaigns.CRITERIA)},
+        "rate_per_minute": rate,
+        "status": "preparing",
+        "total": 0,
+    }
+
+
+async def _send_times(db, domain):
+    emails = await db.email_outbox.find({"domain": domain}, {"_id": 0, "next_attempt_at": 1}).to_list(None)
+    return sorted(datetime.fromisoformat(e["next_attempt_at"]) for e in emails)
+
+
+class TestPacing:
+    """Emails to one domain are spaced by the outbox domain rate"""
+
+    def test_one_domain_is_paced_within_domain_rate(self, db, providers):
+        async def scenario():
+            await providers(20)
+            await db.email_campaigns.insert_one(_campaign(rate=300))
+            await campaigns._prepare(_campaign(rate=300))
+            return await _send_times(db, "gmail.com")
+
+        times = asyncio.run(scenario())
+        spacing = timedelta(seconds=60 / email_outbox.DOMAIN_RATE)
+        assert len(times) == 20
+        assert all(b - a >= spacing for a, b in zip(times, times[1:]))
+
+    def test_other_domains_keep_campaign_pace(self, db, providers):
+        async def scenario():
+            await providers(10)
+            await providers(10, domain="orange.fr")
+            await db.email_campaigns.insert_one(_campaign(rate=300))
+            await campaigns._prepare(_campaign(rate=300))
+            return await _send_times(db, "gmail.com"), await _send_times(db, "orange.fr")
+
+        gmail, orange = asyncio.run(scenario())
+        # Ten gmail emails take 9 domain intervals, not 9 campaign intervals
+        assert gmail[-1] - gmail[0] >= timedelta(seconds=9 * 60 / email_outbox.DOMAIN_RATE)
+        assert orange[-1] - gmail[0] < timedelta(seconds=20 * 60 / email_outbox.DOMAIN_RATE)
+
+
+class TestResume:
+    """A preparation cut short is taken over once its lease runs out"""
+
+    def test_interrupted_preparation_is_resumed(self, db, providers, monkeypatch):
+        monkeypatch.setattr(campaigns, "BATCH_SIZE", 4)
+        render = campaigns.email_templates.render
+        rendered = []
+
+        def crash_after_six(*args, **kwargs):
+            rendered.append(1)
+            if len(rendered) == 7:
+                raise asyncio.CancelledError()  # the process went away
+            return render(*args, **kwargs)
+
+        async def scenario():
+            await providers(10)
+            await db.email_campaigns.insert_one({**_campaign(), "lease_until": campaigns._lease()})
+            monkeypatch.setattr(campaigns.email_templates, "render", crash_after_six)
+            with pytest.raises(asyncio.CancelledError):
+                await campaigns._prepare(_campaign())
+            interrupted = await db.email_campaigns.find_one({"campaign_id": "campaign_test"})
+
+            # Nothing to take over while the lease holds
+            assert await campaigns.resume_stalled() == 0
+            expired = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+            await db.email_campaigns.update_one({"campaign_id": "campaign_test"}, {"$set": {"lease_until": expired}})
+            assert await campaigns.resume_stalled() == 1
+            await asyncio.gather(*campaigns._tasks)
+
+            emails = await db.email_outbox.find({"campaign_id": "campaign_test"}, {"_id": 0}).to_list(None)
+            return interrupted, emails, await db.email_campaigns.find_one({"campaign_id": "campaign_test"})
+
+        interrupted, emails, campaign = asyncio.run(scenario())
+        assert interrupted["status"] == "preparing"
+        assert len(emails) == 10
+        assert len({e["user_id"] for e in emails}) == 10
+        assert campaign["status"] == "sending" and campaign["total"] == 10
@@ -0,0 +1,171 @@
+"""
+Conversation Summary Tests
+Unread counters and read watermarks kept on the conversation documents
+"""
+import asyncio
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import admin
+import conversations
+
+CLIENT = "user_client"
+PROVIDER = "user_provider"
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _message(sender, receiver, minutes):
+    return {
+        "message_id": f"msg_{uuid.uuid4().hex[:12]}",
+        "sender_id": sender,
+        "receiver_id": receiver,
+        "content": "Bonjour",
+        "read": False,
+        "created_at": (T0 + timedelta(minutes=minutes)).isoformat(),
+    }
+
+
+async def _unread(db, user_id):
+    conversation = await db.conversations.find_one(
+        {"conversation_id": conversations.conversation_id_for(CLIENT, PROVIDER)}
+    )
+    return conversation.get("unread", {}).get(user_id, 0)
+
+
+class _Interleaved:
+    """Database proxy running `hook` right after the first conversations.find_one"""
+
+    def __init__(self, db, hook):
+        self._db = db
+        self._hook = hook
+
+    def __getattr__(self, name):
+        collection = getattr(self._db, name)
+        if name != "conversations":
+            return collection
+        proxy = self
+
+        class Collection:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def find_one(self, *args, **kwargs):
+                doc = await collection.find_one(*args, **kwargs)
+                if proxy._hook:
+                    hook, proxy._hook = proxy._hook, None
+                    await hook()
+                return doc
+
+        return Collection()
+
+
+class TestReadWatermarks:
+    """mark_read keeps the unread counter consistent with the watermark"""
+
+    def test_mark_read_resets_counter(self, db):
+        async def scenario():
+            for minutes in (1, 2):
+                await conversations.insert_message(_message(PROVIDER, CLIENT, minutes))
+            assert await _unread(db, CLIENT) == 2
+            watermark = await conversations.mark_read(CLIENT, PROVIDER)
+            messages = await db.messages.find({}, {"_id": 0}).to_list(None)
+            await conversations.apply_read_state(messages)
+            return watermark, messages
+
+        watermark, messages = asyncio.run(scenario())
+        assert watermark == (T0 + timedelta(minutes=2)).isoformat()
+        assert all(m["read"] for m in messages)
+        assert asyncio.run(_unread(db, CLIENT)) == 0
+
+    def test_message_arriving_during_mark_read_is_not_lost(self, db, monkeypatch):
+        async def scenario():
+            await conversations.insert_message(_message(PROVIDER, CLIENT, 1))
+
+            async def new_message():
+                await conversations.insert_message(_message(PROVIDER, CLIENT, 2))
+            monkeypatch.setattr(conversations, "get_db", lambda: _Interleaved(db, new_message))
+
+            watermark = await conversations.mark_read(CLIENT, PROVIDER)
+            messages = await db.messages.find({}, {"_id": 0}).to_list(None)
+            return watermark, messages, await _unread(db, CLIENT)
+
+        watermark, messages, unread = asyncio.run(scenario())
+        assert len(messages) == 2
+        assert unread == sum(1 for m in messages if m["created_at"] > watermark)
+
+    def test_unread_messages_before_watermark_are_read(self):
+        message = _message(PROVIDER, CLIENT, 1)
+        assert conversations.is_read(message, {CLIENT: message["created_at"]})
+        assert not conversations.is_read(message, {PROVIDER: message["created_at"]})
+        assert not conversations.is_read(message, {})
+
+
+class TestAdminDeleteUser:
+    """Deleting an account drops its conversations for the other party too"""
+
+    def test_conversations_are_deleted(self, db):
+        async def scenario():
+            await db.users.insert_one({"user_id": CLIENT, "email": "client@test.com"})
+            await conversations.insert_message(_message(CLIENT, PROVIDER, 1))
+            await admin.delete_user(CLIENT, admin={"user_id": "admin"})
+            return await db.conversations.count_documents({"participants": PROVIDER})
+
+        assert asyncio.run(scenario()) == 0
+
+
+class TestHistoryPaging:
+    """Cursor pages cover a thread exactly once, even with equal timestamps"""
+
+    def test_pages_cover_thread_without_gaps(self, db):
+        async def scenario():
+            # Two messages per minute: the cursor must break ties on message_id
+            for minutes in (1, 1, 2, 2, 3, 3, 4):
+                await conversations.insert_message(_message(PROVIDER, CLIENT, minutes))
+            pages, cursor = [], None
+            while True:
+                page, cursor = await conversations.get_history(CLIENT, PROVIDER, limit=3, before=cursor)
+                pages.append(page)
+                if not cursor:
+                    return pages, await db.messages.find({}, {"_id": 0}).to_list(None)
+
+        pages, stored = asyncio.run(scenario())
+        assert [len(page) for page in pages] == [3, 3, 1]
+        seen = [m["message_id"] for page in reversed(pages) for m in page]
+        assert len(set(seen)) == len(stored) == 7
+        order = [(m["created_at"], m["message_id"]) for page in reversed(pages) for m in page]
+        assert order == sorted(order)
+
+    def test_changes_since_cursor(self, db):
+        async def scenario():
+            await conversations.insert_message(_message(PROVIDER, CLIENT, 1))
+            start = await conversations.get_changes(CLIENT)
+            await conversations.insert_message(_message(CLIENT, PROVIDER, 2))
+            await conversations.insert_message(_message(PROVIDER, CLIENT, 3))
+            return start, await conversations.get_changes(CLIENT, since=start["cursor"])
+
+        start, changes = asyncio.run(scenario())
+        assert start["messages"] == []
+        assert [m["created_at"] for m in changes["messages"]] == [
+            (T0 + timedelta(minutes=2)).isoformat(), (T0 + timedelta(minutes=3)).isoformat()
+        ]
+        assert changes["has_more"] is False
+
+    def test_changes_for_user_without_messages(self, db):
+        """A first sync with no messages still gives a cursor, so nothing sent next is skipped"""
+        async def scenario():
+            start = await conversations.get_changes(CLIENT)
+            message = _message(PROVIDER, CLIENT, 0)
+            message["created_at"] = conversations.decode_cursor(start["cursor"])[0]  # same instant
+            await conversations.insert_message(message)
+            return start, await conversations.get_changes(CLIENT, since=start["cursor"])
+
+        start, changes = asyncio.run(scenario())
+        assert start["cursor"]
+        assert len(changes["messages"]) == 1
+        assert changes["cursor"] != start["cursor"]
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError):
+            conversations.decode_cursor("not-a-cursor")
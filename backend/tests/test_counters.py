@@ -0,0 +1,133 @@
+"""
+View Counter Tests
+Buffered view counts are written in bulk, kept on failure and flushed on
+shutdown
+"""
+import asyncio
+
+import pytest
+
+import counters
+import rollups
+
+
+@pytest.fixture
+def portfolio(db, monkeypatch):
+    """Fresh portfolio buffer and two portfolio items"""
+    buffer = counters.CounterBuffer("portfolio_item", "portfolio_items", "item_id")
+    monkeypatch.setattr(counters, "portfolio_views", buffer)
+    monkeypatch.setattr(counters, "BUFFERS", [buffer])
+    asyncio.run(db.portfolio_items.insert_many([
+        {"item_id": "item_1", "views_count": 0},
+        {"item_id": "item_2", "views_count": 3},
+    ]))
+    return buffer
+
+
+class _FailingWrites:
+    """Database proxy whose bulk writes on one collection fail (or hang)"""
+
+    def __init__(self, db, collection, error):
+        self._db = db
+        self._collection = collection
+        self._error = error
+
+    def __getattr__(self, name):
+        collection = self._db[name]
+        return self._wrap(collection) if name == self._collection else collection
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+    def _wrap(self, collection):
+        error = self._error
+
+        class Collection:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def bulk_write(self, *args, **kwargs):
+                raise error
+
+        return Collection()
+
+
+async def _views(db):
+    return {d["item_id"]: d["views_count"] async for d in db.portfolio_items.find({}, {"_id": 0})}
+
+
+class TestFlush:
+    """Views are summed per item and written in one bulk write"""
+
+    def test_flush_writes_sums_and_daily_buckets(self, db, portfolio):
+        async def scenario():
+            for _ in range(5):
+                portfolio.add("item_1")
+            portfolio.add("item_2", 2)
+            portfolio.add("unknown_item")
+            assert await portfolio.flush() == 2
+            buckets = await db.daily_views.find({}, {"_id": 0}).sort("item_id", 1).to_list(None)
+            return await _views(db), buckets
+
+        views, buckets = asyncio.run(scenario())
+        today = rollups.day_key()
+        assert views == {"item_1": 5, "item_2": 5}
+        assert buckets == [
+            {"kind": "portfolio_item", "item_id": "item_1", "date": today, "count": 5},
+            {"kind": "portfolio_item", "item_id": "item_2", "date": today, "count": 2},
+        ]
+        assert portfolio.stats["unknown"] == 1
+        assert portfolio.stats["writes"] == 1
+
+    def test_failed_write_is_kept_for_next_flush(self, db, portfolio, monkeypatch):
+        async def scenario():
+            portfolio.add("item_1", 4)
+            monkeypatch.setattr(counters, "get_db", lambda: _FailingWrites(db, "portfolio_items", ConnectionError()))
+            assert await portfolio.flush() == 0
+            assert (await _views(db))["item_1"] == 0
+            monkeypatch.setattr(counters, "get_db", lambda: db)
+            await portfolio.flush()
+            return await _views(db), await db.daily_views.find_one({"item_id": "item_1"})
+
+        views, bucket = asyncio.run(scenario())
+        assert views["item_1"] == 4
+        assert bucket["count"] == 4
+        assert portfolio.stats["requeued"] == 4
+
+    def test_failed_bucket_write_does_not_recount_views(self, db, portfolio, monkeypatch):
+        async def scenario():
+            portfolio.add("item_1", 2)
+            monkeypatch.setattr(counters, "get_db", lambda: _FailingWrites(db, "daily_views", ConnectionError()))
+            await portfolio.flush()
+            monkeypatch.setattr(counters, "get_db", lambda: db)
+            await portfolio.flush()
+            return await _views(db), await db.daily_views.find_one({"item_id": "item_1"})
+
+        views, bucket = asyncio.run(scenario())
+        assert views["item_1"] == 2
+        assert bucket["count"] == 2
+
+    def test_cancelled_flush_keeps_counts(self, db, portfolio, monkeypatch):
+        async def scenario():
+            portfolio.add("item_1", 3)
+            monkeypatch.setattr(counters, "get_db", lambda: _FailingWrites(db, "portfolio_items", asyncio.CancelledError()))
+            with pytest.raises(asyncio.CancelledError):
+                await portfolio.flush()
+            monkeypatch.setattr(counters, "get_db", lambda: db)
+            await portfolio.flush()
+            return await _views(db)
+
+        assert asyncio.run(scenario())["item_1"] == 3
+
+
+class TestWorker:
+    """Shutdown writes what is still buffered"""
+
+    def test_stop_worker_flushes(self, db, portfolio):
+        async def scenario():
+            counters.start_worker()
+            portfolio.add("item_2")
+            await counters.stop_worker()
+            return await _views(db)
+
+        assert asyncio.run(scenario())["item_2"] == 4
@@ -0,0 +1,117 @@
+"""
+Email Outbox Tests
+Claiming, per-domain rate limits, backoff and dead-lettering of queued emails
+"""
+import asyncio
+
+import pytest
+
+import email_outbox
+import email_service
+
+
+@pytest.fixture
+def outbox(db, monkeypatch):
+    """Emails handed to SMTP, instead of sending them"""
+    delivered = []
+
+    async def deliver(to_email, subject, html_content, text_content=None):
+        delivered.append({"to": to_email, "subject": subject})
+
+    monkeypatch.setattr(email_service, "deliver_email", deliver)
+    monkeypatch.setattr(email_outbox, "_buckets", {})
+    monkeypatch.setattr(email_outbox, "_throttled", {})
+    monkeypatch.setattr(email_outbox, "_stats", {k: 0 for k in email_outbox._stats})
+    return delivered
+
+
+def _bulk(count, domain="gmail.com"):
+    return [
+        email_outbox.build_email(f"pro{i}@{domain}", "Complétez votre profil", "<p>Bonjour</p>",
+                                 category="campaign", priority=email_outbox.PRIORITY_BULK)
+        for i in range(count)
+    ]
+
+
+async def _statuses(db):
+    return {
+        row["_id"]: row["count"]
+        async for row in db.email_outbox.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+    }
+
+
+class TestRateLimit:
+    """A throttled domain is not claimed again until it has tokens"""
+
+    def test_backlog_for_one_domain_is_not_churned(self, db, outbox):
+        async def scenario():
+            await email_outbox.enqueue_many(_bulk(50))
+            await email_outbox.process_outbox()
+            return await _statuses(db)
+
+        statuses = asyncio.run(scenario())
+        assert len(outbox) == email_outbox.DOMAIN_BURST
+        assert statuses == {"sent": email_outbox.DOMAIN_BURST, "pending": 50 - email_outbox.DOMAIN_BURST}
+        # Only the email that found the bucket empty was claimed and put back
+        assert email_outbox._stats["throttled"] <= email_outbox.CONCURRENCY
+
+    def test_other_domains_are_not_held_up(self, db, outbox):
+        async def scenario():
+            await email_outbox.enqueue_many(_bulk(30) + _bulk(3, domain="orange.fr"))
+            await email_outbox.process_outbox()
+
+        asyncio.run(scenario())
+        assert sum(1 for e in outbox if e["to"].endswith("@orange.fr")) == 3
+
+    def test_transactional_mail_has_its_own_bucket(self, db, outbox):
+        async def scenario():
+            await email_outbox.enqueue_many(_bulk(30))
+            await email_outbox.process_outbox()
+            await email_outbox.enqueue("client@gmail.com", "Bienvenue", "<p>Bienvenue</p>", category="welcome")
+            await email_outbox.process_outbox()
+
+        asyncio.run(scenario())
+        assert outbox[-1] == {"to": "client@gmail.com", "subject": "Bienvenue"}
+
+
+class TestRetries:
+    """Failed sends back off, then go to the dead letters"""
+
+    def test_failure_backs_off_then_dead_letters(self, db, outbox, monkeypatch):
+        async def failing(*args):
+            raise ConnectionError("SMTP down")
+        monkeypatch.setattr(email_service, "deliver_email", failing)
+
+        async def scenario():
+            email_id = await email_outbox.enqueue("client@test.com", "Bienvenue", "<p>Bienvenue</p>")
+            await email_outbox.process_outbox()
+            first = await db.email_outbox.find_one({"email_id": email_id})
+            for _ in range(email_outbox.MAX_ATTEMPTS - 1):
+                await db.email_outbox.update_one({"email_id": email_id}, {"$set": {"next_attempt_at": ""}})
+                await email_outbox.process_outbox()
+            return first, await db.email_outbox.find_one({"email_id": email_id}), email_id
+
+        first, last, email_id = asyncio.run(scenario())
+        assert first["status"] == "failed" and first["attempts"] == 1
+        assert first["next_attempt_at"] > first["created_at"]
+        assert last["status"] == "dead" and last["attempts"] == email_outbox.MAX_ATTEMPTS
+        assert asyncio.run(email_outbox.retry(email_id))
+
+    def test_unconfigured_smtp_is_not_retried(self, db, outbox, monkeypatch):
+        async def unconfigured(*args):
+            raise email_service.EmailNotConfigured("Email not sent (no SMTP password)")
+        monkeypatch.setattr(email_service, "deliver_email", unconfigured)
+
+        async def scenario():
+            email_id = await email_outbox.enqueue("client@test.com", "Bienvenue", "<p>Bienvenue</p>")
+            await email_outbox.process_outbox()
+            await email_outbox.process_outbox()
+            return await db.email_outbox.find_one({"email_id": email_id}, {"_id": 0})
+
+        email = asyncio.run(scenario())
+        assert email["status"] == "cancelled"
+        assert email["attempts"] == 0
+        assert "no SMTP password" in email["last_error"]
+        assert "html" not in email
+        assert email_outbox._stats["not_configured"] == 1
+        assert email_outbox._stats["failed"] == email_outbox._stats["dead"] == 0
@@ -0,0 +1,196 @@
+"""
+HTTP Cache Tests
+ETags and 304s, single-flight misses and invalidation across workers for
+the public GET response cache
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import admin
+import http_cache
+import provider_page
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    """Fresh cache state and an app whose endpoints count their calls"""
+    for name, value in {"_entries": {}, "_inflight": {}, "_versions": {}, "_state": {"seen": 0},
+                        "_listeners": [], "_stats": {k: 0 for k in http_cache._stats}}.items():
+        monkeypatch.setattr(http_cache, name, value)
+
+    app = FastAPI()
+    calls = {"packs": 0, "provider": 0, "page": 0}
+
+    @app.get("/api/packs")
+    async def packs():
+        calls["packs"] += 1
+        await asyncio.sleep(0.01)
+        return [{"pack_id": "pack_1", "version": calls["packs"]}]
+
+    @app.get("/api/providers/{provider_id}")
+    async def provider(provider_id: str):
+        calls["provider"] += 1
+        return {"provider_id": provider_id, "version": calls["provider"]}
+
+    @app.get("/api/providers/{provider_id}/page")
+    async def page(provider_id: str):
+        calls["page"] += 1
+        return {"provider_id": provider_id, "version": calls["page"]}
+
+    app.add_middleware(http_cache.HTTPCacheMiddleware)
+    return app, calls
+
+
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def _as_other_worker(coro):
+    """Publish an invalidation without touching this worker's memory"""
+    entries, versions = dict(http_cache._entries), dict(http_cache._versions)
+    await coro
+    http_cache._entries.clear()
+    http_cache._entries.update(entries)
+    http_cache._versions.clear()
+    http_cache._versions.update(versions)
+
+
+class TestConditionalRequests:
+    """Cached responses carry an ETag and answer If-None-Match with 304"""
+
+    def test_etag_and_304(self, cache):
+        app, calls = cache
+
+        async def scenario():
+            async with _client(app) as client:
+                first = await client.get("/api/packs")
+                second = await client.get("/api/packs")
+                revalidated = await client.get("/api/packs", headers={"If-None-Match": first.headers["etag"]})
+                return first, second, revalidated
+
+        first, second, revalidated = asyncio.run(scenario())
+        assert first.headers["x-cache"] == "MISS"
+        assert second.headers["x-cache"] == "HIT"
+        assert second.headers["etag"] == first.headers["etag"]
+        assert "max-age=30" in first.headers["cache-control"]
+        assert revalidated.status_code == 304 and revalidated.content == b""
+        assert calls["packs"] == 1
+
+    def test_concurrent_misses_run_endpoint_once(self, cache):
+        app, calls = cache
+
+        async def scenario():
+            async with _client(app) as client:
+                return await asyncio.gather(*(client.get("/api/packs") for _ in range(10)))
+
+        responses = asyncio.run(scenario())
+        assert all(r.status_code == 200 for r in responses)
+        assert len({r.headers["etag"] for r in responses}) == 1
+        assert calls["packs"] == 1
+
+
+class TestInvalidation:
+    """Writes made in one worker show up in the others at their next poll"""
+
+    def test_local_invalidation(self, cache):
+        app, calls = cache
+
+        async def scenario():
+            async with _client(app) as client:
+                await client.get("/api/providers/prov_1")
+                await provider_page.invalidate("prov_1")
+                return await client.get("/api/providers/prov_1")
+
+        response = asyncio.run(scenario())
+        assert response.headers["x-cache"] == "MISS"
+        assert response.json()["version"] == 2
+
+    def test_invalidation_from_another_worker(self, cache):
+        app, calls = cache
+
+        async def scenario():
+            async with _client(app) as client:
+                await client.get("/api/providers/prov_1")
+                await client.get("/api/providers/prov_2")
+                await _as_other_worker(provider_page.invalidate("prov_1"))
+                before_poll = await client.get("/api/providers/prov_1")
+                assert await http_cache.poll() == 1
+                return (before_poll, await client.get("/api/providers/prov_1"),
+                        await client.get("/api/providers/prov_2"))
+
+        before_poll, after_poll, other = asyncio.run(scenario())
+        assert before_poll.headers["x-cache"] == "HIT"
+        assert after_poll.headers["x-cache"] == "MISS"
+        assert other.headers["x-cache"] == "HIT"
+
+    def test_provider_page_follows_provider_invalidation(self, cache):
+        app, calls = cache
+
+        async def scenario():
+            async with _client(app) as client:
+                first = await client.get("/api/providers/prov_1/page")
+                await _as_other_worker(provider_page.invalidate("prov_1"))
+                await http_cache.poll()
+                return first, await client.get("/api/providers/prov_1/page")
+
+        first, after_poll = asyncio.run(scenario())
+        assert after_poll.headers["x-cache"] == "MISS"
+        assert after_poll.headers["etag"] != first.headers["etag"]
+
+    def test_parent_prefix_invalidates_every_provider(self, cache):
+        app, calls = cache
+
+        async def scenario():
+            async with _client(app) as client:
+                await client.get("/api/providers/prov_1")
+                await _as_other_worker(http_cache.invalidate("/api/providers/"))
+                await http_cache.poll()
+                return await client.get("/api/providers/prov_1")
+
+        assert asyncio.run(scenario()).headers["x-cache"] == "MISS"
+
+    def test_listeners_hear_remote_invalidations(self, cache):
+        heard = []
+        http_cache.on_change(heard.append)
+
+        async def scenario():
+            await _as_other_worker(http_cache.invalidate("/api/packs"))
+            await http_cache.poll()
+            await http_cache.poll()
+
+        asyncio.run(scenario())
+        assert heard == ["/api/packs"]
+
+
+class TestAdminEventModeration:
+    """Events deleted or hidden by an admin leave the cached listing at once"""
+
+    @pytest.mark.parametrize("method,path,body", [
+        ("DELETE", "/api/admin/community-events/evt_1", None),
+        ("PATCH", "/api/admin/community-events/evt_1/status", {"status": "hidden"}),
+    ])
+    def test_listing_invalidated(self, db, cache, method, path, body):
+        app, calls = cache
+
+        @app.get("/api/events")
+        async def events():
+            return await db.community_events.find({"status": "published"}, {"_id": 0}).to_list(None)
+
+        app.include_router(admin.router)
+        app.dependency_overrides[admin.get_admin_user] = lambda: {"admin_id": "admin_1"}
+
+        async def scenario():
+            await db.community_events.insert_one({"event_id": "evt_1", "status": "published"})
+            async with _client(app) as client:
+                listed = (await client.get("/api/events")).json()
+                response = await client.request(method, path, json=body)
+                return listed, response, await client.get("/api/events")
+
+        listed, response, after = asyncio.run(scenario())
+        assert [e["event_id"] for e in listed] == ["evt_1"]
+        assert response.status_code == 200
+        assert after.headers["x-cache"] == "MISS"
+        assert after.json() == []
@@ -0,0 +1,93 @@
+"""
+Message Notification Tests
+Chat email digests skip messages the recipient has already read
+"""
+import asyncio
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import conversations
+import email_service
+import message_notifications
+import realtime
+
+CLIENT = "user_client"
+PROVIDER = "user_provider"
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def sent(db, monkeypatch):
+    """Emails handed to the email service, instead of sending them"""
+    emails = []
+
+    async def offline(user_id):
+        return False
+
+    async def send_single(to, name, sender_name, preview):
+        emails.append({"to": to, "previews": [preview]})
+        return True
+
+    async def send_digest(to, name, senders, total):
+        emails.append({"to": to, "total": total})
+        return True
+
+    monkeypatch.setattr(realtime, "is_online", offline)
+    monkeypatch.setattr(email_service, "send_new_message_notification", send_single)
+    monkeypatch.setattr(email_service, "send_message_digest_notification", send_digest)
+    asyncio.run(db.users.insert_many([
+        {"user_id": CLIENT, "email": "client@test.com", "name": "Client"},
+        {"user_id": PROVIDER, "email": "pro@test.com", "name": "Pro"},
+    ]))
+    return emails
+
+
+async def _send(minutes, content="Bonjour"):
+    message = await conversations.insert_message({
+        "message_id": f"msg_{uuid.uuid4().hex[:12]}",
+        "sender_id": PROVIDER,
+        "receiver_id": CLIENT,
+        "content": content,
+        "read": False,
+        "created_at": (T0 + timedelta(minutes=minutes)).isoformat(),
+    })
+    await message_notifications.schedule(message, sender_name="Pro")
+
+
+async def _deliver(db):
+    pending = await db.pending_message_notifications.find_one_and_delete({"user_id": CLIENT}, {"_id": 0})
+    await message_notifications.deliver(pending)
+
+
+class TestReadSuppression:
+    """Read state comes from the conversation watermarks"""
+
+    def test_unread_message_is_sent(self, db, sent):
+        async def scenario():
+            await _send(1)
+            await _deliver(db)
+
+        asyncio.run(scenario())
+        assert sent == [{"to": "client@test.com", "previews": ["Bonjour"]}]
+
+    def test_read_messages_are_not_sent(self, db, sent):
+        async def scenario():
+            await _send(1)
+            await _send(2)
+            await conversations.mark_read(CLIENT, PROVIDER)
+            await _deliver(db)
+
+        asyncio.run(scenario())
+        assert sent == []
+
+    def test_only_messages_after_watermark_are_sent(self, db, sent):
+        async def scenario():
+            await _send(1, "Premier")
+            await conversations.mark_read(CLIENT, PROVIDER)
+            await _send(2, "Second")
+            await _deliver(db)
+
+        asyncio.run(scenario())
+        assert sent == [{"to": "client@test.com", "previews": ["Second"]}]
@@ -0,0 +1,78 @@
+"""
+Message Pipeline Tests
+Failed post-processing steps are retried on their own, without repeating
+the writes that already went through
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import conversations
+import message_pipeline
+
+CLIENT = "user_client"
+PROVIDER = "user_provider"
+
+
+@pytest.fixture
+def pipeline(db, monkeypatch):
+    """Inline pipeline (no workers) with immediate retries"""
+    monkeypatch.setattr(message_pipeline, "RETRY_DELAY", 0)
+    monkeypatch.setattr(message_pipeline, "_stats", dict(message_pipeline._stats, processed=0, retried=0, failed=0))
+    return message_pipeline
+
+
+def _fail(monkeypatch, name, times):
+    original = getattr(conversations, name)
+    calls = []
+
+    async def flaky(*args):
+        calls.append(args)
+        if len(calls) <= times:
+            raise RuntimeError("write failed")
+        return await original(*args)
+    monkeypatch.setattr(conversations, name, flaky)
+    return calls
+
+
+async def _send(db):
+    message = await conversations.insert_message({
+        "message_id": "msg_1", "sender_id": PROVIDER, "receiver_id": CLIENT,
+        "content": "Bonjour", "read": False, "created_at": datetime.now(timezone.utc).isoformat()
+    }, summary=False)
+    await message_pipeline.submit(message, steps=("summary",))
+    while message_pipeline._retries:
+        await asyncio.gather(*list(message_pipeline._retries))
+    return await db.conversations.find_one({"conversation_id": message["conversation_id"]}, {"_id": 0})
+
+
+class TestSummaryRetry:
+    """A failed preview write does not count the message twice"""
+
+    def test_preview_failure_retries_preview_only(self, db, pipeline, monkeypatch):
+        counted = _fail(monkeypatch, "count_message", 0)
+        previews = _fail(monkeypatch, "update_preview", 1)
+
+        conversation = asyncio.run(_send(db))
+        assert conversation["unread"] == {CLIENT: 1}
+        assert conversation["last_message"]["message_id"] == "msg_1"
+        assert (len(counted), len(previews)) == (1, 2)
+        assert pipeline._stats["retried"] == 1
+        assert pipeline._stats["processed"] == 1
+
+    def test_counter_failure_is_retried(self, db, pipeline, monkeypatch):
+        counted = _fail(monkeypatch, "count_message", 1)
+
+        conversation = asyncio.run(_send(db))
+        assert conversation["unread"] == {CLIENT: 1}
+        assert conversation["last_message"]["message_id"] == "msg_1"
+        assert len(counted) == 2
+
+    def test_gives_up_after_max_attempts(self, db, pipeline, monkeypatch):
+        _fail(monkeypatch, "update_preview", message_pipeline.MAX_ATTEMPTS)
+
+        conversation = asyncio.run(_send(db))
+        assert conversation["unread"] == {CLIENT: 1}
+        assert "last_message" not in conversation
+        assert pipeline._stats["failed"] == 1
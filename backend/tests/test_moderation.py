@@ -0,0 +1,73 @@
+"""
+Moderation Tests
+Keyword matching over normalized text and the per-process matcher cache
+"""
+import asyncio
+
+import pytest
+
+import moderation
+import settings_service
+from moderation import KeywordMatcher, normalize
+
+
+class TestNormalize:
+    """Accents, case, leetspeak and spaced-out letters are undone"""
+
+    @pytest.mark.parametrize("text,expected", [
+        ("Écris-moi sur WhatsApp", "ecrismoi sur whatsapp"),
+        ("Wh4ts4pp", "whatsapp"),
+        ("w h a t s a p p !", "whatsapp"),
+        ("t.e.l.e.g.r.a.m", "telegram"),
+        ("  ", ""),
+    ])
+    def test_normalize(self, text, expected):
+        assert normalize(text) == expected
+
+
+class TestKeywordMatcher:
+    """The automaton finds every keyword in one pass"""
+
+    def test_obfuscated_keywords_are_found(self):
+        matcher = KeywordMatcher(moderation.DEFAULT_FLAGGED_KEYWORDS)
+        assert matcher.find("Ajoute-moi sur W-h-@-t-s-@-p-p, paiement en ESPÈCES") == ["whatsapp", "espèces"]
+
+    def test_keywords_in_order_of_appearance(self):
+        matcher = KeywordMatcher(["virement", "telegram", "cash"])
+        assert matcher.find("cash ou virement ? sinon telegram") == ["cash", "virement", "telegram"]
+
+    def test_short_keywords_match_whole_words_only(self):
+        matcher = KeywordMatcher(["tg", "arnaque"])
+        assert matcher.find("Votre mortgage est prêt") == []
+        assert matcher.find("tg") == ["tg"]
+        assert matcher.find("c'est une arnaquerie") == ["arnaque"]
+
+    def test_normalized_duplicates_are_reported_once(self):
+        matcher = KeywordMatcher(["mon numéro", "mon numero"])
+        assert len(matcher) == 1
+        assert matcher.find("voici MON NUMÉRO") == ["mon numéro"]
+
+    def test_clean_message(self):
+        matcher = KeywordMatcher(moderation.DEFAULT_FLAGGED_KEYWORDS)
+        assert matcher.find("Bonjour, je souhaite réserver pour le 12 juin") == []
+
+
+class TestMatcherCache:
+    """The matcher is rebuilt only when the settings version changes"""
+
+    def test_rebuilt_after_settings_change(self, db, monkeypatch):
+        monkeypatch.setattr(moderation, "_cache", {"version": None, "matcher": None})
+        monkeypatch.setattr(settings_service, "_state", {"version": None, "loaded_at": None})
+
+        async def scenario():
+            await db.moderation_config.insert_one({"type": "keywords", "enabled": True, "keywords": ["paypal"]})
+            await settings_service.load()
+            first = await moderation.get_matcher()
+            again = await moderation.get_matcher()
+            await db.moderation_config.update_one({"type": "keywords"}, {"$set": {"keywords": ["lydia"]}})
+            await settings_service.notify_changed()
+            return first, again, await moderation.find_keywords("payé par Lydia")
+
+        first, again, found = asyncio.run(scenario())
+        assert again is first
+        assert found == ["lydia"]
@@ -0,0 +1,159 @@
+"""
+Payment Event Tests
+Stripe webhook events are recorded once and applied exactly once, however
+often the same payment is reported
+"""
+import asyncio
+
+import pytest
+
+import payment_events
+
+SESSION_ID = "cs_test_1"
+
+
+@pytest.fixture
+def booking(db):
+    """A confirmed booking with a pending deposit transaction"""
+    asyncio.run(payment_events.ensure_indexes())
+    asyncio.run(db.users.insert_one({"user_id": "user_client", "name": "Client"}))
+    asyncio.run(db.provider_profiles.insert_one({"provider_id": "prov_1", "user_id": "user_provider"}))
+    asyncio.run(db.bookings.insert_one({
+        "booking_id": "booking_1", "provider_id": "prov_1", "client_id": "user_client",
+        "total_amount": 1000.0, "deposit_required": 300.0, "deposit_paid": 0, "payment_status": "pending",
+    }))
+    asyncio.run(db.payment_transactions.insert_one({
+        "transaction_id": "txn_1", "session_id": SESSION_ID, "booking_id": "booking_1",
+        "user_id": "user_client", "amount": 300.0, "payment_status": "pending",
+    }))
+
+
+async def _record(event_id):
+    return await payment_events.record_webhook_event(
+        event_id, "checkout.session.completed", SESSION_ID, "paid", {"booking_id": "booking_1"}
+    )
+
+
+class TestEventStore:
+    """Duplicate deliveries of one event are stored once"""
+
+    def test_duplicate_event_is_ignored(self, db, booking):
+        async def scenario():
+            return await _record("evt_1"), await _record("evt_1"), await db.stripe_events.count_documents({})
+
+        assert asyncio.run(scenario()) == (True, False, 1)
+
+
+class TestIdempotentApply:
+    """The booking is credited and the provider told once per transaction"""
+
+    def test_payment_applied_once(self, db, booking):
+        async def scenario():
+            await _record("evt_1")
+            await _record("evt_2")  # Stripe may send several events for one session
+            assert await payment_events.process_pending_events() == 2
+            await payment_events.apply_paid_session(SESSION_ID)  # status poll racing the webhook
+            return (
+                await db.bookings.find_one({"booking_id": "booking_1"}, {"_id": 0}),
+                await db.messages.count_documents({"receiver_id": "user_provider"}),
+                await db.stripe_events.distinct("status"),
+            )
+
+        booking_doc, messages, statuses = asyncio.run(scenario())
+        assert booking_doc["deposit_paid"] == 300.0
+        assert booking_doc["payment_status"] == "partial"
+        assert booking_doc["applied_transaction_ids"] == ["txn_1"]
+        assert messages == 1
+        assert statuses == ["processed"]
+
+    def test_failed_event_is_retried_later(self, db, booking, monkeypatch):
+        async def broken(*args):
+            raise RuntimeError("database hiccup")
+        monkeypatch.setattr(payment_events, "apply_paid_session", broken)
+
+        async def scenario():
+            await _record("evt_1")
+            await payment_events.process_pending_events()
+            return await db.stripe_events.find_one({"event_id": "evt_1"}, {"_id": 0})
+
+        event = asyncio.run(scenario())
+        assert event["status"] == "failed"
+        assert event["attempts"] == 1
+        assert event["next_attempt_at"] > event["received_at"]
+
+
+def _fail_once(monkeypatch, name):
+    """Make payment_events.<name> raise on its first call only"""
+    original = getattr(payment_events, name)
+    calls = []
+
+    def flaky(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("worker crashed")
+        return original(*args, **kwargs)
+    monkeypatch.setattr(payment_events, name, flaky)
+
+
+async def _retry_now(db):
+    """Make the failed events due again and run the worker"""
+    await db.stripe_events.update_many({"status": "failed"}, {"$set": {"next_attempt_at": ""}})
+    await payment_events.process_pending_events()
+
+
+class TestSideEffectsAfterCrash:
+    """A retry after a crash past the paid transition still runs every side effect, once"""
+
+    @pytest.fixture
+    def pushes(self, monkeypatch):
+        sent = []
+
+        async def push(user_id, payload):
+            sent.append((user_id, payload["transaction_id"]))
+        monkeypatch.setattr(payment_events, "notify_payment_confirmed", push)
+        return sent
+
+    async def _outcome(self, db):
+        return (
+            await db.bookings.find_one({"booking_id": "booking_1"}, {"_id": 0}),
+            await db.messages.count_documents({"receiver_id": "user_provider"}),
+            await db.daily_stats.find({}, {"_id": 0, "revenue": 1, "payments": 1}).to_list(None),
+            await db.stripe_events.find_one({"event_id": "evt_1"}, {"_id": 0, "status": 1}),
+        )
+
+    @pytest.mark.parametrize("crash_in", ["compute_booking_payment_status", "_send_payment_message"])
+    def test_retry_completes_the_payment(self, db, booking, pushes, monkeypatch, crash_in):
+        _fail_once(monkeypatch, crash_in)
+
+        async def scenario():
+            await _record("evt_1")
+            await payment_events.process_pending_events()
+            failed = await db.stripe_events.find_one({"event_id": "evt_1"}, {"_id": 0, "status": 1})
+            await _retry_now(db)
+            await _record("evt_2")  # a late duplicate changes nothing
+            await payment_events.process_pending_events()
+            return failed, await self._outcome(db)
+
+        failed, (booking_doc, messages, rollup, event) = asyncio.run(scenario())
+        assert failed["status"] == "failed"
+        assert event["status"] == "processed"
+        assert booking_doc["deposit_paid"] == 300.0
+        assert booking_doc["payment_status"] == "partial"
+        assert messages == 1
+        assert rollup == [{"revenue": 300.0, "payments": 1}]
+        assert pushes == [("user_client", "txn_1")]
+
+    def test_already_paid_transactions_are_not_replayed(self, db, booking, pushes):
+        """Transactions paid before the side effect flags existed keep their rollups as they are"""
+        async def scenario():
+            await db.payment_transactions.update_one(
+                {"transaction_id": "txn_1"},
+                {"$set": {"payment_status": "paid", "provider_notified": True}}
+            )
+            await payment_events.apply_paid_session(SESSION_ID)
+            return await self._outcome(db)
+
+        _, messages, rollup, _ = asyncio.run(scenario())
+        assert messages == 0
+        assert rollup == []
+        assert pushes == []
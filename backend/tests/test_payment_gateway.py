@@ -0,0 +1,98 @@
+"""
+Payment Gateway Tests
+Circuit breaker and retry behaviour of the payment gateway client, run
+against the in-process fake gateway
+"""
+import asyncio
+
+import pytest
+
+import payment_gateway
+from payment_gateway import CircuitOpenError, FakePaymentGateway, PaymentGatewayError
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setattr(payment_gateway, "BACKOFF_MAX", 0)
+    return FakePaymentGateway()
+
+
+async def _checkout(gateway):
+    return await gateway.create_checkout_session(
+        10.0, "eur", "https://example.com/ok?session_id={CHECKOUT_SESSION_ID}",
+        "https://example.com/cancel", {"user_id": "user_1"}
+    )
+
+
+class TestCircuitBreaker:
+    """Only provider outages open the breaker"""
+
+    def test_bad_webhooks_do_not_open_breaker(self, gateway):
+        async def scenario():
+            for _ in range(payment_gateway.BREAKER_THRESHOLD * 2):
+                with pytest.raises(PaymentGatewayError):
+                    await gateway.handle_webhook(b"garbage", None)
+            return await _checkout(gateway)
+
+        session = asyncio.run(scenario())
+        assert session.session_id.startswith("cs_fake_")
+        assert gateway.breaker.state == "closed"
+
+    def test_client_errors_do_not_open_breaker(self, gateway):
+        async def scenario():
+            for _ in range(payment_gateway.BREAKER_THRESHOLD * 2):
+                with pytest.raises(PaymentGatewayError):
+                    await gateway.get_checkout_status("cs_unknown")
+
+        asyncio.run(scenario())
+        assert gateway.breaker.state == "closed"
+        assert gateway.metrics.snapshot()["get_checkout_status"]["retries"] == 0
+
+    def test_outage_opens_breaker(self, gateway, monkeypatch):
+        async def unreachable(session_id):
+            raise ConnectionError("connection refused")
+        monkeypatch.setattr(gateway, "_do_get_checkout_status", unreachable)
+
+        async def scenario():
+            for _ in range(payment_gateway.BREAKER_THRESHOLD):
+                with pytest.raises(PaymentGatewayError):
+                    await gateway.get_checkout_status("cs_1")
+            with pytest.raises(CircuitOpenError):
+                await _checkout(gateway)
+
+        asyncio.run(scenario())
+        assert gateway.breaker.state == "open"
+
+
+class TestRetries:
+    """Transient failures are retried, except where a retry could duplicate a write"""
+
+    def test_status_reads_are_retried(self, gateway, monkeypatch):
+        calls = []
+        original = gateway._do_get_checkout_status
+
+        async def flaky(session_id):
+            calls.append(session_id)
+            if len(calls) == 1:
+                raise asyncio.TimeoutError()
+            return await original(session_id)
+        monkeypatch.setattr(gateway, "_do_get_checkout_status", flaky)
+
+        async def scenario():
+            session = await _checkout(gateway)
+            return await gateway.get_checkout_status(session.session_id)
+
+        assert asyncio.run(scenario()).payment_status == "unpaid"
+        assert len(calls) == 2
+
+    def test_checkout_creation_is_not_retried(self, gateway, monkeypatch):
+        calls = []
+
+        async def timing_out(*args):
+            calls.append(args)
+            raise asyncio.TimeoutError()
+        monkeypatch.setattr(gateway, "_do_create_checkout_session", timing_out)
+
+        with pytest.raises(PaymentGatewayError):
+            asyncio.run(_checkout(gateway))
+        assert len(calls) == 1
@@ -0,0 +1,49 @@
+"""
+Payment Status Cache Tests
+The transaction cache behind the payment status endpoints stays bounded
+"""
+import time
+
+from server import TTLCache
+
+
+class TestTTLCache:
+    """Expiry and size bound of the payment status cache"""
+
+    def test_get_returns_fresh_entry(self):
+        cache = TTLCache(ttl=60, max_size=10)
+        cache.set("cs_1", {"payment_status": "pending"})
+        assert cache.get("cs_1") == {"payment_status": "pending"}
+
+    def test_expired_entry_is_dropped(self, monkeypatch):
+        cache = TTLCache(ttl=3, max_size=10)
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now)
+        cache.set("cs_1", {"payment_status": "pending"})
+        monkeypatch.setattr(time, "monotonic", lambda: now + 4)
+        assert cache.get("cs_1") is None
+        assert len(cache) == 0
+
+    def test_abandoned_sessions_are_evicted_on_write(self, monkeypatch):
+        cache = TTLCache(ttl=3, max_size=1000)
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now)
+        for i in range(100):
+            cache.set(f"cs_{i}", {"payment_status": "pending"})
+        monkeypatch.setattr(time, "monotonic", lambda: now + 4)
+        cache.set("cs_new", {"payment_status": "pending"})
+        assert len(cache) == 1
+
+    def test_size_is_bounded(self):
+        cache = TTLCache(ttl=60, max_size=5)
+        for i in range(20):
+            cache.set(f"cs_{i}", i)
+        assert len(cache) == 5
+        assert cache.get("cs_0") is None
+        assert cache.get("cs_19") == 19
+
+    def test_pop(self):
+        cache = TTLCache(ttl=60, max_size=5)
+        cache.set("cs_1", 1)
+        assert cache.pop("cs_1") == 1
+        assert cache.pop("cs_1", None) is None
@@ -0,0 +1,150 @@
+"""
+Review Stats Tests
+Incremental review counters on the provider profile, and their rebuild
+from the reviews collection
+"""
+import asyncio
+
+import pytest
+
+import review_stats
+
+
+def _review(rating, verified=False, provider_id="prov_1"):
+    return {"provider_id": provider_id, "rating": rating, "is_verified": verified}
+
+
+@pytest.fixture
+def providers(db):
+    asyncio.run(db.provider_profiles.insert_many([
+        {"provider_id": "prov_1", "rating": 0.0, "total_reviews": 0},
+        {"provider_id": "prov_2", "rating": 0.0, "total_reviews": 0},
+    ]))
+
+
+async def _profile(db, provider_id="prov_1"):
+    return await db.provider_profiles.find_one({"provider_id": provider_id}, {"_id": 0})
+
+
+class _Interleaved:
+    """Database proxy running `hook` right after the first provider_profiles.find_one_and_update"""
+
+    def __init__(self, db, hook):
+        self._db = db
+        self._hook = hook
+
+    def __getattr__(self, name):
+        collection = getattr(self._db, name)
+        if name != "provider_profiles":
+            return collection
+        proxy = self
+
+        class Collection:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def find_one_and_update(self, *args, **kwargs):
+                doc = await collection.find_one_and_update(*args, **kwargs)
+                if proxy._hook:
+                    hook, proxy._hook = proxy._hook, None
+                    await hook()
+                return doc
+
+        return Collection()
+
+
+class TestRecordReview:
+    """Each review moves the counters, the histogram and the displayed rating"""
+
+    def test_add_and_remove(self, db, providers):
+        async def scenario():
+            for review in (_review(5, verified=True), _review(4), _review(4.6)):
+                await review_stats.record_review(review)
+            added = await _profile(db), await review_stats.get_stats("prov_1")
+            await review_stats.record_review(_review(5, verified=True), sign=-1)
+            return added, await _profile(db)
+
+        (profile, stats), removed = asyncio.run(scenario())
+        assert stats["count"] == 3
+        assert stats["verified_count"] == 1
+        assert stats["histogram"] == {"1": 0, "2": 0, "3": 0, "4": 2, "5": 1}
+        assert (profile["rating"], profile["total_reviews"]) == (4.5, 3)
+        assert removed["review_stats"]["histogram"]["5"] == 0
+        assert (removed["rating"], removed["total_reviews"]) == (4.3, 2)
+
+    def test_unknown_provider(self, db, providers):
+        asyncio.run(review_stats.record_review(_review(3, provider_id="prov_missing")))
+        assert asyncio.run(db.provider_profiles.count_documents({})) == 2
+
+    def test_rating_write_skipped_when_another_review_landed(self, db, providers, monkeypatch):
+        """The slower write must not replace the rating with its older stats"""
+        async def concurrent_review():
+            monkeypatch.setattr(review_stats, "get_db", lambda: db)
+            await review_stats.record_review(_review(1))
+        monkeypatch.setattr(review_stats, "get_db", lambda: _Interleaved(db, concurrent_review))
+
+        asyncio.run(review_stats.record_review(_review(5)))
+        profile = asyncio.run(_profile(db))
+        assert profile["review_stats"]["count"] == 2
+        assert (profile["rating"], profile["total_reviews"]) == (3.0, 2)
+
+    def test_empty_stats(self, db, providers):
+        stats = asyncio.run(review_stats.get_stats("prov_2"))
+        assert stats == review_stats.empty_stats()
+        assert review_stats.average(stats) == 0.0
+
+
+class TestReconcile:
+    """reconcile() rebuilds from the reviews and resets providers without any"""
+
+    def test_rebuilds_and_resets(self, db, providers):
+        async def scenario():
+            await db.reviews.insert_many([_review(5, verified=True), _review(3), _review(3)])
+            # Drifted counters, and a provider whose reviews were all deleted
+            await db.provider_profiles.update_one({"provider_id": "prov_1"}, {"$set": {
+                "review_stats": {"count": 9, "sum": 9, "verified_count": 0, "histogram": {"1": 9}}
+            }})
+            await review_stats.record_review(_review(4, provider_id="prov_2"))
+            result = await review_stats.reconcile()
+            return result, await _profile(db), await _profile(db, "prov_2")
+
+        result, first, second = asyncio.run(scenario())
+        assert result == {"providers": 1, "reviews": 3, "reset": 1}
+        assert first["review_stats"] == {
+            "count": 3, "sum": 11, "verified_count": 1, "histogram": {"1": 0, "2": 0, "3": 2, "4": 0, "5": 1}
+        }
+        assert (first["rating"], first["total_reviews"]) == (3.7, 3)
+        assert second["review_stats"] == review_stats.empty_stats()
+        assert (second["rating"], second["total_reviews"]) == (0.0, 0)
+
+
+class TestEnsurePopulated:
+    """Stats are built once, on a database that has reviews but no stats yet"""
+
+    def test_builds_missing_stats(self, db, providers):
+        async def scenario():
+            await db.reviews.insert_one(_review(4))
+            await review_stats.ensure_populated()
+            return await _profile(db)
+
+        profile = asyncio.run(scenario())
+        assert profile["review_stats"]["count"] == 1
+        assert profile["rating"] == 4.0
+
+    def test_existing_stats_are_kept(self, db, providers, monkeypatch):
+        calls = []
+
+        async def reconcile():
+            calls.append(True)
+        monkeypatch.setattr(review_stats, "reconcile", reconcile)
+
+        async def scenario():
+            await db.reviews.insert_one(_review(4))
+            await review_stats.record_review(_review(4))
+            await review_stats.ensure_populated()
+            await db.provider_profiles.update_many({}, {"$unset": {"review_stats": ""}})
+            await db.reviews.delete_many({})
+            await review_stats.ensure_populated()  # no reviews: nothing to build
+
+        asyncio.run(scenario())
+        assert calls == []
@@ -0,0 +1,89 @@
+"""
+Rollup Tests
+Counters kept on writes match a rebuild from the source collections
+"""
+import asyncio
+
+import rollups
+
+DAY1 = "2026-03-30T10:00:00+00:00"
+DAY2 = "2026-04-02T15:30:00+00:00"
+
+
+async def _buckets(db):
+    return (
+        await db.daily_stats.find({}, {"_id": 0, "updated_at": 0}).sort("date", 1).to_list(None),
+        await db.monthly_stats.find({}, {"_id": 0, "updated_at": 0}).sort("month", 1).to_list(None),
+    )
+
+
+def _counters(buckets: list) -> list:
+    """Non-zero counters of each bucket (moved contributions leave zeros behind)"""
+    return [
+        {"key": b.get("date", b.get("month")), **{k: v for k, v in rollups.flatten(b).items() if v}}
+        for b in buckets
+    ]
+
+
+class TestIncrementalMatchesRebuild:
+    """Every incremental write lands where the nightly rebuild puts it"""
+
+    def test_same_totals(self, db):
+        async def scenario():
+            await rollups.ensure_indexes()
+            users = [
+                {"user_id": "u1", "user_type": "client", "created_at": DAY1},
+                {"user_id": "u2", "user_type": "provider", "created_at": DAY1},
+                {"user_id": "u3", "user_type": "client", "created_at": DAY2},
+            ]
+            await db.users.insert_many([dict(u) for u in users])
+            for user in users:
+                await rollups.record_user_created(user["user_type"], user["created_at"])
+
+            await db.provider_profiles.insert_one({"provider_id": "p1", "category": "dj", "created_at": DAY1})
+            await rollups.record_provider_created(DAY1)
+
+            bookings = [
+                {"booking_id": "b1", "provider_id": "p1", "status": "pending",
+                 "total_amount": 800.0, "platform_commission": 80.0, "created_at": DAY1},
+                {"booking_id": "b2", "provider_id": "p1", "status": "pending",
+                 "total_amount": 450.5, "platform_commission": 45.05, "created_at": DAY2},
+            ]
+            await db.bookings.insert_many([dict(b) for b in bookings])
+            for booking in bookings:
+                await rollups.record_booking_created(booking)
+            # b1 is confirmed later: its contribution moves between statuses
+            await db.bookings.update_one({"booking_id": "b1"}, {"$set": {"status": "confirmed"}})
+            await rollups.record_booking_changed(bookings[0], {**bookings[0], "status": "confirmed"})
+
+            await db.payment_transactions.insert_many([
+                {"transaction_id": "t1", "amount": 240.0, "payment_status": "paid", "paid_at": DAY2, "created_at": DAY1},
+                {"transaction_id": "t2", "amount": 99.0, "payment_status": "pending", "created_at": DAY2},
+            ])
+            await rollups.record_payment(240.0, DAY2)
+
+            await db.subscriptions.insert_one({"plan_id": "pro", "status": "active", "created_at": DAY1})
+            await rollups.record_subscription_change(started_plan="pro", when=DAY1)
+
+            incremental = await _buckets(db)
+            await db.daily_stats.insert_one({"date": "2026-01-01", "new_users": 3})  # its users are gone
+            assert await rollups.rebuild_rollups() == {"days": 2, "months": 2}
+            return incremental, await _buckets(db)
+
+        (daily, monthly), (rebuilt_daily, rebuilt_monthly) = asyncio.run(scenario())
+        assert _counters(daily) == _counters(rebuilt_daily)
+        assert _counters(monthly) == _counters(rebuilt_monthly)
+        assert [d["date"] for d in daily] == ["2026-03-30", "2026-04-02"]
+        assert daily[0]["bookings_by_status"] == {"pending": 0, "confirmed": 1}
+        assert daily[1]["revenue"] == 240.0
+        assert rollups.sum_buckets(monthly)["new_users"] == 3
+
+    def test_totals_by_month(self, db):
+        async def scenario():
+            await rollups.record_payment(100.0, DAY1)
+            await rollups.record_payment(50.0, DAY2)
+            return await rollups.get_totals(), await rollups.get_totals(since_month="2026-04")
+
+        totals, april = asyncio.run(scenario())
+        assert totals == {"revenue": 150.0, "payments": 2}
+        assert april == {"revenue": 50.0, "payments": 1}
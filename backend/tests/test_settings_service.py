@@ -0,0 +1,107 @@
+"""
+Settings Service Tests
+Settings are served from memory, and a change made by one worker is
+picked up by the others through the version stamp
+"""
+import asyncio
+
+import pytest
+
+import settings_service
+
+
+@pytest.fixture
+def settings(db, monkeypatch):
+    """Fresh in-memory state, polling every few milliseconds"""
+    monkeypatch.setattr(settings_service, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings_service, "_state", {"version": None, "loaded_at": None})
+    monkeypatch.setattr(settings_service, "_listeners", [])
+    monkeypatch.setattr(settings_service, "_stats", dict.fromkeys(settings_service._stats, 0))
+    monkeypatch.setattr(settings_service, "_worker_task", None)
+    for name in ("_settings", "_homepage", "_moderation"):
+        monkeypatch.setattr(settings_service, name, {})
+    asyncio.run(db.site_settings.insert_one({"key": "commission", "value": {"enabled": True, "rate": 10}}))
+    return settings_service
+
+
+class TestVersionStamp:
+    """Writes bump the shared stamp; every worker reloads when it moves"""
+
+    def test_notify_changed_bumps_the_version(self, db, settings):
+        async def scenario():
+            await settings.load()
+            before = settings.version()
+            await db.site_settings.update_one({"key": "commission"}, {"$set": {"value": {"enabled": True, "rate": 15}}})
+            await settings.notify_changed()
+            stamp = await db.cache_versions.find_one({"_id": settings.VERSION_ID})
+            return before, stamp["version"], await settings.commission()
+
+        before, stamp, commission = asyncio.run(scenario())
+        assert before == 0
+        assert stamp == 1 == settings.version()
+        assert commission["rate"] == 15
+
+    def test_other_worker_change_is_polled(self, db, settings):
+        changes = []
+        settings.on_change(lambda: changes.append(settings.version()))
+
+        async def scenario():
+            await settings.load()
+            settings.start_worker()
+            try:
+                # Another worker writes and bumps the stamp
+                await db.site_settings.update_one({"key": "commission"}, {"$set": {"value": {"enabled": False}}})
+                await db.cache_versions.update_one({"_id": settings.VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+                for _ in range(100):
+                    if changes:
+                        break
+                    await asyncio.sleep(0.01)
+                return await settings.commission()
+            finally:
+                await settings.stop_worker()
+
+        commission = asyncio.run(scenario())
+        assert commission == {"enabled": False}
+        assert changes == [1]
+        assert settings.stats()["changes_received"] == 1
+
+    def test_unchanged_stamp_does_not_reload(self, db, settings):
+        async def scenario():
+            await settings.load()
+            settings.start_worker()
+            await asyncio.sleep(0.05)
+            await settings.stop_worker()
+
+        asyncio.run(scenario())
+        assert settings.stats()["loads"] == 1
+
+
+class TestAccessors:
+    """Callers get copies: changing them leaves the loaded settings intact"""
+
+    def test_values_are_deep_copies(self, db, settings):
+        async def scenario():
+            await db.moderation_config.insert_one({"type": "keywords", "keywords": ["paypal"]})
+            await db.site_content.insert_one({"type": "homepage", "hero": {"title": "Bienvenue"}})
+            commission = await settings.commission()
+            commission["rate"] = 99
+            moderation = await settings.moderation_config()
+            moderation["keywords"].append("lydia")
+            homepage = await settings.homepage()
+            homepage["hero"]["title"] = "Changé"
+            return await settings.commission(), await settings.moderation_config(), await settings.homepage()
+
+        commission, moderation, homepage = asyncio.run(scenario())
+        assert commission["rate"] == 10
+        assert moderation["keywords"] == ["paypal"]
+        assert homepage["hero"]["title"] == "Bienvenue"
+
+    def test_defaults(self, db, settings):
+        async def scenario():
+            await db.site_settings.delete_many({})
+            return (
+                await settings.commission(), await settings.subscription_plans(),
+                await settings.email_config(), await settings.get("missing", "default"),
+            )
+
+        assert asyncio.run(scenario()) == ({"enabled": False, "rate": 0}, None, None, "default")
@@ -0,0 +1,157 @@
+"""
+SMTP Transport Tests
+Pooled connections are reused, recycled when idle or worn out, and a send
+on a dropped connection is retried once on a new one
+"""
+import asyncio
+import types
+from email.message import EmailMessage
+
+import aiosmtplib
+import pytest
+
+import smtp_transport
+
+CONFIG = {"smtp_host": "smtp.example.com", "smtp_port": 587, "smtp_user": "user", "smtp_password": "secret"}
+
+
+class _FakeSMTP:
+    """aiosmtplib.SMTP stand-in; `failures` lists errors raised by the next sends"""
+
+    opened: list = []
+    failures: list = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.is_connected = False
+        self.sent = 0
+        self.quit_called = False
+
+    async def connect(self):
+        self.is_connected = True
+        _FakeSMTP.opened.append(self)
+
+    async def send_message(self, message):
+        if _FakeSMTP.failures:
+            error = _FakeSMTP.failures.pop(0)
+            self.is_connected = False
+            raise error
+        self.sent += 1
+
+    async def quit(self):
+        self.quit_called = True
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(smtp_transport, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(smtp_transport.aiosmtplib, "SMTP", _FakeSMTP)
+    monkeypatch.setattr(_FakeSMTP, "opened", [])
+    monkeypatch.setattr(_FakeSMTP, "failures", [])
+    monkeypatch.setattr(smtp_transport, "_stats", dict.fromkeys(smtp_transport._stats, 0))
+    return clock
+
+
+def _message():
+    message = EmailMessage()
+    message["To"] = "client@example.com"
+    message.set_content("Bonjour")
+    return message
+
+
+class TestConnectionReuse:
+    """Sends share a connection until it idles too long or reaches its message cap"""
+
+    def test_reused_between_sends(self, smtp):
+        pool = smtp_transport.SMTPPool(CONFIG, size=2)
+
+        async def scenario():
+            for _ in range(3):
+                await pool.send(_message())
+
+        asyncio.run(scenario())
+        assert len(_FakeSMTP.opened) == 1
+        assert _FakeSMTP.opened[0].sent == 3
+        assert _FakeSMTP.opened[0].kwargs["start_tls"] is True
+
+    def test_idle_connection_is_recycled(self, smtp):
+        pool = smtp_transport.SMTPPool(CONFIG)
+
+        async def scenario():
+            await pool.send(_message())
+            smtp.now += smtp_transport.IDLE_TIMEOUT + 1
+            await pool.send(_message())
+
+        asyncio.run(scenario())
+        first, second = _FakeSMTP.opened
+        assert first.quit_called
+        assert second.sent == 1
+
+    def test_message_cap_per_connection(self, smtp, monkeypatch):
+        monkeypatch.setattr(smtp_transport, "MAX_MESSAGES_PER_CONNECTION", 2)
+        pool = smtp_transport.SMTPPool(CONFIG)
+
+        async def scenario():
+            for _ in range(5):
+                await pool.send(_message())
+
+        asyncio.run(scenario())
+        assert [c.sent for c in _FakeSMTP.opened] == [2, 2, 1]
+        assert all(c.quit_called for c in _FakeSMTP.opened[:2])
+        assert len(pool._idle) == 1
+
+
+class TestReconnect:
+    """A dropped connection is retried once, on a new session"""
+
+    def test_retried_once_on_disconnect(self, smtp):
+        pool = smtp_transport.SMTPPool(CONFIG)
+
+        async def scenario():
+            await pool.send(_message())
+            _FakeSMTP.failures.append(aiosmtplib.SMTPServerDisconnected("idle timeout"))
+            await pool.send(_message())
+
+        asyncio.run(scenario())
+        assert [c.sent for c in _FakeSMTP.opened] == [1, 1]
+        assert smtp_transport._stats["reconnects"] == 1
+
+    def test_second_failure_is_raised(self, smtp):
+        pool = smtp_transport.SMTPPool(CONFIG)
+        _FakeSMTP.failures.extend([ConnectionResetError(), ConnectionResetError()])
+
+        with pytest.raises(ConnectionResetError):
+            asyncio.run(pool.send(_message()))
+        assert len(_FakeSMTP.opened) == 2
+        assert pool._idle == []
+
+    def test_other_errors_are_not_retried(self, smtp):
+        pool = smtp_transport.SMTPPool(CONFIG)
+        _FakeSMTP.failures.append(aiosmtplib.SMTPRecipientsRefused([]))
+
+        with pytest.raises(aiosmtplib.SMTPRecipientsRefused):
+            asyncio.run(pool.send(_message()))
+        assert len(_FakeSMTP.opened) == 1
+        assert smtp_transport._stats["reconnects"] == 0
+
+
+class TestSendMessage:
+    """A config change replaces the pool"""
+
+    def test_new_pool_on_config_change(self, smtp, monkeypatch):
+        monkeypatch.setattr(smtp_transport, "_pool", None)
+
+        async def scenario():
+            await smtp_transport.send_message(_message(), CONFIG)
+            await smtp_transport.send_message(_message(), {**CONFIG, "smtp_password": "rotated"})
+            await smtp_transport.close()
+
+        asyncio.run(scenario())
+        assert len(_FakeSMTP.opened) == 2
+        assert all(c.quit_called for c in _FakeSMTP.opened)
+        assert smtp_transport._stats["sent"] == 2
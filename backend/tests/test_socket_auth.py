@@ -0,0 +1,120 @@
+"""
+Socket.IO Authentication Tests
+The handshake is checked against the session store and the user is bound
+to the socket, never taken from event payloads
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+import socketio
+
+import realtime
+import server
+
+TOKEN = "session_token_1"
+
+
+class _FakeSio:
+    """Per-socket sessions and rooms of the Socket.IO server, without a transport"""
+
+    def __init__(self):
+        self.sessions, self.rooms, self.disconnected = {}, {}, []
+
+    async def save_session(self, sid, session):
+        self.sessions[sid] = session
+
+    async def get_session(self, sid):
+        return self.sessions.setdefault(sid, {})
+
+    async def enter_room(self, sid, room):
+        self.rooms.setdefault(sid, set()).add(room)
+
+    async def disconnect(self, sid):
+        self.disconnected.append(sid)
+
+
+@pytest.fixture
+def sio(db, monkeypatch):
+    fake = _FakeSio()
+    for name in ("save_session", "get_session", "enter_room", "disconnect"):
+        monkeypatch.setattr(server.sio, name, getattr(fake, name))
+    monkeypatch.setattr(realtime, "presence", realtime.PresenceRegistry())
+    return fake
+
+
+def _session(db, expires_in):
+    async def insert():
+        await db.users.insert_one({
+            "user_id": "user_1", "email": "a@example.com", "name": "A",
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        await db.user_sessions.insert_one({
+            "session_token": TOKEN, "user_id": "user_1",
+            "expires_at": (datetime.now(timezone.utc) + expires_in).isoformat()
+        })
+    asyncio.run(insert())
+
+
+class TestConnect:
+    """Handshakes without a valid session are refused"""
+
+    def test_no_token(self, sio):
+        with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+            asyncio.run(server.connect("sid_1", {}, None))
+        assert sio.sessions == {}
+
+    def test_unknown_token(self, sio):
+        with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+            asyncio.run(server.connect("sid_1", {}, {"token": "forged"}))
+
+    def test_expired_session(self, db, sio):
+        _session(db, timedelta(minutes=-1))
+        with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+            asyncio.run(server.connect("sid_1", {"HTTP_COOKIE": f"session_token={TOKEN}"}))
+        assert sio.rooms == {}
+
+    @pytest.mark.parametrize("environ,auth", [
+        ({"HTTP_COOKIE": f"session_token={TOKEN}"}, None),
+        ({}, {"token": TOKEN}),
+        ({"HTTP_AUTHORIZATION": f"Bearer {TOKEN}"}, None),
+    ])
+    def test_user_bound_from_session(self, db, sio, environ, auth):
+        _session(db, timedelta(days=1))
+
+        async def scenario():
+            await server.connect("sid_1", environ, auth)
+            return await server.socket_user("sid_1"), await db.socket_connections.find_one({"sid": "sid_1"})
+
+        user_id, connection = asyncio.run(scenario())
+        assert user_id == "user_1"
+        assert sio.rooms == {"sid_1": {"user_1"}}
+        assert connection["session"] == realtime.session_key(TOKEN)
+
+
+class TestSocketUser:
+    """Events resolve the user bound at connect, until its session expires"""
+
+    def test_payload_user_is_ignored(self, db, sio):
+        _session(db, timedelta(days=1))
+
+        async def scenario():
+            await server.connect("sid_1", {}, {"token": TOKEN})
+            await server.join_room("sid_1", {"user_id": "someone_else"})
+
+        asyncio.run(scenario())
+        assert sio.rooms == {"sid_1": {"user_1"}}
+
+    def test_session_expired_mid_connection(self, db, sio):
+        _session(db, timedelta(days=1))
+
+        async def scenario():
+            await server.connect("sid_1", {}, {"token": TOKEN})
+            sio.sessions["sid_1"]["expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+            return await server.socket_user("sid_1")
+
+        assert asyncio.run(scenario()) is None
+        assert sio.disconnected == ["sid_1"]
+
+    def test_unauthenticated_socket(self, sio):
+        assert asyncio.run(server.socket_user("sid_unknown")) is None
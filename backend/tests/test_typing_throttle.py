@@ -0,0 +1,130 @@
+"""
+Typing Throttle Tests
+Typing events are coalesced per conversation and rate-limited per socket,
+and every indicator that was shown is eventually stopped
+"""
+import asyncio
+
+from realtime import TypingThrottle
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _throttle(**kwargs):
+    sent = []
+
+    async def emit(sender_id, receiver_id, is_typing):
+        sent.append((sender_id, receiver_id, is_typing))
+    return TypingThrottle(emit, **kwargs), sent
+
+
+class TestCoalescing:
+    """One start and one stop reach the receiver, however many events are sent"""
+
+    def test_repeats_are_suppressed(self):
+        throttle, sent = _throttle(timeout=60, burst=100)
+
+        async def scenario():
+            forwarded = [await throttle.update("sid_1", "alice", "bob", True) for _ in range(5)]
+            forwarded.append(await throttle.update("sid_1", "alice", "bob", False))
+            forwarded.append(await throttle.update("sid_1", "alice", "bob", False))
+            return forwarded
+
+        assert asyncio.run(scenario()) == [True, False, False, False, False, True, False]
+        assert sent == [("alice", "bob", True), ("alice", "bob", False)]
+        assert throttle.stats()["suppressed"] == 5
+        assert throttle.stats()["active"] == 0
+
+    def test_conversations_are_independent(self):
+        throttle, sent = _throttle(timeout=60, burst=100)
+
+        async def scenario():
+            await throttle.update("sid_1", "alice", "bob", True)
+            await throttle.update("sid_1", "alice", "carol", True)
+            await throttle.update("sid_2", "bob", "alice", True)
+
+        asyncio.run(scenario())
+        assert len(sent) == 3
+        assert throttle.stats()["active"] == 3
+
+
+class TestTokenBucket:
+    """Each socket gets `burst` events at once, then `rate` per second"""
+
+    def test_burst_then_refill(self):
+        clock = _Clock()
+        throttle, sent = _throttle(timeout=60, rate=2, burst=3, clock=clock)
+
+        async def scenario():
+            receivers = ["r1", "r2", "r3", "r4"]
+            burst = [await throttle.update("sid_1", "alice", r, True) for r in receivers]
+            other_socket = await throttle.update("sid_2", "alice", "r5", True)
+            clock.now += 0.5  # one token back
+            refilled = await throttle.update("sid_1", "alice", "r4", True)
+            again = await throttle.update("sid_1", "alice", "r6", True)
+            return burst, other_socket, refilled, again
+
+        burst, other_socket, refilled, again = asyncio.run(scenario())
+        assert burst == [True, True, True, False]
+        assert other_socket is True
+        assert (refilled, again) == (True, False)
+        assert throttle.stats()["rate_limited"] == 2
+
+    def test_stop_bypasses_the_limit(self):
+        throttle, sent = _throttle(timeout=60, rate=0.001, burst=1)
+
+        async def scenario():
+            await throttle.update("sid_1", "alice", "bob", True)
+            assert await throttle.update("sid_1", "alice", "carol", True) is False
+            return await throttle.update("sid_1", "alice", "bob", False)
+
+        assert asyncio.run(scenario()) is True
+        assert sent[-1] == ("alice", "bob", False)
+
+
+class TestStopDelivered:
+    """An indicator stops on timeout or disconnect when the client never says so"""
+
+    def test_expires_after_timeout(self):
+        throttle, sent = _throttle(timeout=0.2, burst=100)
+
+        async def scenario():
+            await throttle.update("sid_1", "alice", "bob", True)
+            await asyncio.sleep(0.1)
+            await throttle.update("sid_1", "alice", "bob", True)  # pushes the expiry back
+            await asyncio.sleep(0.15)
+            still_typing = list(sent)
+            await asyncio.sleep(0.3)
+            return still_typing
+
+        still_typing = asyncio.run(scenario())
+        assert still_typing == [("alice", "bob", True)]
+        assert sent == [("alice", "bob", True), ("alice", "bob", False)]
+        assert throttle.stats()["expired"] == 1
+
+    def test_stopped_on_disconnect(self):
+        throttle, sent = _throttle(timeout=60, burst=100)
+
+        async def scenario():
+            await throttle.update("sid_1", "alice", "bob", True)
+            await throttle.update("sid_1", "alice", "carol", True)
+            await throttle.update("sid_1", "alice", "carol", False)
+            await throttle.forget_socket("sid_1")
+
+        asyncio.run(scenario())
+        assert sent.count(("alice", "bob", False)) == 1
+        assert sent.count(("alice", "carol", False)) == 1
+        assert throttle.stats()["active"] == 0
+
+    def test_failed_emit_is_not_fatal(self):
+        async def emit(*args):
+            raise ConnectionError("adapter down")
+        throttle = TypingThrottle(emit, timeout=60)
+
+        assert asyncio.run(throttle.update("sid_1", "alice", "bob", True)) is True
@@ -125,6 +125,7 @@ const ProviderCard = ({ provider }) => {
     if (expanded && provider.provider_id) {
       fetchServices();
       fetchPacks();
+      trackView();
       // Reset selections when modal opens
       setSelectedServices([]);
       setSelectedOptions({});
@@ -143,6 +144,17 @@ const ProviderCard = ({ provider }) => {
     }
   };
 
+  // The profile GET is cached, so views are reported separately
+  const trackView = async () => {
+    try {
+      await fetch(`${BACKEND_URL}/api/providers/${provider.provider_id}/view`, {
+        method: 'POST'
+      });
+    } catch (error) {
+      // Ignore errors
+    }
+  };
+
   const fetchPacks = async () => {
     try {
       const res = await fetch(`${BACKEND_URL}/api/providers/${provider.provider_id}/packs`);
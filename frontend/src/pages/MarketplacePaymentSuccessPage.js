@@ -1,5 +1,6 @@
 import { useState, useEffect } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
+import { io } from 'socket.io-client';
 import Navbar from '@/components/Navbar';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
@@ -25,6 +26,31 @@ const MarketplacePaymentSuccessPage = () => {
     }
   }, [inquiryId]);
 
+  // The backend pushes the confirmation as soon as the Stripe webhook is processed;
+  // polling below stays as a fallback
+  useEffect(() => {
+    if (!user || !inquiryId) return;
+
+    const socketUrl = BACKEND_URL.replace('/api', '').replace('https://', 'wss://').replace('http://', 'ws://');
+    const socket = io(socketUrl, {
+      transports: ['websocket', 'polling'],
+      withCredentials: true,
+    });
+
+    socket.on('connect', () => {
+      socket.emit('join_room', { user_id: user.user_id });
+    });
+
+    socket.on('payment_confirmed', (data) => {
+      if (data.inquiry_id === inquiryId) {
+        setPaymentData(prev => ({ ...prev, ...data, paid: true }));
+        setStatus('success');
+      }
+    });
+
+    return () => socket.disconnect();
+  }, [user, inquiryId, BACKEND_URL]);
+
   const checkAuth = async () => {
     try {
       const response = await fetch(`${BACKEND_URL}/api/auth/me`, {
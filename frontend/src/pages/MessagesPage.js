@@ -1,6 +1,7 @@
 import { useState, useEffect, useRef, useCallback } from 'react';
 import { useSearchParams } from 'react-router-dom';
 import { io } from 'socket.io-client';
+import msgpackParser from 'socket.io-msgpack-parser';
 import Navbar from '@/components/Navbar';
 import MobileNav from '@/components/MobileNav';
 import ProtectedRoute from '@/components/ProtectedRoute';
@@ -24,10 +25,16 @@ const MessagesPage = () => {
   const [pendingAttachments, setPendingAttachments] = useState([]);
   const [isTyping, setIsTyping] = useState(false);
   const [otherUserTyping, setOtherUserTyping] = useState(false);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
   const socketRef = useRef(null);
   const typingTimeoutRef = useRef(null);
+  const syncCursorRef = useRef(null);
+  // Set once the first sync has returned a starting cursor
+  const syncInitializedRef = useRef(false);
+  const selectedUserRef = useRef(null);
   const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
   // Initialize Socket.IO connection
@@ -38,11 +45,16 @@ const MessagesPage = () => {
     socketRef.current = io(socketUrl, {
       transports: ['websocket', 'polling'],
       withCredentials: true,
+      // Compact binary frames; the server keeps JSON for clients without it
+      parser: msgpackParser,
+      query: { serializer: 'msgpack' },
     });
 
     socketRef.current.on('connect', () => {
       console.log('Socket connected');
       socketRef.current.emit('join_room', { user_id: user.user_id });
+      // Catch up on what was missed while disconnected
+      syncMessages();
     });
 
     socketRef.current.on('new_message', (msg) => {
@@ -88,6 +100,44 @@ const MessagesPage = () => {
     };
   }, [user, BACKEND_URL]);
 
+  // Delta sync: fetch only the messages after the last sync cursor
+  const syncMessages = async () => {
+    try {
+      const initialized = syncInitializedRef.current;
+      let hasMore = true;
+      const received = [];
+      while (hasMore) {
+        const params = initialized && syncCursorRef.current
+          ? `?since=${encodeURIComponent(syncCursorRef.current)}`
+          : '';
+        const response = await fetch(`${BACKEND_URL}/api/messages/sync${params}`, {
+          credentials: 'include',
+        });
+        if (!response.ok) return;
+        const data = await response.json();
+        syncCursorRef.current = data.cursor;
+        syncInitializedRef.current = true;
+        received.push(...data.messages);
+        hasMore = data.has_more;
+      }
+      if (!initialized || received.length === 0) return;
+
+      const current = selectedUserRef.current;
+      if (current) {
+        const threadMessages = received.filter(m =>
+          m.sender_id === current.user_id || m.receiver_id === current.user_id
+        );
+        setMessages(prev => {
+          const known = new Set(prev.map(m => m.message_id));
+          return [...prev, ...threadMessages.filter(m => !known.has(m.message_id))];
+        });
+      }
+      refreshConversations();
+    } catch (error) {
+      console.error('Error syncing messages:', error);
+    }
+  };
+
   const refreshConversations = async () => {
     try {
       const convRes = await fetch(`${BACKEND_URL}/api/messages/conversations`, {
@@ -208,6 +258,7 @@ const MessagesPage = () => {
 
   // Fetch messages when selecting a user
   useEffect(() => {
+    selectedUserRef.current = selectedUser;
     if (selectedUser) {
       fetchMessages();
       // Mark messages as read
@@ -236,11 +287,30 @@ const MessagesPage = () => {
       });
       const data = await response.json();
       setMessages(data);
+      setOlderCursor(response.headers.get('X-Next-Cursor'));
     } catch (error) {
       console.error('Error fetching messages:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!selectedUser || !olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const response = await fetch(
+        `${BACKEND_URL}/api/messages/${selectedUser.user_id}?before=${encodeURIComponent(olderCursor)}`,
+        { credentials: 'include' }
+      );
+      const data = await response.json();
+      setMessages(prev => [...data, ...prev]);
+      setOlderCursor(response.headers.get('X-Next-Cursor'));
+    } catch (error) {
+      console.error('Error fetching older messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   // Handle typing indicator
   const handleTyping = useCallback(() => {
     if (!socketRef.current || !selectedUser || !user) return;
@@ -529,6 +599,19 @@ const MessagesPage = () => {
 
                       {/* Messages */}
                       <div className="flex-1 p-4 overflow-y-auto space-y-4">
+                        {olderCursor && (
+                          <div className="text-center">
+                            <Button
+                              variant="ghost"
+                              size="sm"
+                              onClick={loadOlderMessages}
+                              disabled={loadingOlder}
+                              data-testid="load-older-messages"
+                            >
+                              {loadingOlder ? 'Chargement...' : 'Messages précédents'}
+                            </Button>
+                          </div>
+                        )}
                         {messages.length === 0 ? (
                           <div className="text-center py-12">
                             <MessageCircle className="h-16 w-16 mx-auto text-muted-foreground/30 mb-4" />
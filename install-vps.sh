@@ -85,6 +85,9 @@ MONGO_URL="mongodb://localhost:27017"
 DB_NAME="lumiere_events"
 CORS_ORIGINS="https://${DOMAIN},https://www.${DOMAIN}"
 STRIPE_API_KEY=${STRIPE_KEY}
+# Socket.IO partagé entre les workers uvicorn (pas de sessions collantes)
+SOCKETIO_MESSAGE_QUEUE="mongo"
+SOCKETIO_TRANSPORTS="websocket"
 EOF
 
 # Créer le dossier uploads
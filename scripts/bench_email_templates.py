@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Render benchmark of the email templates (backend/email_templates.py).
+
+Renders the new booking email --renders times:
+- the previous f-string body concatenated with the header/footer helpers
+  (HTML only, no escaping)
+- the Jinja2 template recompiled on every render (no template cache)
+- email_templates.render: compiled once, pre-rendered layout, HTML plus the
+  plain-text alternative
+
+Usage:
+    python scripts/bench_email_templates.py --renders 20000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from jinja2 import Environment, FileSystemLoader, select_autoescape  # noqa: E402
+
+import email_templates  # noqa: E402
+
+BOOKING = {
+    "client_name": "Camille <Martin>",
+    "event_type": "Mariage",
+    "event_date": "2026-06-14",
+    "location": "Aix-en-Provence",
+    "amount": 1850,
+}
+
+
+def legacy_header():
+    return """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>
+            body { font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }
+            .container { max-width: 600px; margin: 0 auto; }
+            .header { background: linear-gradient(135deg, #D4AF37, #B8860B); padding: 30px; text-align: center; }
+            .content { background: #ffffff; padding: 30px; }
+            .highlight-box { background: #f8f9fa; border-left: 4px solid #D4AF37; padding: 15px; margin: 20px 0; }
+            .footer { background: #f8f9fa; padding: 20px; text-align: center; font-size: 12px; color: #666; }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>✨ Je Suis</h1>
+                <p>Votre plateforme événementielle</p>
+            </div>
+            <div class="content">
+    """
+
+
+def legacy_footer():
+    return """
+            </div>
+            <div class="footer">
+                <p>📩 <a href="mailto:contact@creativindustry.com">contact@creativindustry.com</a></p>
+                <p>© 2025 Je Suis - Tous droits réservés</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def legacy(provider_name, booking_data):
+    return legacy_header() + f"""
+    <h2>Nouvelle demande de réservation ! 🎉</h2>
+    <p>Bonjour {provider_name},</p>
+    <div class="highlight-box">
+        <ul>
+            <li><strong>Client :</strong> {booking_data.get('client_name', 'N/A')}</li>
+            <li><strong>Événement :</strong> {booking_data.get('event_type', 'N/A')}</li>
+            <li><strong>Date :</strong> {booking_data.get('event_date', 'N/A')}</li>
+            <li><strong>Lieu :</strong> {booking_data.get('location', 'N/A')}</li>
+            <li><strong>Montant :</strong> {booking_data.get('amount', 0)}€</li>
+        </ul>
+    </div>
+    <p style="text-align: center;">
+        <a href="https://events.creativindustry.cloud/dashboard" class="button">Voir la demande</a>
+    </p>
+    """ + legacy_footer()
+
+
+def timed(label, render, renders):
+    started = time.perf_counter()
+    for _ in range(renders):
+        render()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {elapsed / renders * 1e6:8.1f}µs/render  {renders / elapsed:>9,.0f} renders/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=20000)
+    parser.add_argument("--uncached-renders", type=int, default=500,
+                        help="renders with a recompile each time (slow)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    email_templates.load()
+    print(f"load (compile all templates, pre-render layouts): {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    uncached = Environment(
+        loader=FileSystemLoader(str(email_templates.TEMPLATE_DIR)),
+        autoescape=select_autoescape(["html"]),
+        cache_size=0,
+    )
+    uncached.filters.update(email_templates._env.filters)
+    uncached.globals.update(email_templates._env.globals)
+
+    timed("f-string + header/footer (html)", lambda: legacy("Studio Lumière", BOOKING), args.renders)
+    timed("jinja, recompiled (html)",
+          lambda: uncached.get_template("new_booking.html").render(provider_name="Studio Lumière", booking=BOOKING),
+          args.uncached_renders)
+    timed("email_templates (html only)",
+          lambda: email_templates._env.get_template("new_booking.html").render(
+              provider_name="Studio Lumière", booking=BOOKING),
+          args.renders)
+    timed("email_templates.render (html+text)",
+          lambda: email_templates.render("new_booking.html", provider_name="Studio Lumière", booking=BOOKING),
+          args.renders)
+
+
+if __name__ == "__main__":
+    main()
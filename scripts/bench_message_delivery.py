@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Delivery latency benchmark for real-time messages (backend/server.py socket
+handlers + backend/message_pipeline.py).
+
+Serves the backend's Socket.IO app in-process, connects --users clients with
+real sessions, and has them send messages to each other at --rate messages/s.
+Latency is measured from the sender's emit to the receiver's new_message
+event. Post-processing (conversation summary, moderation) goes through the
+message pipeline; --no-workers runs it inline in the socket handler after the
+emit, which is the pipeline's fallback when its queue is full.
+
+Uses a throwaway database (dropped at the end):
+    MONGO_URL=mongodb://localhost:27017 python scripts/bench_message_delivery.py \
+        --users 200 --messages 5000 --rate 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+os.environ.setdefault("DB_NAME", f"bench_delivery_{uuid.uuid4().hex[:6]}")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+import message_pipeline  # noqa: E402
+import server  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def seed(db, users: int):
+    now = datetime.now(timezone.utc)
+    user_ids = [f"bench_user_{i}" for i in range(users)]
+    await db.users.insert_many([
+        {"user_id": user_id, "email": f"{user_id}@bench.local", "name": user_id,
+         "user_type": "client", "created_at": now.isoformat()}
+        for user_id in user_ids
+    ])
+    await db.user_sessions.insert_many([
+        {"user_id": user_id, "session_token": f"token_{user_id}",
+         "expires_at": (now + timedelta(hours=1)).isoformat(), "created_at": now.isoformat()}
+        for user_id in user_ids
+    ])
+    await db.moderation_config.insert_one({
+        "type": "keywords", "enabled": True, "keywords": ["arnaque", "whatsapp", "virement"]
+    })
+    return user_ids
+
+
+async def run(args):
+    import socketio
+    import uvicorn
+
+    db = server.db
+    user_ids = await seed(db, args.users)
+    if not args.no_workers:
+        message_pipeline.start_workers()
+
+    config = uvicorn.Config(server.socket_app, host="127.0.0.1", port=args.port,
+                            lifespan="off", log_level="warning")
+    http = uvicorn.Server(config)
+    serve_task = asyncio.create_task(http.serve())
+    while not http.started:
+        await asyncio.sleep(0.05)
+
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def on_message(data):
+        started = sent_at.pop(data["content"], None)
+        if started is not None:
+            latencies.append(time.perf_counter() - started)
+            if len(latencies) >= args.messages:
+                done.set()
+
+    clients = []
+    try:
+        for user_id in user_ids:
+            client = socketio.AsyncClient()
+            client.on("new_message", on_message)
+            await client.connect(f"http://127.0.0.1:{args.port}", transports=["websocket"],
+                                 auth={"token": f"token_{user_id}"})
+            clients.append(client)
+
+        interval = 1 / args.rate
+        started = time.perf_counter()
+        for n in range(args.messages):
+            sender, receiver = random.sample(range(len(clients)), 2)
+            key = f"bench message {n}"
+            sent_at[key] = time.perf_counter()
+            await clients[sender].emit("send_message", {
+                "receiver_id": user_ids[receiver],
+                "content": key
+            })
+            delay = started + (n + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+
+        print(f"mode: {'inline post-processing' if args.no_workers else 'message pipeline'}")
+        print(f"delivered {len(latencies)}/{args.messages} messages in {elapsed:.2f}s "
+              f"({len(latencies) / elapsed:.0f}/s)")
+        if latencies:
+            print(f"delivery latency p50 {statistics.median(latencies) * 1000:.1f}ms  "
+                  f"p95 {percentile(latencies, 0.95) * 1000:.1f}ms  "
+                  f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+        await message_pipeline.stop_workers()
+        print(f"pipeline: {message_pipeline.stats()}")
+        summaries = await db.conversations.count_documents({})
+        print(f"conversation summaries: {summaries}")
+    finally:
+        for client in clients:
+            await client.disconnect()
+        http.should_exit = True
+        await serve_task
+        await server.client.drop_database(os.environ["DB_NAME"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=500, help="messages per second")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--no-workers", action="store_true", help="run post-processing inline")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of the moderation keyword matcher (backend/moderation.py).
+
+Builds the Aho-Corasick matcher from --keywords generated keywords plus the
+default list, then scans --messages chat messages. A quarter of the messages
+contain a keyword, half of those disguised (accents, leetspeak, inserted
+punctuation or spacing). The previous per-keyword `keyword in content` loop
+runs on the same messages for comparison.
+
+Usage:
+    python scripts/bench_moderation.py --keywords 5000 --messages 20000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from moderation import DEFAULT_FLAGGED_KEYWORDS, KeywordMatcher  # noqa: E402
+
+SYLLABLES = ["ba", "ché", "do", "fra", "gu", "li", "mon", "pé", "ri", "sa", "tou", "vé", "zin", "que", "tre"]
+FILLER = ("bonjour je voudrais savoir si vous êtes disponible le samedi pour un mariage "
+          "de cent vingt personnes avec un photographe et un traiteur merci beaucoup").split()
+
+
+def make_keywords(count: int):
+    keywords = set()
+    while len(keywords) < count:
+        keywords.add("".join(random.choice(SYLLABLES) for _ in range(random.randint(3, 5))))
+    return sorted(keywords)
+
+
+def disguise(keyword: str) -> str:
+    style = random.choice(("upper", "leet", "dots", "spaces"))
+    if style == "upper":
+        return keyword.upper()
+    if style == "leet":
+        return keyword.replace("e", "3").replace("a", "4").replace("o", "0").replace("i", "1")
+    if style == "dots":
+        return ".".join(keyword)
+    return " ".join(keyword)
+
+
+def make_messages(count: int, keywords):
+    messages, planted = [], []
+    for _ in range(count):
+        words = random.choices(FILLER, k=random.randint(10, 40))
+        keyword = None
+        if random.random() < 0.25:
+            keyword = random.choice(keywords)
+            word = disguise(keyword) if random.random() < 0.5 else keyword
+            words.insert(random.randrange(len(words) + 1), word)
+        messages.append(" ".join(words))
+        planted.append(keyword)
+    return messages, planted
+
+
+def naive(keywords, content: str):
+    content = content.lower()
+    return [keyword for keyword in keywords if keyword.lower() in content]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keywords", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--naive-messages", type=int, default=2000,
+                        help="messages scanned by the per-keyword loop (slow)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    keywords = DEFAULT_FLAGGED_KEYWORDS + make_keywords(args.keywords)
+    messages, planted = make_messages(args.messages, keywords)
+    size = sum(len(m.encode()) for m in messages)
+
+    started = time.perf_counter()
+    matcher = KeywordMatcher(keywords)
+    build = time.perf_counter() - started
+    print(f"{len(keywords):,} keywords -> {len(matcher._goto):,} automaton states, built in {build * 1000:.0f}ms")
+
+    started = time.perf_counter()
+    results = [matcher.find(message) for message in messages]
+    elapsed = time.perf_counter() - started
+    caught = sum(1 for keyword, found in zip(planted, results) if keyword and keyword in found)
+    print(f"automaton: {len(messages) / elapsed:>10,.0f} msg/s  {size / elapsed / 1e6:6.2f} MB/s  "
+          f"caught {caught}/{sum(1 for k in planted if k)} planted keywords")
+
+    sample = messages[:args.naive_messages]
+    started = time.perf_counter()
+    naive_results = [naive(keywords, message) for message in sample]
+    elapsed = time.perf_counter() - started
+    naive_caught = sum(1 for keyword, found in zip(planted, naive_results) if keyword and keyword in found)
+    sample_planted = sum(1 for k in planted[:len(sample)] if k)
+    print(f"naive loop: {len(sample) / elapsed:>9,.0f} msg/s  "
+          f"caught {naive_caught}/{sample_planted} planted keywords (first {len(sample):,} messages)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the socket presence registry (backend/realtime.py).
+
+Connects --sockets sockets spread over users with one to three devices each,
+then runs connect/disconnect churn and online-status queries against
+PresenceRegistry. The previous {user_id: sid} dict with a linear scan on
+disconnect is measured on the same population for comparison.
+
+Usage:
+    python scripts/bench_presence.py --sockets 50000 --churn 200000
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from realtime import PresenceRegistry  # noqa: E402
+
+
+def population(sockets: int):
+    """[(sid, user_id)] with 1-3 devices per user"""
+    pairs = []
+    user = 0
+    while len(pairs) < sockets:
+        for device in range(random.choice((1, 1, 2, 3))):
+            pairs.append((f"sid_{user}_{device}", f"user_{user}"))
+        user += 1
+    return pairs[:sockets]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(name, durations):
+    total = sum(durations)
+    print(f"{name:<28} {len(durations) / total:>12,.0f} ops/s   "
+          f"p50 {statistics.median(durations) * 1e6:>8.2f}us   p99 {percentile(durations, 0.99) * 1e6:>8.2f}us")
+
+
+def bench_registry(pairs, churn: int, queries: int):
+    registry = PresenceRegistry()
+    clock = time.perf_counter
+
+    started = clock()
+    for sid, user_id in pairs:
+        registry.add(sid, user_id)
+    print(f"registry: {len(registry):,} sockets / {registry.user_count:,} users connected "
+          f"in {(clock() - started) * 1000:.0f}ms")
+
+    # Churn: a random socket drops and reconnects under a new sid
+    live = [sid for sid, _ in pairs]
+    owner = dict(pairs)
+    disconnects, connects = [], []
+    for n in range(churn):
+        i = random.randrange(len(live))
+        sid = live[i]
+        user_id = owner.pop(sid)
+
+        t = clock()
+        registry.remove(sid)
+        disconnects.append(clock() - t)
+
+        new_sid = f"sid_churn_{n}"
+        t = clock()
+        registry.add(new_sid, user_id)
+        connects.append(clock() - t)
+
+        live[i] = new_sid
+        owner[new_sid] = user_id
+
+    users = list(set(owner.values()))
+    batches = [random.sample(users, 50) for _ in range(queries)]
+    lookups = []
+    for batch in batches:
+        t = clock()
+        registry.online(batch)
+        lookups.append(clock() - t)
+
+    assert len(registry) == len(pairs)
+    report("registry disconnect", disconnects)
+    report("registry connect", connects)
+    report("registry online(50 users)", lookups)
+
+
+def bench_legacy(pairs, churn: int):
+    """Previous approach: {user_id: sid}, disconnect scans the whole dict"""
+    connected_users = {}
+    for sid, user_id in pairs:
+        connected_users[user_id] = sid  # later devices overwrite earlier ones
+    print(f"legacy: {len(connected_users):,} entries for {len(pairs):,} sockets "
+          f"({len(pairs) - len(connected_users):,} devices invisible)")
+
+    sids = list(connected_users.values())
+    disconnects = []
+    for n in range(churn):
+        sid = random.choice(sids)
+        t = time.perf_counter()
+        user_to_remove = None
+        for user_id, s in connected_users.items():
+            if s == sid:
+                user_to_remove = user_id
+                break
+        if user_to_remove:
+            del connected_users[user_to_remove]
+        disconnects.append(time.perf_counter() - t)
+        connected_users[user_to_remove] = sid  # reconnect
+    report("legacy disconnect (scan)", disconnects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=50000)
+    parser.add_argument("--churn", type=int, default=200000, help="disconnect/reconnect cycles")
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--legacy-churn", type=int, default=2000,
+                        help="cycles for the linear-scan baseline (slow)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    pairs = population(args.sockets)
+    bench_registry(pairs, args.churn, args.queries)
+    if args.legacy_churn:
+        bench_legacy(pairs, args.legacy_churn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of the pooled SMTP transport (backend/smtp_transport.py)
+against a local SMTP sink.
+
+Starts an aiosmtpd server that accepts AUTH and discards the mail, then sends
+--emails messages with --concurrency concurrent senders, first with
+aiosmtplib.send (a new session per email, as before), then through the pool.
+--latency adds a delay to every SMTP reply from the sink to mimic a remote
+server; session setup (greeting, EHLO, AUTH) costs several round trips.
+
+Needs aiosmtpd (pip install aiosmtpd):
+    python scripts/bench_smtp.py --emails 300 --concurrency 3 --latency 0.01
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+import warnings
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from pathlib import Path
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult, SMTP
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+import smtp_transport  # noqa: E402
+
+
+class Sink:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+class SlowSMTP(SMTP):
+    """aiosmtpd server that waits `latency` seconds before every reply"""
+    latency = 0.0
+
+    async def push(self, status):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await super().push(status)
+
+
+class SinkController(Controller):
+    def factory(self):
+        return SlowSMTP(self.handler, **self.SMTP_kwargs)
+
+
+def make_message(n: int):
+    message = MIMEMultipart("alternative")
+    message["From"] = "infos@bench.local"
+    message["To"] = f"user{n}@bench.local"
+    message["Subject"] = f"Nouveau message {n}"
+    message.attach(MIMEText("<p>Bonjour, vous avez un nouveau message.</p>" * 20, "html"))
+    return message
+
+
+async def run_senders(send, emails: int, concurrency: int) -> float:
+    queue = list(range(emails))
+
+    async def worker():
+        while queue:
+            await send(make_message(queue.pop()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def run(args):
+    handler = Sink()
+    SlowSMTP.latency = args.latency
+    controller = SinkController(
+        handler, hostname="127.0.0.1", port=args.port,
+        auth_require_tls=False,
+        authenticator=lambda server, session, envelope, mechanism, auth_data: AuthResult(
+            success=True, auth_data=auth_data),
+    )
+    controller.start()
+    config = {
+        "smtp_host": "127.0.0.1", "smtp_port": args.port, "smtp_user": "bench",
+        "smtp_password": "bench", "start_tls": False,
+    }
+    try:
+        async def per_email(message):
+            await aiosmtplib.send(message, hostname="127.0.0.1", port=args.port,
+                                  username="bench", password="bench", start_tls=False)
+
+        elapsed = await run_senders(per_email, args.emails, args.concurrency)
+        print(f"session per email: {args.emails / elapsed:8.1f} emails/s  ({args.emails} sessions)")
+
+        smtp_transport.POOL_SIZE = args.pool_size
+        async def pooled(message):
+            await smtp_transport.send_message(message, config)
+
+        elapsed = await run_senders(pooled, args.emails, args.concurrency)
+        stats = smtp_transport.stats()
+        print(f"pooled transport:  {args.emails / elapsed:8.1f} emails/s  "
+              f"({stats['connections_opened']} sessions, pool of {args.pool_size})")
+        await smtp_transport.close()
+        print(f"sink received {handler.received} emails")
+    finally:
+        controller.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--pool-size", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each SMTP reply")
+    parser.add_argument("--port", type=int, default=8825)
+    args = parser.parse_args()
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    warnings.simplefilter("ignore")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Wire size and CPU cost of the Socket.IO serializers (backend/realtime.py).
+
+Encodes and decodes the chat events (new_message, message_sent,
+messages_read, user_typing) with the default JSON packet and with msgpack,
+each raw and through a permessage-deflate stream (raw deflate with context
+takeover, as negotiated by uvicorn). Also times the per-broadcast transcode
+from JSON to msgpack that NegotiatingServer does once per packet, for
+--fanout recipients.
+
+Usage:
+    python scripts/bench_socketio_serializer.py --messages 20000 --fanout 200
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from socketio import packet  # noqa: E402
+from socketio.msgpack_packet import MsgPackPacket  # noqa: E402
+
+import realtime  # noqa: E402
+
+WORDS = ("bonjour merci pour votre devis est-ce que la date du samedi 14 juin est encore "
+         "disponible nous serons environ cent vingt invités au domaine").split()
+
+
+def make_events(count: int):
+    events = []
+    for n in range(count):
+        sender, receiver = f"user_{uuid.uuid4().hex[:12]}", f"user_{uuid.uuid4().hex[:12]}"
+        kind = random.choices(("new_message", "message_sent", "messages_read", "user_typing"),
+                              weights=(45, 30, 10, 15))[0]
+        if kind in ("new_message", "message_sent"):
+            data = {
+                "message_id": f"msg_{uuid.uuid4().hex[:12]}",
+                "sender_id": sender,
+                "receiver_id": receiver,
+                "content": " ".join(random.choices(WORDS, k=random.randint(3, 30))),
+                "attachments": [],
+                "read": False,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+        elif kind == "messages_read":
+            data = {"reader_id": receiver, "sender_id": sender}
+        else:
+            data = {"sender_id": sender, "is_typing": n % 2 == 0}
+        events.append([kind, data])
+    return events
+
+
+def deflated(frames):
+    """Total size of the frames through one permessage-deflate stream"""
+    stream = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    total = 0
+    for frame in frames:
+        if isinstance(frame, str):
+            frame = frame.encode()
+        # RFC 7692: flush each message and drop the trailing 00 00 ff ff
+        total += len(stream.compress(frame) + stream.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+
+def measure(name, packet_class, events):
+    started = time.perf_counter()
+    frames = [packet_class(packet.EVENT, data=event).encode() for event in events]
+    encode = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for frame in frames:
+        packet_class(encoded_packet=frame)
+    decode = time.perf_counter() - started
+
+    raw = sum(len(f.encode() if isinstance(f, str) else f) for f in frames)
+    started = time.perf_counter()
+    compressed = deflated(frames)
+    deflate = time.perf_counter() - started
+
+    count = len(events)
+    print(f"{name:<8} {raw / count:>7.1f} B/msg raw  {compressed / count:>6.1f} B/msg deflated  "
+          f"encode {encode / count * 1e6:5.2f}µs  decode {decode / count * 1e6:5.2f}µs  "
+          f"deflate {deflate / count * 1e6:5.2f}µs")
+    return raw, compressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--fanout", type=int, default=200,
+                        help="recipients of one broadcast for the transcode timing")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    events = make_events(args.messages)
+    json_raw, json_deflated = measure("json", packet.Packet, events)
+    msgpack_raw, msgpack_deflated = measure("msgpack", MsgPackPacket, events)
+    print(f"msgpack saves {1 - msgpack_raw / json_raw:.0%} raw, "
+          f"{1 - msgpack_deflated / json_deflated:.0%} deflated "
+          f"(deflate alone saves {1 - json_deflated / json_raw:.0%} on JSON)")
+
+    # Broadcast path: the JSON packet is encoded once by the manager, then
+    # transcoded once for all msgpack recipients instead of once per socket
+    server = realtime.NegotiatingServer(async_mode="asgi")
+    sample = [packet.Packet(packet.EVENT, data=event).encode() for event in events[:2000]]
+    started = time.perf_counter()
+    for json_frame in sample:
+        server._as_msgpack(server.packet_class(encoded_packet=json_frame))
+    once = (time.perf_counter() - started) / len(sample)
+    print(f"transcode per broadcast {once * 1e6:.2f}µs "
+          f"(vs {once * args.fanout * 1e3:.2f}ms if repeated for {args.fanout} recipients)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Load test for the Stripe webhook pipeline (backend/payment_events.py).
+
+The in-process fake payment gateway creates checkout sessions and emits
+checkout.session.completed events, which go through the same webhook
+parsing as production. Every event is delivered several times
+concurrently, status polls race with the webhook worker, and the script then
+checks that each payment was credited to its booking exactly once.
+
+Usage:
+    MONGO_URL=mongodb://localhost:27017 python scripts/load_test_stripe_webhooks.py \
+        --bookings 200 --payments 2 --duplicates 5 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+import conversations  # noqa: E402
+import payment_events  # noqa: E402
+import rollups  # noqa: E402
+from payment_gateway import FakePaymentGateway  # noqa: E402
+
+
+async def seed(db, gateway: FakePaymentGateway, bookings: int, payments: int):
+    """Create bookings and pending transactions. Returns (events, expected deposits)."""
+    now = datetime.now(timezone.utc).isoformat()
+    events = []
+    expected = {}
+
+    await db.users.insert_one({"user_id": "user_loadtest", "name": "Load Test", "created_at": now})
+    await db.provider_profiles.insert_one({"provider_id": "provider_loadtest", "user_id": "user_provider_loadtest"})
+
+    for _ in range(bookings):
+        booking_id = f"booking_lt_{uuid.uuid4().hex[:12]}"
+        await db.bookings.insert_one({
+            "booking_id": booking_id,
+            "client_id": "user_loadtest",
+            "provider_id": "provider_loadtest",
+            "event_type": "wedding",
+            "event_date": "2030-01-01",
+            "event_location": "Paris",
+            "status": "confirmed",
+            "total_amount": 1000.0,
+            "deposit_required": 300.0,
+            "deposit_paid": 0.0,
+            "payment_status": "pending",
+            "created_at": now,
+            "updated_at": now
+        })
+        expected[booking_id] = 0.0
+
+        for _ in range(payments):
+            amount = float(random.choice([100, 150, 300]))
+            transaction_id = f"txn_{uuid.uuid4().hex[:12]}"
+            metadata = {"booking_id": booking_id, "transaction_id": transaction_id}
+            session = await gateway.create_checkout_session(
+                amount=amount,
+                currency="eur",
+                success_url="http://localhost/payment/success?session_id={CHECKOUT_SESSION_ID}",
+                cancel_url="http://localhost/dashboard",
+                metadata=metadata
+            )
+            session_id = session.session_id
+            await db.payment_transactions.insert_one({
+                "transaction_id": transaction_id,
+                "booking_id": booking_id,
+                "user_id": "user_loadtest",
+                "session_id": session_id,
+                "amount": amount,
+                "currency": "eur",
+                "payment_type": "deposit",
+                "payment_status": "pending",
+                "metadata": metadata,
+                "created_at": now,
+                "updated_at": now
+            })
+            expected[booking_id] += amount
+            events.append(json.dumps(gateway.complete_session(session_id)).encode())
+
+    return events, expected
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[os.environ.get("DB_NAME", "stripe_webhook_loadtest")]
+    for module in (payment_events, conversations, rollups):
+        module.get_db = lambda: db
+
+    # Count confirmation pushes instead of emitting on the Socket.IO server
+    pushes = []
+
+    async def record_push(user_id, payload):
+        pushes.append(payload["session_id"])
+    payment_events.notify_payment_confirmed = record_push
+
+    for collection in ("users", "provider_profiles", "bookings", "payment_transactions", "stripe_events", "messages",
+                       "conversations", "daily_stats", "monthly_stats"):
+        await db[collection].delete_many({})
+    await payment_events.ensure_indexes()
+
+    gateway = FakePaymentGateway()
+    bodies, expected = await seed(db, gateway, args.bookings, args.payments)
+    events = [await gateway.handle_webhook(body, None) for body in bodies]
+    print(f"Seeded {len(expected)} bookings, {len(events)} paid sessions")
+
+    deliveries = [e for e in events for _ in range(args.duplicates)]
+    random.shuffle(deliveries)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        payment_events.record_webhook_event(e.event_id, e.event_type, e.session_id, e.payment_status, e.metadata)
+        for e in deliveries
+    ])
+    ack_elapsed = time.perf_counter() - start
+    print(f"Acknowledged {len(deliveries)} deliveries in {ack_elapsed:.2f}s "
+          f"({len(deliveries) / ack_elapsed:.0f}/s), {sum(results)} new events")
+
+    # Status polls racing with the workers
+    polls = [payment_events.apply_booking_payment(e.session_id) for e in random.sample(events, len(events) // 2)]
+    workers = [payment_events.process_pending_events() for _ in range(args.workers)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*polls, *workers)
+    apply_elapsed = time.perf_counter() - start
+    print(f"Applied {len(events)} events in {apply_elapsed:.2f}s ({len(events) / apply_elapsed:.0f}/s)")
+
+    errors = 0
+    async for booking in db.bookings.find({}, {"_id": 0, "booking_id": 1, "deposit_paid": 1}):
+        if abs(booking["deposit_paid"] - expected[booking["booking_id"]]) > 0.001:
+            errors += 1
+            print(f"  MISMATCH {booking['booking_id']}: {booking['deposit_paid']} != {expected[booking['booking_id']]}")
+
+    stored = await db.stripe_events.count_documents({})
+    processed = await db.stripe_events.count_documents({"status": "processed"})
+    notifications = await db.messages.count_documents({})
+    print(f"Stored events: {stored} (expected {len(events)}), processed: {processed}")
+    print(f"Provider notifications: {notifications} (expected {len(events)})")
+    print(f"Payment confirmations pushed: {len(pushes)} (expected {len(events)})")
+    print("OK - every payment applied exactly once" if errors == 0 else f"FAILED - {errors} bookings mismatched")
+
+    client.close()
+    return 0 if errors == 0 and stored == len(events) and len(pushes) == len(events) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=2, help="payments per booking")
+    parser.add_argument("--duplicates", type=int, default=5, help="deliveries per Stripe event")
+    parser.add_argument("--workers", type=int, default=4)
+    sys.exit(asyncio.run(main(parser.parse_args())))
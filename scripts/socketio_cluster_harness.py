@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Multi-process harness for the Socket.IO message queue (backend/realtime.py).
+
+Starts a minimal Redis-compatible pub/sub server in-process (SUBSCRIBE /
+PUBLISH only, enough for socketio.AsyncRedisManager), spawns several uvicorn
+workers serving a Socket.IO app built with realtime.create_server(), connects
+clients to every worker and has each client send messages to users connected
+to the other workers. Exits non-zero if any message is lost.
+
+Usage:
+    python scripts/socketio_cluster_harness.py --workers 3 --clients 20 --messages 10
+    python scripts/socketio_cluster_harness.py --no-queue   # in-memory manager: cross-worker messages are lost
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+# ============ REDIS STAND-IN ============
+
+class PubSubServer:
+    """Just enough of the RESP2 protocol for Redis pub/sub clients"""
+
+    def __init__(self):
+        self.channels = {}  # channel -> set of writers
+        self.connections = {}  # writer -> handler task
+        self.server = None
+        self.published = 0
+
+    @staticmethod
+    def encode(value) -> bytes:
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, (list, tuple)):
+            return b"*%d\r\n" % len(value) + b"".join(PubSubServer.encode(v) for v in value)
+        if isinstance(value, str):
+            value = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    @staticmethod
+    async def read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()  # inline command
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name = command[0].upper()
+                if name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(self.encode([b"subscribe", channel, len(subscribed)]))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscribed):
+                        self.channels.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(self.encode([b"unsubscribe", channel, len(subscribed)]))
+                elif name == b"PUBLISH":
+                    channel, payload = command[1], command[2]
+                    receivers = list(self.channels.get(channel, ()))
+                    for receiver in receivers:
+                        receiver.write(self.encode([b"message", channel, payload]))
+                    self.published += 1
+                    writer.write(self.encode(len(receivers)))
+                elif name == b"PING":
+                    if subscribed:
+                        writer.write(self.encode([b"pong", command[1] if len(command) > 1 else b""]))
+                    else:
+                        writer.write(b"+PONG\r\n")
+                else:
+                    # CLIENT SETINFO, SELECT, ... from connection setup
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    async def start(self, port: int):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+
+    async def stop(self):
+        self.server.close()
+        tasks = list(self.connections.values())
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+
+# ============ WORKER ============
+
+def serve_worker(port: int):
+    """Socket.IO app of one worker process (run with --serve)"""
+    import uvicorn
+    import socketio
+    import realtime
+
+    sio = realtime.create_server()
+
+    @sio.event
+    async def join_room(sid, data):
+        await sio.enter_room(sid, data["user_id"])
+        return True
+
+    @sio.event
+    async def send_message(sid, data):
+        await sio.emit("new_message", data, room=data["receiver_id"])
+
+    app = socketio.ASGIApp(sio)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# ============ DRIVER ============
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_port(port: int, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} did not start")
+
+
+async def run(args):
+    import socketio
+
+    queue_port = free_port()
+    pubsub = PubSubServer()
+    await pubsub.start(queue_port)
+
+    env = dict(os.environ, SOCKETIO_TRANSPORTS="websocket")
+    if not args.no_queue:
+        env["SOCKETIO_MESSAGE_QUEUE"] = f"redis://127.0.0.1:{queue_port}/0"
+    else:
+        env.pop("SOCKETIO_MESSAGE_QUEUE", None)
+
+    ports = [free_port() for _ in range(args.workers)]
+    processes = [
+        subprocess.Popen([sys.executable, __file__, "--serve", str(port)], env=env)
+        for port in ports
+    ]
+    clients = []
+    try:
+        for port in ports:
+            await wait_for_port(port)
+
+        received = {}
+        done = asyncio.Event()
+        expected = args.workers * args.clients * args.messages
+
+        def make_client(user_id):
+            client = socketio.AsyncClient()
+
+            @client.on("new_message")
+            async def on_message(data):
+                assert data["receiver_id"] == user_id
+                received[data["message_id"]] = time.perf_counter() - data["sent_at"]
+                if len(received) >= expected:
+                    done.set()
+
+            return client
+
+        users = []  # (worker index, user_id, client)
+        for w, port in enumerate(ports):
+            for i in range(args.clients):
+                user_id = f"user_{w}_{i}"
+                client = make_client(user_id)
+                await client.connect(f"http://127.0.0.1:{port}", transports=["websocket"])
+                await client.call("join_room", {"user_id": user_id})
+                users.append((w, user_id, client))
+                clients.append(client)
+        await asyncio.sleep(0.5)  # let every worker's listener subscribe
+
+        async def send(client, sender_id, receiver_id, n):
+            await client.emit("send_message", {
+                "message_id": f"{sender_id}_{n}",
+                "sender_id": sender_id,
+                "receiver_id": receiver_id,
+                "content": "ping",
+                "sent_at": time.perf_counter()
+            })
+
+        sends = []
+        for w, sender_id, client in users:
+            others = [u for u in users if u[0] != w]
+            for n in range(args.messages):
+                sends.append(send(client, sender_id, random.choice(others)[1], n))
+        started = time.perf_counter()
+        await asyncio.gather(*sends)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+
+        print(f"workers: {args.workers}, clients: {len(users)}, queue: {'off' if args.no_queue else 'redis'}")
+        print(f"cross-worker messages delivered: {len(received)}/{expected} in {elapsed:.2f}s "
+              f"({pubsub.published} published on the queue)")
+        if received:
+            latencies = sorted(received.values())
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f"latency p50: {statistics.median(latencies) * 1000:.1f}ms  p99: {p99 * 1000:.1f}ms")
+        return len(received) == expected
+    finally:
+        for client in clients:
+            await client.disconnect()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        await pubsub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=20, help="clients per worker")
+    parser.add_argument("--messages", type=int, default=10, help="messages per client")
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--no-queue", action="store_true", help="run without the message queue")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_worker(args.serve)
+        return
+
+    ok = asyncio.run(run(args))
+    if args.no_queue:
+        sys.exit(0)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()